@@ -1,2 +1,29 @@
-from .generic import *
-from . import atmel_asf_v3, mbed, stm32f4, generic
\ No newline at end of file
+'''
+    Handler modules are imported on first use, normally by
+    intercepts.get_bp_handler for the classes named in the config, so
+    starting halucinator only loads the handlers (and their dependencies)
+    the config uses.  The generic handlers are also available from here,
+    e.g. halucinator.bp_handlers.ReturnZero.
+'''
+import importlib
+import importlib.util
+from .bp_handler import BPHandler, bp_handler
+
+SUBPACKAGES = ('atmel_asf_v3', 'generic', 'mbed', 'stm32f4')
+
+
+def __getattr__(name):
+    if name in SUBPACKAGES:
+        return importlib.import_module('.' + name, __name__)
+    if name.startswith('__'):
+        raise AttributeError(name)
+    if importlib.util.find_spec('.' + name, __name__) is not None:
+        # A module of this package (e.g. intercepts), the import system
+        # loads it when this fails
+        raise AttributeError(name)
+    generic = importlib.import_module('.generic', __name__)
+    try:
+        return getattr(generic, name)
+    except AttributeError:
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, name))
@@ -3,8 +3,8 @@
 # certain rights in this software.
 
 from ..bp_handler import BPHandler, bp_handler
+from ... import hal_clock
 import logging
-import time
 log = logging.getLogger(__name__)
 
 
@@ -13,7 +13,7 @@ class Contiki(BPHandler):
     def __init__(self, model=None):
         BPHandler.__init__(self)
         self.model = model
-        self.start_time = time.time()
+        self.start_time = hal_clock.now()
         self.ticks_per_second = 128
 
     def register_handler(self, qemu, addr, func_name, ticks_per_second=None):
@@ -23,13 +23,13 @@ class Contiki(BPHandler):
 
     @bp_handler(['clock_time'])
     def clock_time(self, qemu, bp_addr):
-        ticks = time.time() - self.start_time
+        ticks = hal_clock.now() - self.start_time
         ticks = int(ticks * self.ticks_per_second)
         log.debug("#Ticks: %i" % ticks)
         return True, ticks
 
     @bp_handler(['clock_seconds'])
     def clock_seconds(self, qemu, bp_addr):
-        secs = int(time.time() - self.start_time)
+        secs = int(hal_clock.now() - self.start_time)
         log.debug("#Seconds: %i" % secs)
         return True, secs
@@ -4,6 +4,7 @@
 
 from ..intercepts import tx_map, rx_map
 from ..bp_handler import BPHandler, bp_handler
+from ..inline import inline_return
 from collections import defaultdict, deque
 import struct
 import binascii
@@ -30,10 +31,12 @@ class EDBG_Stub(BPHandler):
         return BPHandler.register_handler(self, qemu, addr, func_name)
 
     @bp_handler(['i2c_master_init', 'i2c_master_enable'])
+    @inline_return(None)
     def return_void(self, qemu, bp_addr):
         return True, None
 
     @bp_handler(['i2c_master_write_packet_wait_no_stop'])
+    @inline_return(0)
     def return_ok(self, qemu, bp_addr):
         return True, 0
 
@@ -6,6 +6,7 @@
 from ...peripheral_models.ethernet import EthernetModel
 from ..intercepts import tx_map, rx_map
 from ..bp_handler import BPHandler, bp_handler
+from ... import hal_clock
 from collections import defaultdict, deque
 import struct
 import binascii
@@ -41,7 +42,7 @@ class Ksz8851Eth(BPHandler):
         self.model = model
         self.regs = defaultdict(int)
         self.model.rx_frame_isr = 20
-        self.last_rx_time = time.time()
+        self.last_rx_time = hal_clock.now()
 
     def get_id(self, qemu):
         return 'ksz8851'
@@ -135,13 +136,13 @@ class Ksz8851Eth(BPHandler):
             log.info("Fifo Read, Blocking")
             frame, rx_time = self.model.get_rx_frame(self.get_id(qemu), True)
         log.info("Frame Received: Delay %s, Frame: %s" %
-                 (str(time.time()-rx_time), binascii.hexlify(frame[:10])))
+                 (str(hal_clock.now()-rx_time), binascii.hexlify(frame[:10])))
         buf_ptr = qemu.regs.r0
         length = qemu.regs.r1
         log.info("Reading into: %s, %i" % (hex(buf_ptr), length))
 
-        log.info("Inter Frame Timeing: %f" % (time.time()-self.last_rx_time))
-        self.last_rx_time = time.time()
+        log.info("Inter Frame Timeing: %f" % (hal_clock.now()-self.last_rx_time))
+        self.last_rx_time = hal_clock.now()
         # Frames can have padding to align things in memory add it into
         # front of buffer
         qemu.write_memory(buf_ptr + Ksz8851Eth.PADDING,
@@ -3,10 +3,10 @@
 # certain rights in this software.
 
 
-import IPython
 from ...peripheral_models.ethernet import EthernetModel
 from ..intercepts import tx_map, rx_map
 from ..bp_handler import BPHandler, bp_handler
+from ... import hal_clock
 from collections import defaultdict, deque
 import struct
 import binascii
@@ -23,7 +23,7 @@ class EthernetSmartConnect(BPHandler):
         BPHandler.__init__(self)
         log.debug("Ethernet Smart Connect Init")
         self.model = model
-        self.last_rx_time = time.time()
+        self.last_rx_time = hal_clock.now()
         self.last_exec_time = time.time()
         self.dev_ptr = None
         self.netif_ptr = None
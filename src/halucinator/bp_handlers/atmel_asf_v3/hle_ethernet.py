@@ -3,10 +3,10 @@
 # certain rights in this software.
 
 
-import IPython
 from ...peripheral_models.ethernet import EthernetModel
 from ..intercepts import tx_map, rx_map
 from ..bp_handler import BPHandler, bp_handler
+from ... import hal_clock
 from collections import defaultdict, deque
 import struct
 import binascii
@@ -43,6 +43,7 @@ PBUF_LEN = 10
 PBUF_TYPE = 12
 PBUF_FLAGS = 13
 PBUF_REF = 14
+PBUF_STRUCT_FMT = '<IIHH'  # next, payload, tot_len, len
 
 # Ethernet Types
 ETHTYPE_ARP = 0x0806
@@ -58,7 +59,7 @@ class Ksz8851HLE(BPHandler):
     def __init__(self, model=EthernetModel):
         BPHandler.__init__(self)
         self.model = model
-        self.last_rx_time = time.time()
+        self.last_rx_time = hal_clock.now()
         self.last_exec_time = time.time()
         self.dev_ptr = None
         self.netif_ptr = None
@@ -119,7 +120,7 @@ class Ksz8851HLE(BPHandler):
                 # and this one to be freed by stack
                 qemu.write_memory(self.dev_ptr + DEVICE_RX_PBUF, 4, 0, 1)
 
-                self.last_rx_time = time.time()
+                self.last_rx_time = hal_clock.now()
 
                 # Get payload_ptr
                 payload_ptr = qemu.read_memory(rx_pbuf_ptr+PBUF_PAYLOAD, 4, 1)
@@ -143,7 +144,7 @@ class Ksz8851HLE(BPHandler):
                 self.dev_ptr = None
                 self.netif_ptr = None
                 log.info("Got Frame: LATENCY %f, inter packet time %f" %
-                         (time.time()-rx_time, (time.time() - self.last_rx_time)))
+                         (hal_clock.now()-rx_time, (hal_clock.now() - self.last_rx_time)))
                 log.info("Execution Time rx_packet %f " %
                          (time.time()-start_time))
                 return False, None
@@ -157,20 +158,20 @@ class Ksz8851HLE(BPHandler):
         log.info('In low level output')
         pbuf_free = qemu.avatar.callables['pbuf_free']
         pbuf_ptr = qemu.regs.r1
-        frame_bufs = []
+        payload_regions = []
         p = pbuf_ptr
         # os.system('stty sane') # Make so display works
         # IPython.embed()
         padding = PADDING
         while p != 0:
-            length = qemu.read_memory(p + PBUF_LEN, 2, 1)
-            payload_ptr = qemu.read_memory(p + PBUF_PAYLOAD, 4, 1)
-            frame_bufs.append(qemu.read_memory(
-                payload_ptr + padding, 1, length-padding, raw=True))
+            # next, payload, tot_len, len in a single read
+            next_p, payload_ptr, tot_len, length = qemu.read_struct(
+                p + PBUF_NEXT, PBUF_STRUCT_FMT)
+            payload_regions.append((payload_ptr + padding, length - padding))
             padding = 0  # Padding only on first pbuf
-            p = qemu.read_memory(p+PBUF_NEXT, 4, 1)
+            p = next_p
 
-        frame = ''.join(frame_bufs)
+        frame = b''.join(qemu.read_memory_gather(payload_regions))
         log.info("Sending Frame with size: %s" % (len(frame)))
         self.model.tx_frame(self.get_id(qemu), frame)
         #qemu.call_ret_0(pbuf_free, pbuf_ptr)
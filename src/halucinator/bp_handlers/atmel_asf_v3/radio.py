@@ -6,6 +6,7 @@
 from ...peripheral_models.ieee802_15_4 import IEEE802_15_4
 from ..intercepts import tx_map, rx_map
 from ..bp_handler import BPHandler, bp_handler
+from ... import hal_clock
 from collections import defaultdict, deque
 import struct
 import binascii
@@ -65,7 +66,7 @@ class SAMR21Radio(BPHandler):
         self.model = model
         self.regs = defaultdict(int)
         self.model.rx_frame_isr = 20
-        self.last_rx_time = time.time()
+        self.last_rx_time = hal_clock.now()
 
     def get_id(self, qemu):
         return 'SAMR21Radio'
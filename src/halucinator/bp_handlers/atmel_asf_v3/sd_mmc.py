@@ -45,18 +45,21 @@ class SDCard(BPHandler):
 
         for sd_id, values in list(self.slot_configs.items()):
             self.model.set_config(sd_id, values['filename'],
-                                  values['block_size'])
+                                  values['block_size'],
+                                  values.get('base_image'))
 
     def register_handler(self, qemu, addr, func_name, slots=None):
         '''
             slots(dict): {slot_id: {'capactiy': int (KB), 'block_size': int, 
-                                    'write_protected': bool, 'filename': file}}
+                                    'write_protected': bool, 'filename': file,
+                                    'base_image': file (optional, copy-on-write)}}
         '''
         if slots is not None:
             self.slot_configs = slots
             for sd_id, values in list(slots.items()):
                 self.model.set_config(sd_id, values['filename'],
-                                      values['block_size'])
+                                      values['block_size'],
+                                      values.get('base_image'))
         return BPHandler.register_handler(self, qemu, addr, func_name)
 
     @bp_handler(['sd_mmc_init'])
@@ -127,13 +130,10 @@ class SDCard(BPHandler):
                  (dest, number_blocks))
         log.info("LR: %s", hex(qemu.regs.lr))
 
-        blocks = []
-        for i in range(number_blocks):
-            blocks.append(self.model.read_block(self.active_read_slot,
-                                                self.active_read_block))
-            self.active_read_block += 1
-        data = ''.join(blocks)
-        qemu.write_memory(dest, 1, data, len(data), raw=True)
+        data = self.model.read_blocks(self.active_read_slot,
+                                      self.active_read_block, number_blocks)
+        self.active_read_block += number_blocks
+        qemu.write_memory_bulk(dest, data)
 
         return True, 0
 
@@ -170,12 +170,11 @@ class SDCard(BPHandler):
         log.info("LR: %s", hex(qemu.regs.lr))
 
         block_size = self.slot_configs[self.active_write_slot]['block_size']
-        for i in range(nb_blocks):
-            addr = i * block_size
-            data = qemu.read_memory(addr, 1, block_size, raw=True)
-            self.model.write_block(self.active_write_slot,
-                                   self.active_write_block, data)
-            self.active_write_block += 1
+        # Read all blocks in one request
+        src_data = qemu.read_memory_bulk(src_ptr, nb_blocks * block_size)
+        self.model.write_blocks(self.active_write_slot,
+                                self.active_write_block, src_data)
+        self.active_write_block += nb_blocks
 
         return True, 0
 
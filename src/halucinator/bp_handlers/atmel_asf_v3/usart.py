@@ -4,6 +4,7 @@
 from ...peripheral_models.uart import UARTPublisher
 from ..intercepts import tx_map, rx_map
 from ..bp_handler import BPHandler, bp_handler
+from ..inline import inline_return
 import struct
 import logging
 import binascii
@@ -17,6 +18,7 @@ class USART(BPHandler):
         self.model = impl
 
     @bp_handler(['usart_init', 'usart_enable'])
+    @inline_return(0)
     def return_ok(self, qemu, bp_addr):
         return True, 0
 
@@ -51,7 +53,7 @@ class USART(BPHandler):
     def read_single(self, qemu, bp_addr):
         usart_ptr = qemu.regs.r0
         hw_addr = qemu.read_memory(usart_ptr, 4, 1)
-        ret = self.model.read(hw_addr, 1, block=True)[0]
+        ret = self.model.read(hw_addr, 1, block=True)[0]  # bytes -> int
         log.debug("Got Char: %s" % ret)
-        qemu.write_memory(qemu.regs.r1, 2, ord(ret), 1)
+        qemu.write_memory(qemu.regs.r1, 2, ret, 1)
         return True, 0
@@ -38,3 +38,12 @@ class BPHandler(object):
         error_str = "%s does not have bp_handler for %s" % \
                     (self.__class__.__name__, func_name)
         raise ValueError(error_str)
+
+    def get_inline_stub(self, addr, handler):
+        '''
+            Gets the in-guest stub that can replace handler for the intercept
+            at addr (see inline.py). Returns None if the handler must be
+            executed in python.  Override if the returned value depends on
+            the registration args.
+        '''
+        return getattr(handler, 'inline_stub', None)
@@ -1,6 +1,26 @@
-from .common import *
-from .counter import *
-from .argument_loggers import *
-from .debug import *
-from .function_callers import *
-from .timer import *
\ No newline at end of file
+'''
+    Classes are imported from their module on first use
+'''
+import importlib
+
+MODULES = ('common', 'counter', 'argument_loggers', 'debug',
+           'function_callers', 'timer')
+CLASSES = {'ReturnZero': 'common', 'ReturnConstant': 'common',
+           'SkipFunc': 'common', 'Counter': 'counter',
+           'ArgumentLogger': 'argument_loggers', 'IPythonShell': 'debug',
+           'CortexMDebugHelper': 'debug', 'FunctionCaller': 'function_callers',
+           'ARMFunctionCaller': 'function_callers',
+           'FunctionCallerIntercept': 'function_callers', 'Timer': 'timer'}
+
+
+def __getattr__(name):
+    if name.startswith('__'):
+        raise AttributeError(name)
+    if name in MODULES:
+        return importlib.import_module('.' + name, __name__)
+    modules = [CLASSES[name]] if name in CLASSES else MODULES
+    for module_name in modules:
+        module = importlib.import_module('.' + module_name, __name__)
+        if hasattr(module, name):
+            return getattr(module, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -1,4 +1,5 @@
 from ..bp_handler import BPHandler, bp_handler
+from ..inline import inline_return, ReturnValueStub
 import logging
 from ... import hal_log
 
@@ -14,6 +15,7 @@ class ReturnZero(BPHandler):
           function: <func_name> (Can be anything)
           registration_args: {silent:false}
           addr: <addr>
+          inline: false  # Optional, if true executes in guest without logging
     '''
     def __init__(self, filename=None):
         self.silent = {}
@@ -25,6 +27,7 @@ class ReturnZero(BPHandler):
         return ReturnZero.return_zero
 
     @bp_handler
+    @inline_return(0)
     def return_zero(self, qemu, addr):
         '''
             Intercept Execution and return 0
@@ -43,6 +46,7 @@ class ReturnConstant(BPHandler):
           function: <func_name> (Can be anything)
           registration_args: { ret_value:(value), silent:false}
           addr: <addr>
+          inline: false  # Optional, if true executes in guest without logging
     '''
     def __init__(self, filename=None):
         self.ret_values = {}
@@ -55,6 +59,9 @@ class ReturnConstant(BPHandler):
         self.func_names[addr] = func_name
         return ReturnConstant.return_constant
 
+    def get_inline_stub(self, addr, handler):
+        return ReturnValueStub(self.ret_values[addr])
+
     @bp_handler
     def return_constant(self, qemu, addr):
         '''
@@ -74,6 +81,7 @@ class SkipFunc(BPHandler):
           function: <func_name> (Can be anything)
           registration_args: {silent:false}
           addr: <addr>
+          inline: false  # Optional, if true executes in guest without logging
     '''
     def __init__(self, filename=None):
         self.silent = {}
@@ -85,6 +93,7 @@ class SkipFunc(BPHandler):
         return SkipFunc.skip
 
     @bp_handler
+    @inline_return(None)
     def skip(self, qemu, addr):
         '''
             Just return
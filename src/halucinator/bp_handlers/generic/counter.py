@@ -7,6 +7,7 @@ from binascii import hexlify
 from os import path
 import sys
 from ..bp_handler import BPHandler, bp_handler
+from ..inline import CounterStub
 
 # sys.path.insert(0,path.dirname(path.dirname(path.abspath(__file__))))
 
@@ -20,6 +21,7 @@ class Counter(BPHandler):
           function: <func_name> (Can be anything)
           addr: <addr>
           registration_args:{increment:1} (Optional)
+          inline: false  # Optional, if true counts in guest memory
     '''
 
     def __init__(self):
@@ -35,6 +37,9 @@ class Counter(BPHandler):
 
         return Counter.get_value
 
+    def get_inline_stub(self, addr, handler):
+        return CounterStub(self.increment[addr])
+
     @bp_handler
     def get_value(self, qemu, addr):
         '''
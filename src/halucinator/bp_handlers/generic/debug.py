@@ -4,7 +4,6 @@
 from os import path, system
 from ..bp_handler import BPHandler, bp_handler
 from ..intercepts import register_bp_handler
-import IPython
 import logging
 log = logging.getLogger(__name__)
 
@@ -79,6 +78,7 @@ class IPythonShell(BPHandler):
         system('stty sane')  # Make so display works
         print("In function: %s" % (self.addr2name[addr]))
         print("You can look up a symbol using target.avatar.config.get_symbol_name(addr)")
+        import IPython
         IPython.embed()
 
         # return intercept, ret_val
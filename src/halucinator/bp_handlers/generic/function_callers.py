@@ -2,9 +2,9 @@
 # Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains 
 # certain rights in this software.
 from os import path, system
+import struct
 from ..bp_handler import BPHandler, bp_handler
 from ..intercepts import register_bp_handler
-import IPython
 import logging
 import avatar2
 from ... import hal_config
@@ -23,51 +23,88 @@ class FunctionCaller():
         self.callee_fname = callee_fname
         self.return_addr = None # Subclass needs to set in init
         self.regs = {}
+        # (registers, on_return) of each call in progress, innermost last
+        self.frames = []
+        self.return_value = None # Value returned by last completed call
 
     def reg_size(self):
         return 4
 
     def save_state(self):
-        for reg in sorted(self.qemu.avatar.arch.registers.keys()):
-            log.debug("Saving Register: %s" % reg)
-            self.regs[reg] = self.qemu.read_register(reg)
+        '''
+            Saves the whole register file, served from the register snapshot
+            taken when the break point was hit or read in a single request
+        '''
+        self.regs = self.qemu.read_registers()
+        return self.regs
 
     def restore_state(self):
-        try:
-            for reg in sorted(self.qemu.avatar.arch.registers.keys()):
-                log.debug("Restoring Register: %s" % reg)
-                self.qemu.write_register(reg, self.regs[reg])
-        except KeyError as e:
-            log.error("Register key not available, likely restore called before save")
-            raise(e)
+        '''
+            Writes back the registers from save_state, only those that differ
+            are written and they are flushed together when the target resumes
+        '''
+        if not self.regs:
+            log.error("No saved registers, likely restore called before save")
+            raise(KeyError("regs"))
+        self.qemu.write_registers(self.regs)
 
     def _call(self):
         #Needs to over written by architecture specific call
         raise(NotImplementedError("Override with Arch Specific implementation"))
 
-    def setup_stack_and_args(self):
+    def setup_stack_and_args(self, args):
+        raise(NotImplementedError("Override with Arch Specific implementation"))
+
+    def get_return_value(self):
         raise(NotImplementedError("Override with Arch Specific implementation"))
 
     def get_return_addr(self):
         return self.return_addr
 
-    def call(self):
+    def call(self, args=None, on_return=None):
+        '''
+            Sets up the target to call the callee when resumed, may be called
+            again before the callee returns (e.g., from an interrupt), calls
+            return in reverse order.
+
+            :param args: Arguments for this call, default those configured
+            :param on_return: Called with the callee's return value
+        '''
         self.save_state()
-        self.setup_stack_and_args()
+        self.frames.append((self.regs, on_return))
+        self.setup_stack_and_args(self.args if args is None else args)
         self._call()
 
     def function_return(self):
+        '''
+            Restores the state from before the innermost call
+
+            :returns The callee's return value
+        '''
+        if not self.frames:
+            log.error("Return of %s without a call" % self.callee_fname)
+            raise(IndexError("No call in progress"))
+        value = self.get_return_value()
+        self.regs, on_return = self.frames.pop()
         self.restore_state()
+        self.return_value = value
+        log.debug("%s returned %#x" % (self.callee_fname, value))
+        if on_return is not None:
+            on_return(value)
+        return value
 
 class ARMFunctionCaller(FunctionCaller):
+    TRAMPOLINE_SIZE = 8
+
     def __init__(self, qemu, start_addr, size, 
                  callee_addr, args, callee_fname=None):
         '''
             Setups ARM FunctionCaller with desending stack, memory looks like
             
             +-------------+ highest addr
-            | return addr |
+            | return addr | break point the callee returns to, one per caller
             + ------------+
+            |  stack args |
             |    Stack    |
             |      |      |
             |      |      |
@@ -76,27 +113,46 @@ class ARMFunctionCaller(FunctionCaller):
             +-------------+
         '''
         super().__init__(qemu, start_addr, size, callee_addr, args, callee_fname)
-
-        #Uses decending stack so set sp to top of memory
-        self.initial_sp = self.start_addr + size - self.reg_size()
-        #TODO fix so multiple return break points can be used
-        self.return_addr = self.start_addr + size & 0xFFFFFFFE 
-
-    def setup_stack_and_args(self):
-        for idx, arg in enumerate(self.args):
-            if idx == 4:
-                break
+        self.thumb = issubclass(self.qemu.avatar.arch,
+                                avatar2.archs.arm.ARM_CORTEX_M3)
+        # Return address is inside this caller's memory so every caller
+        # has its own, the stack is 8 byte aligned (AAPCS) below it
+        self.return_addr = (self.start_addr + size - self.TRAMPOLINE_SIZE) \
+                           & 0xFFFFFFF8
+        self.initial_sp = self.return_addr
+
+    def setup_stack_and_args(self, args):
+        sp = self.initial_sp
+        outer_sp = self.regs.get('sp')
+        if outer_sp is not None and self.start_addr < outer_sp <= sp:
+            # Called before a previous call returned, stack below it
+            sp = outer_sp & 0xFFFFFFF8
+
+        args = [arg & 0xFFFFFFFF for arg in args]
+        stack_args = args[4:]
+        sp = (sp - len(stack_args) * self.reg_size()) & 0xFFFFFFF8
+        if sp < self.start_addr:
+            raise(ValueError("Stack of %s caller overflowed, increase "
+                             "stack_size" % self.callee_fname))
+        if stack_args:
+            self.qemu.write_memory_bulk(
+                sp, struct.pack("<%iI" % len(stack_args), *stack_args))
+        for idx, arg in enumerate(args[:4]):
             self.qemu.write_register("r%i"% idx, arg)
-            
 
-        if len(self.args) > 4:
-            raise (NotImplementedError("Stack parameters not supported yet"))
-
-        self.qemu.regs.sp = self.initial_sp
+        self.qemu.regs.sp = sp
     
+    def get_return_value(self):
+        return self.qemu.regs.r0
+
     def _call(self):
-        self.qemu.regs.lr = self.return_addr
-        self.qemu.regs.pc = self.callee_addr 
+        if self.thumb:
+            # Cortex-M only executes thumb, bx lr faults if bit 0 is clear
+            self.qemu.regs.lr = self.return_addr | 1
+            self.qemu.regs.pc = self.callee_addr & 0xFFFFFFFE
+        else:
+            self.qemu.regs.lr = self.return_addr
+            self.qemu.regs.pc = self.callee_addr
 
 class FunctionCallerIntercept():
 
@@ -153,9 +209,9 @@ class FunctionCallerIntercept():
         self.memory_addr, self.memory_size = self.find_memory_region()
         self.next_stack_addr = self.memory_addr
 
-        if self.qemu.avatar.arch != avatar2.archs.arm.ARM:
-            raise(ValueError("Architecture (%s) not supported") %
-                  (str(self.qemu.avatar.arch)))
+        if not issubclass(self.qemu.avatar.arch, avatar2.archs.arm.ARM):
+            raise(ValueError("Architecture (%s) not supported" %
+                             str(self.qemu.avatar.arch)))
 
         if type(callee) == str:
             try:
@@ -170,7 +226,7 @@ class FunctionCallerIntercept():
             callee_addr = callee
 
         
-        if self.qemu.avatar.arch == avatar2.archs.arm.ARM:
+        if issubclass(self.qemu.avatar.arch, avatar2.archs.arm.ARM):
             stack_addr = self.get_stack_addr(stack_size)
             caller = ARMFunctionCaller(self.qemu, stack_addr, stack_size,
                                       callee_addr, args, callee_fname)
@@ -204,23 +260,33 @@ class FunctionCallerIntercept():
             
 
     def setup_return_bp(self, function, callee_addr, return_addr, break_type="BP",rw="r"):
+        '''
+            Registers the return handler at return_addr, it stays set so the
+            callee can be called any number of times
+        '''
         if break_type == "WP":
             config = {'cls': '.'.join([self.__class__.__module__, self.__class__.__name__]),
                     'registration_args': 
                         {'callee': callee_addr, 'is_return': True},
-                    'run_once': True,
                     'function': function +'-return', 'addr': return_addr, 'watchpoint': rw}
         else:
             config = {'cls': '.'.join([self.__class__.__module__, self.__class__.__name__]),
                     'registration_args': 
                         {'callee': callee_addr, 'is_return': True},
-                    'run_once': True,
                     'function': function +'-return', 'addr': return_addr}
 
         intercept_config = hal_config.HalInterceptConfig(__file__, **config)
         register_bp_handler(self.qemu, intercept_config)
         return
 
+    def get_caller(self, addr):
+        '''
+            :returns FunctionCaller registered at the break point addr, its
+                     call(args, on_return) can be used from other handlers
+                     to call the callee when the target is resumed
+        '''
+        return self.function_caller[addr]
+
     @bp_handler
     def initiate_call_handler(self, qemu, addr):
         '''
@@ -230,6 +296,7 @@ class FunctionCallerIntercept():
         caller.call()
         if self.interactive[addr]:
             hal_log.info("Before call of %s" % caller.callee_fname)
+            import IPython
             IPython.embed()
         return False, None # Don't change PC, or R0
 
@@ -241,10 +308,9 @@ class FunctionCallerIntercept():
         caller = self.function_caller[addr]
         if self.interactive[addr]:
             hal_log.info("After call of %s" % caller.callee_fname)
+            import IPython
             IPython.embed()
         
-        caller.restore_state()
+        caller.function_return()
 
         return False, None
-
-    
\ No newline at end of file
@@ -7,7 +7,7 @@ from binascii import hexlify
 from os import path
 import sys
 from ..bp_handler import BPHandler, bp_handler
-import time
+from ... import hal_clock
 import logging
 log = logging.getLogger(__name__)
 # log.setLevel(logging.DEBUG)
@@ -16,7 +16,7 @@ log = logging.getLogger(__name__)
 
 class Timer(BPHandler):
     '''
-        Returns an increasing value based of host system time 
+        Returns an increasing value based of hal_clock time
 
         - class: halucinator.bp_handlers.Timer
           function: <func_name> (Can be anything)
@@ -32,7 +32,7 @@ class Timer(BPHandler):
         '''
 
         '''
-        self.start_time[addr] = time.time()
+        self.start_time[addr] = hal_clock.now()
         self.scale[addr] = scale
 
         return Timer.get_value
@@ -43,7 +43,7 @@ class Timer(BPHandler):
             Gets the current timer value
         '''
         time_ms = int(
-            (time.time() - self.start_time[addr]) * 1000 / float(self.scale[addr]))
+            (hal_clock.now() - self.start_time[addr]) * 1000 / float(self.scale[addr]))
         log.info("Time: %i" % time_ms)
 
         return True, time_ms
@@ -0,0 +1,183 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+'''
+    In-guest (inline) intercepts.  Handlers that only set r0 and return can
+    be replaced by a small Thumb stub in patch memory.  The function entry is
+    rewritten to jump to the stub so the call never stops QEMU.  Each stub
+    increments a hit counter in patch memory that is read lazily into
+    hal_stats.
+'''
+import struct
+from avatar2 import TargetStates
+from .. import hal_stats
+import logging
+log = logging.getLogger(__name__)
+
+# Thumb opcodes
+NOP = 0xBF00
+BX_LR = 0x4770
+LDR_R2_R1 = 0x680A       # ldr r2, [r1, #0]
+STR_R2_R1 = 0x600A       # str r2, [r1, #0]
+ADDS_R2_1 = 0x3201       # adds r2, #1
+LDR_R0_R1_4 = 0x6848     # ldr r0, [r1, #4]
+STR_R0_R1_4 = 0x6048     # str r0, [r1, #4]
+ADDS_R0_R0_R2 = 0x1880   # adds r0, r0, r2
+LDR_W_PC = 0xF8DF        # ldr.w pc, [pc, #imm12] (first halfword)
+
+COUNTER_SIZE = 8  # hit count, counter value (used by CounterStub)
+
+
+class ReturnValueStub(object):
+    '''
+        Stub that returns value (None for void functions)
+    '''
+    def __init__(self, value=None):
+        self.value = value
+
+    def code(self):
+        # Literal 0 is the address of the counter, literal 1 the return value
+        code = [(1, 0), LDR_R2_R1, ADDS_R2_1, STR_R2_R1]
+        literals = []
+        if self.value is not None:
+            code.append((0, 1))
+            literals.append(int(self.value))
+        code.append(BX_LR)
+        return code, literals
+
+
+class CounterStub(object):
+    '''
+        Stub that returns an increasing value, same as Counter handler
+    '''
+    def __init__(self, increment=1):
+        self.increment = increment
+
+    def code(self):
+        code = [(1, 0), LDR_R2_R1, ADDS_R2_1, STR_R2_R1,
+                LDR_R0_R1_4, (2, 1), ADDS_R0_R0_R2, STR_R0_R1_4, BX_LR]
+        return code, [self.increment]
+
+
+def inline_return(value=None):
+    '''
+        @inline_return decorator, marks a bp_handler as doing nothing but
+        returning value (None for void) so it can be executed in the guest
+        when its intercept is configured with inline: true
+
+        Usage: @bp_handler(['F1', 'F2'])
+               @inline_return(0)
+    '''
+    def inline_decorator(func):
+        func.inline_stub = ReturnValueStub(value)
+        return func
+    return inline_decorator
+
+
+def _ldr_literal(rt, instr_addr, lit_addr):
+    '''
+        Encodes ldr rt, [pc, #imm] located at instr_addr loading lit_addr
+    '''
+    offset = lit_addr - ((instr_addr + 4) & ~3)
+    if offset < 0 or offset >= 1024 or offset % 4:
+        raise ValueError("Literal out of range")
+    return 0x4800 | (rt << 8) | (offset >> 2)
+
+
+def assemble(stub_addr, code, literals):
+    '''
+        Assembles a stub, code is a list of 16 bit opcodes or
+        (register, literal_index) tuples for pc relative loads of literals.
+        stub_addr must be word aligned.
+    '''
+    code_size = len(code) * 2
+    lit_base = stub_addr + ((code_size + 3) & ~3)
+    data = b''
+    for idx, ins in enumerate(code):
+        if isinstance(ins, tuple):
+            rt, lit_idx = ins
+            ins = _ldr_literal(rt, stub_addr + 2 * idx, lit_base + 4 * lit_idx)
+        data += struct.pack('<H', ins)
+    if code_size % 4:
+        data += struct.pack('<H', NOP)
+    for lit in literals:
+        data += struct.pack('<I', lit & 0xFFFFFFFF)
+    return data
+
+
+def entry_patch(addr, stub_addr):
+    '''
+        Returns the bytes to write at addr to jump to the Thumb stub at
+        stub_addr.  Uses ldr.w pc with a literal so the full address space is
+        reachable, 8 bytes if addr is word aligned else 10 bytes
+    '''
+    if addr % 4 == 0:
+        return struct.pack('<HHI', LDR_W_PC, 0xF000, stub_addr | 1)
+    # Align(pc, 4) is addr + 2, pad so literal is word aligned
+    return struct.pack('<HHHI', LDR_W_PC, 0xF004, NOP, stub_addr | 1)
+
+
+class InlinePatcher(object):
+    '''
+        Allocates stubs in patch memory and patches function entries.  Stubs
+        grow up from base_addr and counters grow down from the end of the
+        memory so all counters can be read in a single request.
+    '''
+    def __init__(self, qemu, base_addr, size):
+        self.qemu = qemu
+        self.base_addr = base_addr
+        self.end_addr = base_addr + size
+        self.next_stub = base_addr
+        self.counters = []   # (addr, stats_key) slot i at end - 8*(i+1)
+        hal_stats.add_lazy_update(self.update_stats)
+
+    def install(self, addr, stub, stats_key, max_size=None):
+        '''
+            Writes stub to patch memory and patches addr to jump to it
+
+            :param addr:      Address of function entry (thumb bit clear)
+            :param stub:      ReturnValueStub or CounterStub
+            :param stats_key: Key in hal_stats.stats to put hit count in
+            :param max_size:  Size of the function, the patch is refused
+                              if unknown (None or 0) as it may overwrite the
+                              next function
+            :returns True if installed
+        '''
+        counter_addr = self.end_addr - COUNTER_SIZE * (len(self.counters) + 1)
+        code, literals = stub.code()
+        data = assemble(self.next_stub, code, [counter_addr] + literals)
+        patch = entry_patch(addr, self.next_stub)
+        if self.next_stub + len(data) > counter_addr:
+            log.error("Insufficient patch memory for inline intercept %#x" % addr)
+            return False
+        if not max_size:
+            log.info("Size of function at %#x unknown, not inline patching" %
+                     addr)
+            return False
+        if len(patch) > max_size:
+            log.error("Function at %#x too small (%i) for inline patch" %
+                      (addr, max_size))
+            return False
+
+        self.qemu.write_memory(counter_addr, 4, [0, 0], 2)
+        self.qemu.write_memory(self.next_stub, 1, data, len(data), raw=True)
+        self.qemu.write_memory(addr, 1, patch, len(patch), raw=True)
+        log.info("Inline intercept %#x, stub %#x" % (addr, self.next_stub))
+        self.next_stub += (len(data) + 3) & ~3
+        self.counters.append((counter_addr, stats_key))
+        return True
+
+    def update_stats(self):
+        '''
+            Reads all hit counters in one request, only possible while the
+            target is stopped
+        '''
+        if not self.counters or self.qemu.state != TargetStates.STOPPED:
+            return
+        num = len(self.counters)
+        start = self.end_addr - COUNTER_SIZE * num
+        values = self.qemu.read_memory(start, 4, 2 * num)
+        for idx, (counter_addr, key) in enumerate(self.counters):
+            offset = (counter_addr - start) // 4
+            hal_stats.stats[key]['count'] = values[offset]
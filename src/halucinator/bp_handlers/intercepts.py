@@ -10,6 +10,9 @@ from ..util import hexyaml
 import os
 import logging
 from .. import hal_stats as hal_stats
+from .. import hal_profile as hal_profile
+from .. import hal_clock as hal_clock
+from ..peripheral_models import peripheral_server
 log = logging.getLogger(__name__)
 
 from .. import hal_log as hal_log_conf
@@ -31,10 +34,10 @@ def tx_map(per_model_funct):
             per_model_funct(PeripheralModel.method):  Method of child class that
                 this method is providing a mapping for
     '''
-    print("In: intercept_tx_map", per_model_funct)
+    log.debug("In: intercept_tx_map %s" % per_model_funct)
 
     def intercept_decorator(func):
-        print("In: intercept_decorator", func)
+        log.debug("In: intercept_decorator %s" % func)
         @wraps(func)
         def intercept_wrapper(self, target, bp_addr):
             bypass, ret_value, msg = func(self, target, bp_addr)
@@ -55,10 +58,10 @@ def rx_map(per_model_funct):
             per_model_funct(PeripheralModel.method):  Method of child class that
                 this method is providing a mapping for
     '''
-    print("In: intercept_rx_map", per_model_funct)
+    log.debug("In: intercept_rx_map %s" % per_model_funct)
 
     def intercept_decorator(func):
-        print("In: intercept_decorator", func)
+        log.debug("In: intercept_decorator %s" % func)
         @wraps(func)
         def intercept_wrapper(self, target, bp_addr):
             models_inputs = per_model_funct()
@@ -68,6 +71,8 @@ def rx_map(per_model_funct):
 
 initalized_classes = {}
 bp2handler_lut = {}
+intercepted_addrs = set()
+pc_hooks = {}  # addr: callback(target, bp, pc), see add_pc_hook
 
 def get_bp_handler(intercept):
     '''
@@ -129,6 +134,11 @@ def register_bp_handler(qemu, intercept):
         hal_log.error("Input registration args are %s" %(intercept.registration_args))
         exit(-1)
 
+    if intercept.inline:
+        if register_inline_handler(qemu, intercept, bp_cls, handler):
+            return
+        hal_log.warning("Inline not possible, using break point for %s" % intercept)
+
     if intercept.run_once:
         bp_temp = True
         log.debug("Setting as Tempory")
@@ -154,9 +164,73 @@ def register_bp_handler(qemu, intercept):
                            'method': handler.__name__}
 
     bp2handler_lut[bp] = (bp_cls, handler)
+    intercepted_addrs.add(intercept.bp_addr & 0xFFFFFFFE)
     log.info("BP is %i" % bp)
 
 
+def add_pc_hook(qemu, addr, callback, temporary=False):
+    '''
+        Calls callback(target, bp, pc) when addr is executed, before the
+        intercept at addr (if any) is dispatched.  If callback returns True
+        the intercept is skipped and callback must resume the target.  A
+        break point is set if addr is not already intercepted.
+
+        :param temporary: Break point (if set) is removed after one hit
+    '''
+    addr &= 0xFFFFFFFE
+    if addr not in intercepted_addrs:
+        qemu.set_breakpoint(addr, temporary=temporary)
+    pc_hooks[addr] = callback
+
+
+def remove_pc_hook(addr):
+    pc_hooks.pop(addr & 0xFFFFFFFE, None)
+
+
+def _run_pc_hook(target, bp, pc):
+    '''
+        :returns True if the break point was handled by a hook
+    '''
+    hook = pc_hooks.get(pc)
+    if hook is not None and hook(target, bp, pc):
+        return True
+    if bp not in bp2handler_lut:  # Break point only set for a hook
+        target.cont()
+        return True
+    return False
+
+
+def register_inline_handler(qemu, intercept, bp_cls, handler):
+    '''
+        Replaces the break point with an in-guest stub if the handler
+        supports it (see inline.py). Hits are counted in patch memory.
+
+        :param qemu:    Avatar qemu target
+        :param intercept: HALInterceptConfig
+        :returns True if inline intercept was installed
+    '''
+    patcher = getattr(qemu, 'inline_patcher', None)
+    get_stub = getattr(bp_cls, 'get_inline_stub', None)
+    if patcher is None or get_stub is None:
+        return False
+    stub = get_stub(intercept.bp_addr, handler)
+    if stub is None:
+        return False
+
+    key = "inline_%#x" % intercept.bp_addr
+    size = qemu.avatar.config.get_symbol_size(intercept.bp_addr)
+    if not patcher.install(intercept.bp_addr, stub, key, size):
+        return False
+    log.info("Inline Intercept: %s.%s : %s" % (
+        intercept.cls, intercept.function, hex(intercept.bp_addr)))
+    hal_stats.stats[key] = {'function': intercept.function,
+                            'desc': str(intercept),
+                            'count': 0,
+                            'method': handler.__name__,
+                            'inline': True}
+    return True
+
+
 def interceptor(avatar, message):
     '''
         Callback for Avatar2 break point watchman.  It then dispatches to
@@ -168,17 +242,43 @@ def interceptor(avatar, message):
     else:
         bp = int(message.breakpoint_number)
     target = message.origin
-    pc = target.regs.pc & 0xFFFFFFFE  # Clear Thumb bit
+    # Interrupts raised while stopped are injected together after resuming
+    peripheral_server.hold_interrupts()
+    try:
+        timer = None
+        if hal_profile.enabled:
+            timer = hal_profile.InterceptTimer(
+                getattr(message, 'hal_stop_time', None))
+        _intercept(target, bp, timer)
+    finally:
+        peripheral_server.release_interrupts()
 
 
+def _intercept(target, bp, timer=None):
+    '''
+        Runs the handler for bp and resumes the target
+
+        :param timer: hal_profile.InterceptTimer to record timings in
+    '''
+    # Fetch all registers in one request, written back on target.cont()
+    target.snapshot_registers()
+    pc = target.regs.pc & 0xFFFFFFFE  # Clear Thumb bit
+    if pc_hooks and _run_pc_hook(target, bp, pc):
+        return
+
     cls, method = bp2handler_lut[bp]
-    hal_stats.stats[bp]['count'] += 1
+    hal_stats.increment(bp)
     hal_stats.write_on_update(
         'used_intercepts', hal_stats.stats[bp]['function'])
+    hal_clock.on_intercept()
+    run = method
+    if timer is not None:
+        run = timer.start(target, bp, cls, method,
+                          hal_stats.stats[bp]['function'])
 
     # print method
     try:
-        intercept, ret_value = method(cls, target, pc)
+        intercept, ret_value = run(cls, target, pc)
         if intercept:
             hal_stats.write_on_update('bypassed_funcs', hal_stats.stats[bp]['function'])
     except:
@@ -186,4 +286,10 @@ def interceptor(avatar, message):
         raise
     if intercept:
         target.execute_return(ret_value)
+    if timer is not None:
+        timer.handled(target)
+    # Target is stopped, refresh counters kept in its memory (inline.py)
+    hal_stats.refresh_lazy_updates()
     target.cont()
+    if timer is not None:
+        timer.resumed()
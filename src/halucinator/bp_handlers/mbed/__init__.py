@@ -1,3 +1,14 @@
-from .boot import MbedBoot
-from .serial import MbedUART
-from .timer import MbedTimer
+'''
+    Classes are imported from their module on first use
+'''
+import importlib
+
+CLASSES = {'MbedBoot': 'boot', 'MbedUART': 'serial', 'MbedTimer': 'timer'}
+
+
+def __getattr__(name):
+    if name not in CLASSES:
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, name))
+    return getattr(importlib.import_module('.' + CLASSES[name], __name__),
+                   name)
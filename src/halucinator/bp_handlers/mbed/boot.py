@@ -3,6 +3,7 @@
 # certain rights in this software.
 
 from ..bp_handler import BPHandler, bp_handler
+from ..inline import inline_return
 import logging
 log = logging.getLogger(__name__)
 
@@ -13,6 +14,7 @@ class MbedBoot(BPHandler):
         BPHandler.__init__(self)
 
     @bp_handler(['SystemInit'])
+    @inline_return(None)
     def SystemInit(self, qemu, bp_addr):
         log.info("MBED System")
         log.info("LR: %s" % hex(qemu.regs.lr))
@@ -20,18 +22,21 @@ class MbedBoot(BPHandler):
         return True, None
 
     @bp_handler(['mbed_sdk_init'])
+    @inline_return(None)
     def mbed_sdk_init(self, qemu, bp_addr):
         log.info("mbed_sdk_init")
         # ...you don't need to do that
         return True, None
 
     @bp_handler(['software_init_hook'])
+    @inline_return(0)
     def software_init_hook(self, qemu, bp_addr):
         log.info("software_init_hook")
         # Nope.
         return True, 0
 
     @bp_handler(['software_init_hook_rtos'])
+    @inline_return(0)
     def software_init_hook_rtos(self, qemu, bp_addr):
         log.info("software_init_hook_rtos")
         # Not even once
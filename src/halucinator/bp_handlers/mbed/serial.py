@@ -19,9 +19,9 @@ class MbedUART(BPHandler):
         param1 = qemu.regs.r1
         # TODO: param0 is the 'this'pointer, use it get hw address of UART
         # just using the this pointer will make this change per firmware
-        ret = self.model.read(param0, 1, block=True)[0]
+        ret = self.model.read(param0, 1, block=True)[0]  # bytes -> int
         intercept = True
-        return intercept, ord(ret)
+        return intercept, ret
 
     @bp_handler(['_ZN4mbed6Stream4putcEv', '_ZN4mbed6Serial5_putcEi'])
     def putc(self, qemu, bp_addr):
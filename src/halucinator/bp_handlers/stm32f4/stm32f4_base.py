@@ -7,6 +7,7 @@ from ...peripheral_models.timer_model import TimerModel
 from avatar2.peripherals.avatar_peripheral import AvatarPeripheral
 from ..intercepts import tx_map, rx_map
 from ..bp_handler import BPHandler, bp_handler
+from ..inline import inline_return
 import time
 from collections import defaultdict
 
@@ -42,16 +43,19 @@ class STM32F4_Base(BPHandler):
         return False, None
 
     @bp_handler(['SystemClock_Config'])
+    @inline_return(0)
     def systemclock_config(self, qemu, bp_addr):
         log.info("SystemClock_Config called")
         return True, 0
 
     @bp_handler(['HAL_RCC_OscConfig'])
+    @inline_return(0)
     def rcc_osc_config(self, qemu, bp_addr):
         log.info("HAL_RCC_OscConfig called")
         return True, 0
 
     @bp_handler(['HAL_RCC_ClockConfig'])
+    @inline_return(0)
     def rcc_clock_config(self, qemu, bp_addr):
         log.info("HAL_RCC_ClockConfig called")
         return True, 0
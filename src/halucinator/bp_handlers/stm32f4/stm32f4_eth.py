@@ -39,23 +39,24 @@ class STM32F4Ethernet(BPHandler):
         heth_ptr = qemu.regs.r0
         length = qemu.regs.r1
 
-        tx_dma_desc = qemu.read_memory(heth_ptr + 44, 4, 1)  # heth->TXDesc
-        tx_frame_ptr = qemu.read_memory(
-            tx_dma_desc + 8, 4, 1)  # heth->TXDesc->Buffer1Addr
+        # heth->Instance and heth->TXDesc
+        eth_id, tx_dma_desc = qemu.read_struct(heth_ptr, '<I40xI')
+        # heth->TXDesc->Buffer1Addr
+        tx_frame_ptr, = qemu.read_struct(tx_dma_desc + 8, '<I')
         # *(heth->TXDesc->Buffer1Addr)
-        frame = qemu.read_memory(tx_frame_ptr, 1, length, raw=True)
-        eth_id = self.get_id(qemu)
+        frame = qemu.read_memory_bulk(tx_frame_ptr, length)
         self.model.tx_frame(eth_id, frame)
         return True, 0
 
     @bp_handler(['HAL_ETH_GetReceivedFrame'])
     def handle_rx(self, qemu, bp_addr):
         avatar = qemu.avatar
-        eth_id = self.get_id(qemu)
+        heth_ptr = qemu.regs.r0
+        # heth->Instance and heth->RxDesc
+        eth_id, RxDesc_ptr = qemu.read_struct(heth_ptr, '<I36xI')
 
         log.info("IN: STM32F4Ethernet.handle_rx")
         frame = self.model.get_rx_frame(eth_id)
-        heth_ptr = qemu.regs.r0
 
         DMARxFrameInfos_Addr = heth_ptr + 48
         if frame is not None:
@@ -65,16 +66,12 @@ class STM32F4Ethernet(BPHandler):
 
             log.info("Got Frame: %s" % binascii.hexlify(frame))
 
-            RxDesc_ptr = qemu.read_memory(heth_ptr + 40, 4, 1)
-
-            NextDescAddr = qemu.read_memory(RxDesc_ptr+12, 4, 1)
-            BuffAddr = qemu.read_memory(RxDesc_ptr+8, 4, 1)
-            FrameInfo = struct.pack(
-                '<IIIII', RxDesc_ptr, RxDesc_ptr, 1, len(frame), BuffAddr)
-            qemu.write_memory(DMARxFrameInfos_Addr, 1,
-                              FrameInfo, len(FrameInfo), raw=True)
-            qemu.write_memory(BuffAddr, 1, frame, len(frame), raw=True)
-            qemu.write_memory(heth_ptr+40, 4, NextDescAddr, 1)
+            BuffAddr, NextDescAddr = qemu.read_struct(RxDesc_ptr + 8, '<II')
+            with qemu.memory_transaction() as txn:
+                txn.write_struct(DMARxFrameInfos_Addr, '<IIIII', RxDesc_ptr,
+                                 RxDesc_ptr, 1, len(frame), BuffAddr)
+                txn.write(BuffAddr, frame)
+                txn.write_struct(heth_ptr + 40, '<I', NextDescAddr)
 
             if avatar.recorder is not None:
                 avatar.recorder.save_state_to_db(
@@ -83,9 +80,7 @@ class STM32F4Ethernet(BPHandler):
             # import IPython; IPython.embed()
         else:  # No Frame available
             # Need to clear out frame to make clear frame was not received
-            FrameInfo = struct.pack('<IIIII', 0, 0, 0, 0, 0)
-            qemu.write_memory(DMARxFrameInfos_Addr, 1,
-                              FrameInfo, len(FrameInfo), raw=True)
+            qemu.write_struct(DMARxFrameInfos_Addr, '<IIIII', 0, 0, 0, 0, 0)
         ret_val = 0
         intercept = True
         return intercept, ret_val
@@ -5,6 +5,7 @@
 
 from ...peripheral_models.sd_card import SDCardModel
 from ..bp_handler import BPHandler, bp_handler
+from ..inline import inline_return
 from collections import defaultdict, deque
 import struct
 import binascii
@@ -16,9 +17,15 @@ class SD_Card(BPHandler):
     CSD_Struct = binascii.unhexlify(
         '0100000e0032b50509000000000001408a1d0000142c014020017f0000000209000000000100000000')
 
-    blocks = {}
     sd_block_size = 0x200
 
+    def __init__(self, base_image=None):
+        '''
+            :param base_image: Shared SD image, writes go to a per instance
+                               overlay (see SDCardModel)
+        '''
+        SDCardModel.default_base_image = base_image
+
     def get_hw_instance(self, qemu):
         '''
             Gets the instance ID from the hsd
@@ -30,6 +37,7 @@ class SD_Card(BPHandler):
     # HAL_StatusTypeDef HAL_SD_InitCard(SD_HandleTypeDef *hsd)
     # HAL_StatusTypeDef HAL_SD_DeInit(SD_HandleTypeDef
     @bp_handler(['HAL_SD_Init', 'HAL_SD_InitCard', 'HAL_SD_DeInit'])
+    @inline_return(0)
     def return_hal_ok(self, qemu, bp_addr):
         hw_id = self.get_hw_instance(qemu)
         SDCardModel.set_config(hw_id, None, 0x200)
@@ -47,20 +55,9 @@ class SD_Card(BPHandler):
 
         print("SD_CARD Read Block, BlockAddr %i, #Blocks: %i" %
               (block_addr, num_blocks))
-        for i in range(num_blocks):
-            block = block_addr + i
-            addr = pdata + (i*SDCardModel.get_block_size(hw_id))
-            data = SDCardModel.read_block(hw_id, block)
-            if block not in SD_Card.blocks:
-                print("Block not in blocks", block)
-            else:
-                if SD_Card.blocks[block] != data:
-                    print("Data Different:", block)
-                    print("Block", binascii.hexlify(SD_Card.blocks[block]))
-                    print("Data:", binascii.hexlify(data))
-            if len(data) != SDCardModel.get_block_size(hw_id):
-                print("Block lengths wrong", binascii.hexlify(data))
-            qemu.write_memory(addr, 1, data, len(data), raw=True)
+        # All blocks are read and written to the guest as a single slice
+        data = SDCardModel.read_blocks(hw_id, block_addr, num_blocks)
+        qemu.write_memory_bulk(pdata, data)
         return True, 0
 
     # HAL_StatusTypeDef HAL_SD_WriteBlocks(SD_HandleTypeDef *hsd, uint8_t *pData, uint32_t BlockAdd, uint32_t NumberOfBlocks, uint32_t Timeout)
@@ -75,13 +72,9 @@ class SD_Card(BPHandler):
 
         print("SD_CARD Write Block, BlockAddr %i, #Blocks: %i" %
               (block_addr, num_blocks))
-        for i in range(num_blocks):
-            block = block_addr + i
-            addr = pdata + (i*SDCardModel.get_block_size(hw_id))
-            sd_data = qemu.read_memory(
-                addr, 1, SDCardModel.get_block_size(hw_id), raw=True)
-            SD_Card.blocks[block] = sd_data
-            SDCardModel.write_block(hw_id, block, sd_data)
+        block_size = SDCardModel.get_block_size(hw_id)
+        data = qemu.read_memory_bulk(pdata, num_blocks * block_size)
+        SDCardModel.write_blocks(hw_id, block_addr, data)
 
         return True, 0
 
@@ -7,6 +7,7 @@ from ...peripheral_models.timer_model import TimerModel
 from avatar2.peripherals.avatar_peripheral import AvatarPeripheral
 from ..intercepts import tx_map, rx_map
 from ..bp_handler import BPHandler, bp_handler
+from ... import hal_clock
 import time
 from collections import defaultdict
 
@@ -100,7 +101,7 @@ class STM32_TIM(BPHandler):
     def sleep(self, qemu, bp_handler):
         amt = qemu.regs.r0 / 1000.0
         log.debug("sleeping for %f" % amt)
-        # time.sleep(amt)
+        hal_clock.sleep(amt)
         return True, 0
 
     @bp_handler(['HAL_SYSTICK_Config'])
@@ -5,6 +5,7 @@
 from os import sys, path
 from ...peripheral_models.uart import UARTPublisher
 from ..bp_handler import BPHandler, bp_handler
+from ..inline import inline_return
 import logging
 log = logging.getLogger(__name__)
 
@@ -18,6 +19,7 @@ class STM32F4UART(BPHandler):
         self.model = impl
 
     @bp_handler(['HAL_UART_Init'])
+    @inline_return(0)
     def hal_ok(self, qemu, bp_addr):
         log.info("Init Called")
         return True, 0
@@ -4,7 +4,11 @@
 
 import binascii
 from .ioserver import IOServer
+from .async_ioserver import AsyncIOServer
+from ..peripheral_models import codec
 from .trigger_interrupt import SendInterrupt
+from .flow_control import CreditGate
+from . import capture
 import logging
 import time
 import socket
@@ -19,6 +23,7 @@ class IEEE802_15_4(object):
         '''
         self.ioservers = []
         self.host_socket = None
+        self.gate = CreditGate()
         for server in ioservers:
             self.add_server(server)
 
@@ -26,12 +31,14 @@ class IEEE802_15_4(object):
         self.ioservers.append(ioserver)
         ioserver.register_topic('Peripheral.IEEE802_15_4.tx_frame',
                                 self.received_frame)
+        ioserver.register_topic('Peripheral.IEEE802_15_4.rx_credit',
+                                self.gate.credit)
 
     def received_frame(self, from_server, msg):
         for server in self.ioservers:
             if server != from_server:
                 log.info('Forwarding, msg')
-                server.send_msg('Peripheral.IEEE802_15_4.rx_frame', msg)
+                self.gate.send(server, 'Peripheral.IEEE802_15_4.rx_frame', msg)
         if self.host_socket is not None:
             frame = msg['frame']
             self.host_socket.send(frame)
@@ -50,6 +57,12 @@ def main():
                    help='Port numbers to send IO messages via zmq, length must match --rx_ports')
     p.add_argument('-l', '--logs', nargs='+', default=['Receiver.txt', 'Sender.txt'],
                    help='Log files to write IO frames to, length must match --rx_ports')
+    p.add_argument('--codec', default=codec.AUTO, choices=codec.CODECS,
+                   help='Message wire format')
+    p.add_argument('-a', '--async_io', default=False, action='store_true',
+                   help='Serve all emulators from one asyncio event loop '
+                        'instead of a thread per emulator')
+    capture.add_arguments(p)
     args = p.parse_args()
 
     if len(args.rx_ports) != len(args.tx_ports):
@@ -61,10 +74,13 @@ def main():
     hal_log.setLogConfig()
 
     hub = IEEE802_15_4()
+    pcap = capture.from_args(args)
 
     for idx, rx_port in enumerate(args.rx_ports):
         print(idx)
-        server = IOServer(rx_port, args.tx_ports[idx], args.logs[idx])
+        server_cls = AsyncIOServer if args.async_io else IOServer
+        server = server_cls(rx_port, args.tx_ports[idx], args.logs[idx],
+                            msg_codec=args.codec, capture=pcap)
         hub.add_server(server)
         server.start()
 
@@ -79,6 +95,8 @@ def main():
         pass
     log.info("Shutting Down")
     hub.shutdown()
+    if pcap is not None:
+        pcap.close()
     # io_server.join()
 
 
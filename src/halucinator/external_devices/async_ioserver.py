@@ -0,0 +1,171 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+'''
+    asyncio version of IOServer.  All AsyncIOServers in a process share one
+    zmq context and one event loop (run in a background thread), so a hub
+    can connect hundreds of emulators without a thread per emulator.
+
+    AsyncIOServer has the same register_topic/send_msg/start/shutdown API
+    as IOServer.  Handlers are called as method(server, msg) on the loop
+    thread, if a handler returns an awaitable it is awaited before the
+    server's next message is handled.  send_msg may be called from any
+    thread.
+'''
+import asyncio
+import binascii
+import inspect
+import time
+from threading import Thread, Lock, get_ident
+import zmq
+import zmq.asyncio
+from ..peripheral_models import codec
+from .capture import INBOUND, OUTBOUND
+import logging
+log = logging.getLogger(__name__)
+
+
+class IOLoop(object):
+    '''
+        Event loop shared by AsyncIOServers, runs in a daemon thread
+    '''
+    _default = None
+    _default_lock = Lock()
+
+    def __init__(self):
+        self.context = zmq.asyncio.Context()
+        self.loop = asyncio.new_event_loop()
+        self.servers = set()
+        self._thread = Thread(target=self._run, daemon=True, name="IOLoop")
+        self._thread.start()
+
+    @classmethod
+    def default(cls):
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = IOLoop()
+            return cls._default
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def in_loop(self):
+        return self._thread.ident == get_ident()
+
+    def call(self, funct, *args):
+        '''
+            Runs funct(*args) on the loop thread, now if already on it
+        '''
+        if self.in_loop():
+            funct(*args)
+        else:
+            self.loop.call_soon_threadsafe(funct, *args)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+class AsyncIOServer(object):
+    '''
+        :param log_file: CSV log of frames
+        :param capture:  PcapngWriter to capture frames in
+        :param io_loop:  IOLoop to run on, defaults to one per process
+    '''
+    def __init__(self, rx_port=5556, tx_port=5555, log_file=None,
+                 msg_codec=codec.AUTO, capture=None, io_loop=None):
+        self.rx_port = rx_port
+        self.tx_port = tx_port
+        self.io_loop = io_loop if io_loop is not None else IOLoop.default()
+        self.rx_socket = self.io_loop.context.socket(zmq.SUB)
+        self.rx_socket.connect("tcp://localhost:%s" % self.rx_port)
+        self.tx_socket = self.io_loop.context.socket(zmq.PUB)
+        self.tx_socket.bind("tcp://*:%s" % self.tx_port)
+        self.connection = codec.Connection(msg_codec, initial=codec.BINARY)
+        self.handlers = {}
+        self._task = None
+        self.capture = capture
+        self.packet_log = None
+        if log_file is not None:
+            self.packet_log = open(log_file, 'wt')
+            self.packet_log.write("Direction, Time, Topic, Data\n")
+
+    def register_topic(self, topic, method):
+        log.debug("Registering RX_Port: %s, Topic: %s" % (self.rx_port, topic))
+        self.io_loop.call(self.rx_socket.setsockopt, zmq.SUBSCRIBE,
+                          topic.encode("utf-8"))
+        self.handlers[topic] = method
+
+    def start(self):
+        self.io_loop.call(self._start)
+
+    def _start(self):
+        self.io_loop.servers.add(self)
+        self._task = self.io_loop.loop.create_task(self.run())
+
+    async def run(self):
+        try:
+            while True:
+                frames = await self.rx_socket.recv_multipart()
+                topic, data = self.connection.decode(frames)
+                log.debug("Received: %s %s" % (topic, data))
+                if self.capture is not None:
+                    self.capture.capture_msg(self.rx_port, topic, data,
+                                             OUTBOUND)
+                if self.packet_log and 'frame' in data:
+                    self.packet_log.write("Received, %i, %s, %s\n" % (
+                        time.time(), topic, binascii.hexlify(data['frame'])))
+                method = self.handlers.get(topic)
+                if method is None:
+                    log.error("Unhandled topic received: %s" % topic)
+                    continue
+                try:
+                    result = method(self, data)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    log.exception("Error in handler for %s" % topic)
+        except asyncio.CancelledError:
+            pass
+        log.debug("IO Server Stopped")
+
+    def shutdown(self):
+        log.debug("Stopping Async IO Server")
+        self.io_loop.call(self._shutdown)
+
+    def _shutdown(self):
+        self.io_loop.servers.discard(self)
+        if self._task is not None and not self._task.done():
+            # Close once run has seen the cancel
+            self._task.add_done_callback(lambda task: self._close())
+            self._task.cancel()
+        else:
+            self._close()
+
+    def _close(self):
+        self.rx_socket.close(linger=0)
+        self.tx_socket.close(linger=0)
+        if self.packet_log:
+            self.packet_log.close()
+            self.packet_log = None
+
+    def join(self, timeout=None):
+        '''
+            Compatibility with IOServer, the loop thread is shared
+        '''
+        pass
+
+    def send_msg(self, topic, data):
+        self.io_loop.call(self._send_msg, topic, data)
+
+    def _send_msg(self, topic, data):
+        if self.tx_socket.closed:
+            return
+        self.connection.send(self.tx_socket, topic, data)
+        if self.capture is not None:
+            self.capture.capture_msg(self.rx_port, topic, data, INBOUND)
+        if self.packet_log and 'frame' in data:
+            self.packet_log.write("Sent, %i, %s, %s\n" % (
+                time.time(), topic, binascii.hexlify(data['frame'])))
@@ -0,0 +1,232 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+'''
+    pcapng capture of frames passing through IO servers.
+
+    PcapngWriter.write only stamps and queues the frame, a background thread
+    encodes and writes the blocks through a large buffer and flushes it
+    every flush_interval seconds.  Captures can be rotated by size and/or
+    time, rotated files are named <name>_<n>.pcapng.
+
+    Each (IO server port, interface_id) pair gets its own pcapng interface.
+    Direction flags are from the emulated device's view, frames it sent
+    (tx_frame) are outbound and frames sent to it (rx_frame) inbound.
+'''
+import os
+import struct
+import time
+from collections import deque
+from threading import Thread, Condition
+import logging
+log = logging.getLogger(__name__)
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_IEEE802_15_4_NOFCS = 230  # Models exchange frames without FCS
+
+# Link type by the peripheral model in the message topic
+TOPIC_LINKTYPES = {'EthernetModel': LINKTYPE_ETHERNET,
+                   'IEEE802_15_4': LINKTYPE_IEEE802_15_4_NOFCS}
+
+INBOUND = 1
+OUTBOUND = 2
+
+SHB_TYPE = 0x0A0D0D0A
+IDB_TYPE = 0x00000001
+EPB_TYPE = 0x00000006
+BYTE_ORDER_MAGIC = 0x1A2B3C4D
+OPT_ENDOFOPT = 0
+IF_NAME = 2
+IF_TSRESOL = 9
+EPB_FLAGS = 2
+SNAPLEN = 0x40000
+
+
+def _pad(data):
+    return data + b'\x00' * (-len(data) % 4)
+
+
+def _option(code, value):
+    return struct.pack('<HH', code, len(value)) + _pad(value)
+
+
+def _block(block_type, body):
+    length = len(body) + 12
+    return struct.pack('<II', block_type, length) + body + \
+        struct.pack('<I', length)
+
+
+def section_header():
+    return _block(SHB_TYPE, struct.pack('<IHHq', BYTE_ORDER_MAGIC, 1, 0, -1))
+
+
+def interface_description(link_type, name):
+    options = _option(IF_NAME, name.encode('utf-8')) + \
+        _option(IF_TSRESOL, b'\x09') + _option(OPT_ENDOFOPT, b'')
+    return _block(IDB_TYPE, struct.pack('<HHI', link_type, 0, SNAPLEN) +
+                  options)
+
+
+def enhanced_packet(if_id, timestamp_ns, frame, direction=None):
+    body = struct.pack('<IIIII', if_id, timestamp_ns >> 32,
+                       timestamp_ns & 0xFFFFFFFF, len(frame), len(frame))
+    body += _pad(bytes(frame))
+    if direction is not None:
+        body += _option(EPB_FLAGS, struct.pack('<I', direction)) + \
+            _option(OPT_ENDOFOPT, b'')
+    return _block(EPB_TYPE, body)
+
+
+class PcapngWriter(object):
+    '''
+        :param filename:        Capture file
+        :param rotate_size:     Start a new file after this many bytes
+        :param rotate_interval: Start a new file after this many seconds
+        :param flush_interval:  Max seconds frames stay buffered
+        :param max_queued:      Frames queued before new ones are dropped
+    '''
+    def __init__(self, filename, rotate_size=None, rotate_interval=None,
+                 flush_interval=1.0, max_queued=65536):
+        self.filename = filename
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.flush_interval = flush_interval
+        self.max_queued = max_queued
+        self.dropped = 0
+        self.written = 0
+        self._queue = deque()
+        self._cond = Condition()
+        self._running = True
+        self._file = None
+        self._file_num = 0
+        self._open()
+        self._thread = Thread(target=self._run, daemon=True,
+                              name="PcapngWriter")
+        self._thread.start()
+
+    def _next_filename(self):
+        if self.rotate_size is None and self.rotate_interval is None:
+            return self.filename
+        stem, ext = os.path.splitext(self.filename)
+        name = "%s_%i%s" % (stem, self._file_num, ext or '.pcapng')
+        self._file_num += 1
+        return name
+
+    def _open(self):
+        if self._file is not None:
+            self._file.close()
+        name = self._next_filename()
+        log.info("Writing capture to %s" % name)
+        self._file = open(name, 'wb', buffering=1024 * 1024)
+        self._file.write(section_header())
+        self._size = 0
+        self._opened = time.monotonic()
+        self._interfaces = {}  # (key, link_type): interface id in file
+
+    def write(self, link_type, interface, frame, direction=None,
+              timestamp_ns=None):
+        '''
+            Queues frame for writing, safe to call from any thread
+
+            :param interface: Name of the interface frame was seen on
+            :returns False if dropped because the queue is full
+        '''
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        with self._cond:
+            if len(self._queue) >= self.max_queued:
+                self.dropped += 1
+                return False
+            self._queue.append((timestamp_ns, link_type, interface,
+                                bytes(frame), direction))
+            if len(self._queue) == 1:
+                self._cond.notify()
+        return True
+
+    def capture_msg(self, port, topic, msg, direction):
+        '''
+            Captures the frame in a peripheral message, messages without
+            a frame or from unknown models are ignored
+        '''
+        frame = msg.get('frame') if isinstance(msg, dict) else None
+        if frame is None:
+            return
+        link_type = TOPIC_LINKTYPES.get(topic.split('.')[1]
+                                        if topic.count('.') >= 2 else None)
+        if link_type is None:
+            return
+        interface = "%s:%s" % (port, msg.get('interface_id', 0))
+        self.write(link_type, interface, frame, direction)
+
+    def _if_id(self, link_type, interface):
+        key = (interface, link_type)
+        if key not in self._interfaces:
+            self._interfaces[key] = len(self._interfaces)
+            self._emit(interface_description(link_type, interface))
+        return self._interfaces[key]
+
+    def _emit(self, block):
+        self._file.write(block)
+        self._size += len(block)
+
+    def _rotate_due(self):
+        if self.rotate_size is not None and self._size >= self.rotate_size:
+            return True
+        return self.rotate_interval is not None and \
+            time.monotonic() - self._opened >= self.rotate_interval
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            with self._cond:
+                if not self._queue and self._running:
+                    self._cond.wait(self.flush_interval)
+                records = self._queue
+                self._queue = deque()
+                running = self._running
+            for (ts, link_type, interface, frame, direction) in records:
+                if self._rotate_due():
+                    self._open()
+                if_id = self._if_id(link_type, interface)
+                self._emit(enhanced_packet(if_id, ts, frame, direction))
+                self.written += 1
+            now = time.monotonic()
+            if not running or now - last_flush >= self.flush_interval:
+                self._file.flush()
+                last_flush = now
+            if not running:
+                return
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+        self._file.close()
+        log.info("Capture: %i frames written, %i dropped" %
+                 (self.written, self.dropped))
+
+
+def add_arguments(parser):
+    '''
+        Adds the capture options to an ArgumentParser
+    '''
+    parser.add_argument('--pcap', default=None,
+                        help='Capture frames to this pcapng file')
+    parser.add_argument('--pcap_rotate_mb', default=None, type=float,
+                        help='Start a new capture file after this many MB')
+    parser.add_argument('--pcap_rotate_secs', default=None, type=float,
+                        help='Start a new capture file after this many seconds')
+
+
+def from_args(args):
+    '''
+        :returns PcapngWriter for the options from add_arguments or None
+    '''
+    if args.pcap is None:
+        return None
+    rotate_size = None
+    if args.pcap_rotate_mb is not None:
+        rotate_size = int(args.pcap_rotate_mb * 1024 * 1024)
+    return PcapngWriter(args.pcap, rotate_size, args.pcap_rotate_secs)
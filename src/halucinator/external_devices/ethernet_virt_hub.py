@@ -3,84 +3,163 @@
 # certain rights in this software.
 
 from .ioserver import IOServer
+from .async_ioserver import AsyncIOServer
+from ..peripheral_models import codec
 from .trigger_interrupt import SendInterrupt
-from threading import Thread, Event
+from .flow_control import CreditGate
+from .host_bridge import open_bridge
+from . import capture
+from threading import Thread, Event, Lock
+from collections import defaultdict
 import logging
 import time
-import socket
-import scapy.all as scapy
-import os
 
 log = logging.getLogger(__name__)
 
+DEFAULT_VLAN = 1
+HOST_INTERFACE_ID = 1073905664
+
 
 class HostEthernetServer(Thread):
-    def __init__(self, interface, enable_rx=False):
+    '''
+        Bridges the hub to a host interface (raw socket) or to a TAP device
+        created on start up (tap=True).  Frames from the host are sent to
+        the hub with interface_id.
+    '''
+    def __init__(self, interface, enable_rx=False, tap=False,
+                 interface_id=HOST_INTERFACE_ID):
         Thread.__init__(self)
         self.interface = interface
         self.__stop = Event()
         self.enable_rx = enable_rx
-
-        os.system('ip link set %s promisc on' %
-                  interface)  # Set to permisucous
-        ETH_P_ALL = 3
-        self.host_socket = socket.socket(
-            socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
-        self.host_socket.bind((interface, 0))
-        self.host_socket.settimeout(1.0)
+        self.interface_id = interface_id
+        self.bridge = open_bridge(interface, tap)
         self.handler = None
 
     def register_topic(self, topic, method):
         log.debug("Registering Host Ethernet Receiver Topic: %s" % topic)
-        # self.rx_socket.setsockopt(zmq.SUBSCRIBE, topic)
-        self.handler = method
+        # Frames from the host are the only messages this server produces
+        if topic.endswith('tx_frame'):
+            self.handler = method
 
     def run(self):
         while self.enable_rx and not self.__stop.is_set():
-            try:
-                frame = self.host_socket.recv(2048)
-                data = {'interface_id': msg_id, 'frame': frame}
-                msg = encode_zmq_msg(topic, data)
-                self.handler(self, data)
-            except socket.timeout:
-                pass
+            for frame in self.bridge.recv_batch():
+                if self.handler is not None:
+                    self.handler(self, {'interface_id': self.interface_id,
+                                        'frame': frame})
 
         log.debug("Shutting Down Host Ethernet RX")
 
     def send_msg(self, topic, msg):
-        frame = msg['frame']
-        p = scapy.Raw(frame)
-        scapy.sendp(p, iface=self.interface)
+        if topic.endswith('rx_frame'):
+            self.bridge.send(msg['frame'])
 
     def shutdown(self):
         log.debug("Stopping Host Ethernet Server")
         self.__stop.set()
+        if self.enable_rx and self.is_alive():
+            self.join()
+        self.bridge.close()
 
 
 class ViruatalEthHub(object):
-    def __init__(self, ioservers=[]):
+    '''
+        Bridges Ethernet frames between servers.  As a hub every frame is
+        sent to every other server.  As a learning switch the source MAC
+        of each frame is learned for the server it came from, unicast
+        frames go only to the learned server and broadcast, multicast, or
+        unknown destinations are flooded.  Learned entries expire after
+        aging_time seconds without traffic.  Servers can be put in VLANs,
+        frames are only forwarded between servers in the same VLAN.
+        Frames arrive from each server's receive thread, the MAC table and
+        counts are guarded by a lock.
+    '''
+    def __init__(self, ioservers=[], switch=False, aging_time=300):
         '''
             args:
             ioserver:  list of ioservers to bridge together
+            switch:    Forward as a learning switch instead of a hub
+            aging_time: Seconds a learned MAC is kept without traffic
         '''
         self.ioservers = []
         self.host_socket = None
         self.host_interface = None
+        self.gate = CreditGate()
+        self.switch = switch
+        self.aging_time = aging_time
+        self.vlans = {}        # server: vlan
+        self.mac_table = {}    # (vlan, mac): (server, last seen)
+        self._lock = Lock()
+        self.last_aged = time.monotonic()
+        self.counts = defaultdict(int)
         for server in ioservers:
             self.add_server(server)
 
-    def add_server(self, ioserver):
+    def add_server(self, ioserver, vlan=DEFAULT_VLAN):
         self.ioservers.append(ioserver)
+        self.vlans[ioserver] = vlan
         ioserver.register_topic('Peripheral.EthernetModel.tx_frame',
                                 self.received_frame)
+        ioserver.register_topic('Peripheral.EthernetModel.rx_credit',
+                                self.gate.credit)
 
     def received_frame(self, from_server, msg):
-        for server in self.ioservers:
-            log.info('Forwarding, msg')
-            if server != from_server:
-                server.send_msg('Peripheral.EthernetModel.rx_frame', msg)
+        vlan = self.vlans.get(from_server, DEFAULT_VLAN)
+        if not self.switch:
+            with self._lock:
+                self.counts['flooded'] += 1
+            dests = [s for s in self.ioservers if s != from_server and
+                     self.vlans[s] == vlan]
+        else:
+            dests = self.lookup(from_server, vlan, msg['frame'])
+        for server in dests:
+            log.debug('Forwarding, msg')
+            self.gate.send(server, 'Peripheral.EthernetModel.rx_frame', msg)
+
+    def lookup(self, from_server, vlan, frame):
+        '''
+            Learns the source MAC of frame and returns the servers it
+            should be sent to
+        '''
+        dst = bytes(frame[0:6])
+        src = bytes(frame[6:12])
+        with self._lock:
+            now = time.monotonic()
+            if now - self.last_aged > self.aging_time / 2.0:
+                self._age(now)
+            if not src[0] & 1:  # Never learn group addresses
+                self.mac_table[(vlan, src)] = (from_server, now)
+            entry = self.mac_table.get((vlan, dst))
+            if not dst[0] & 1 and entry is not None and \
+                    now - entry[1] <= self.aging_time:
+                if entry[0] == from_server:
+                    self.counts['filtered'] += 1
+                    return []
+                self.counts['forwarded'] += 1
+                return [entry[0]]
+            self.counts['flooded'] += 1
+        return [s for s in self.ioservers if s != from_server and
+                self.vlans[s] == vlan]
+
+    def age(self, now=None):
+        '''
+            Removes MAC table entries not seen within aging_time
+        '''
+        with self._lock:
+            self._age(time.monotonic() if now is None else now)
+
+    def _age(self, now):
+        '''
+            age with the lock held
+        '''
+        self.last_aged = now
+        for key, (server, seen) in list(self.mac_table.items()):
+            if now - seen > self.aging_time:
+                del self.mac_table[key]
 
     def shutdown(self):
+        log.info("Eth Hub: %s" % dict(self.counts))
         for server in self.ioservers:
             log.debug("Eth Hub:Shutting Down")
             server.shutdown()
@@ -98,28 +177,55 @@ def main():
     p.add_argument('-p', '--enable_host_rx', required=False, default=False,
                    action='store_true',
                    help='Enable Recieving data from host interface, requires -i')
+    p.add_argument('--tap', default=False, action='store_true',
+                   help='Create TAP device named -i instead of using an '
+                        'existing interface')
+    p.add_argument('--codec', default=codec.AUTO, choices=codec.CODECS,
+                   help='Message wire format')
+    p.add_argument('-a', '--async_io', default=False, action='store_true',
+                   help='Serve all emulators from one asyncio event loop '
+                        'instead of a thread per emulator')
+    p.add_argument('-s', '--switch', default=False, action='store_true',
+                   help='Forward as a MAC learning switch instead of a hub')
+    p.add_argument('--aging', default=300, type=float,
+                   help='Seconds before an unused learned MAC is forgotten')
+    p.add_argument('--vlans', nargs='+', type=int, default=None,
+                   help='VLAN of each rx_port (host interface uses the '
+                        'first), length must match --rx_ports')
+    capture.add_arguments(p)
     args = p.parse_args()
 
     if len(args.rx_ports) != len(args.tx_ports):
         print("Number of rx_ports and number of tx_ports must match")
         p.print_usage()
         quit(-1)
+    vlans = args.vlans
+    if vlans is None:
+        vlans = [DEFAULT_VLAN] * len(args.rx_ports)
+    elif len(vlans) != len(args.rx_ports):
+        print("Number of vlans and number of rx_ports must match")
+        p.print_usage()
+        quit(-1)
 
     logging.basicConfig()
     #log = logging.getLogger()
     log.setLevel(logging.DEBUG)
 
-    hub = ViruatalEthHub()
+    hub = ViruatalEthHub(switch=args.switch, aging_time=args.aging)
+    pcap = capture.from_args(args)
 
     if args.interface is not None:
-        host_eth = HostEthernetServer(args.interface, args.enable_host_rx)
-        hub.add_server(host_eth)
+        host_eth = HostEthernetServer(args.interface, args.enable_host_rx,
+                                      args.tap)
+        hub.add_server(host_eth, vlans[0])
         host_eth.start()
 
     for idx, rx_port in enumerate(args.rx_ports):
         print(idx)
-        server = IOServer(rx_port, args.tx_ports[idx])
-        hub.add_server(server)
+        server_cls = AsyncIOServer if args.async_io else IOServer
+        server = server_cls(rx_port, args.tx_ports[idx], msg_codec=args.codec,
+                            capture=pcap)
+        hub.add_server(server, vlans[idx])
         if idx == 0:
             interrupter = SendInterrupt(server)
 
@@ -137,6 +243,8 @@ def main():
         pass
     log.info("Shutting Down")
     hub.shutdown()
+    if pcap is not None:
+        pcap.close()
     # io_server.join()
 
 if __name__ == '__main__':
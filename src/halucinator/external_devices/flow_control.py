@@ -0,0 +1,53 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+from collections import defaultdict, deque
+from threading import Lock
+import logging
+log = logging.getLogger(__name__)
+
+
+class CreditGate(object):
+    '''
+        Holds messages for servers whose emulator sent an rx_credit message
+        with 0 credits (its frame queue uses the pause policy and is full).
+        Held messages are sent once credits arrive, at most backlog
+        messages are held per server, older ones are dropped.
+    '''
+    def __init__(self, backlog=1024):
+        self.backlog = backlog
+        self._lock = Lock()
+        self._paused = set()
+        self._held = defaultdict(lambda: deque(maxlen=self.backlog))
+        self.dropped = defaultdict(int)
+
+    def credit(self, server, msg):
+        '''
+            Handler for rx_credit messages from server
+        '''
+        credits = msg['credits']
+        with self._lock:
+            if credits == 0:
+                log.info("Pausing sends to %s" % server)
+                self._paused.add(server)
+                return
+            self._paused.discard(server)
+            held = self._held.pop(server, ())
+        log.info("Resuming sends to %s, %i credits, %i held" %
+                 (server, credits, len(held)))
+        for topic, held_msg in held:
+            server.send_msg(topic, held_msg)
+
+    def send(self, server, topic, msg):
+        '''
+            Sends msg to server, or holds it if server is paused
+        '''
+        with self._lock:
+            if server in self._paused:
+                held = self._held[server]
+                if len(held) == held.maxlen:
+                    self.dropped[server] += 1
+                held.append((topic, msg))
+                return
+        server.send_msg(topic, msg)
@@ -7,7 +7,7 @@ import zmq
 from multiprocessing import Process
 import os
 import time
-from ..peripheral_models.peripheral_server import encode_zmq_msg, decode_zmq_msg
+from ..peripheral_models import codec
 
 
 __run_server = True
@@ -25,14 +25,14 @@ def rx_from_emulator(emu_rx_port):
     mq_socket = context.socket(zmq.SUB)
     mq_socket.connect("tcp://localhost:%s" % emu_rx_port)
     #mq_socket.setsockopt(zmq.SUBSCRIBE, "GPIO.write_pin")
-    mq_socket.setsockopt(zmq.SUBSCRIBE, '')
+    mq_socket.setsockopt(zmq.SUBSCRIBE, b'')
     #mq_socket.setsockopt(zmq.SUBSCRIBE, "GPIO.toggle_pin")
+    connection = codec.Connection()
 
     print("Setup GPIO Listener")
     while (__run_server):
-        msg = mq_socket.recv_string()
-        print("Got from emulator:", msg)
-        topic, data = decode_zmq_msg(msg)
+        topic, data = connection.recv(mq_socket)
+        print("Got from emulator:", topic, data)
         print("Pin: ", data['id'], "Value", data['value'])
 
 
@@ -51,8 +51,7 @@ def update_gpio(emu_tx_port):
             #pin = raw_input("Pin: ")
             #value = raw_input("Value: ")
             #data = {'id':pin, 'value':int(value)}
-            #msg = encode_zmq_msg(topic, data)
-            # to_emu_socket.send(msg)
+            # connection.send(to_emu_socket, topic, data)
     except KeyboardInterrupt:
         __run_server = False
 
@@ -0,0 +1,130 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+'''
+    Sends and receives raw Ethernet frames on a host interface, either by an
+    AF_PACKET socket bound to an existing interface or by creating a TAP
+    device.  Frames are written directly to the socket/device and reads
+    drain everything available in one call (recv_batch).  Requires root
+    (or CAP_NET_RAW/CAP_NET_ADMIN).
+'''
+import fcntl
+import os
+import select
+import socket
+import struct
+import logging
+log = logging.getLogger(__name__)
+
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_MR_PROMISC = 1
+
+TUNSETIFF = 0x400454ca
+IFF_TAP = 0x0002
+IFF_NO_PI = 0x1000
+SIOCGIFFLAGS = 0x8913
+SIOCSIFFLAGS = 0x8914
+IFF_UP = 0x1
+IFREQ_FLAGS = struct.Struct('16sH22x')  # struct ifreq with ifr_flags
+
+MAX_FRAME = 65535
+
+
+class RawBridge(object):
+    '''
+        AF_PACKET socket bound to interface, in promiscuous mode.  Frames
+        other programs on the host send on interface (pkttype outgoing) are
+        received too, the kernel does not return the frames this socket
+        sends so they need no filtering.
+    '''
+    def __init__(self, interface):
+        self.interface = interface
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW,
+                                  socket.htons(ETH_P_ALL))
+        self.sock.bind((interface, 0))
+        ifindex = socket.if_nametoindex(interface)
+        mreq = struct.pack('iHH8s', ifindex, PACKET_MR_PROMISC, 0, b'')
+        self.sock.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, mreq)
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, frame):
+        select.select([], [self.sock], [])
+        self.sock.send(frame)
+
+    def _recv(self):
+        return self.sock.recv(MAX_FRAME)
+
+    def recv_batch(self, max_frames=64, timeout=1.0):
+        '''
+            Waits up to timeout seconds for a frame then returns all frames
+            available (up to max_frames)
+        '''
+        return _recv_batch(self, max_frames, timeout)
+
+    def close(self):
+        self.sock.close()
+
+
+class TapBridge(object):
+    '''
+        TAP device created (or attached to if it exists) with name interface
+        and brought up, frames written to it are received by the host stack
+    '''
+    def __init__(self, interface):
+        self.interface = interface
+        self.fd = os.open('/dev/net/tun', os.O_RDWR | os.O_NONBLOCK)
+        ifr = IFREQ_FLAGS.pack(interface.encode('utf-8'), IFF_TAP | IFF_NO_PI)
+        fcntl.ioctl(self.fd, TUNSETIFF, ifr)
+        ctl = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            ifr = IFREQ_FLAGS.pack(interface.encode('utf-8'), 0)
+            name, flags = IFREQ_FLAGS.unpack_from(
+                fcntl.ioctl(ctl, SIOCGIFFLAGS, ifr))
+            fcntl.ioctl(ctl, SIOCSIFFLAGS, IFREQ_FLAGS.pack(name, flags | IFF_UP))
+        finally:
+            ctl.close()
+        log.info("Created TAP %s" % interface)
+
+    def fileno(self):
+        return self.fd
+
+    def send(self, frame):
+        select.select([], [self.fd], [])
+        os.write(self.fd, frame)
+
+    def _recv(self):
+        return os.read(self.fd, MAX_FRAME)
+
+    def recv_batch(self, max_frames=64, timeout=1.0):
+        return _recv_batch(self, max_frames, timeout)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _recv_batch(bridge, max_frames, timeout):
+    readable, _, _ = select.select([bridge], [], [], timeout)
+    frames = []
+    if not readable:
+        return frames
+    while len(frames) < max_frames:
+        try:
+            frames.append(bridge._recv())
+        except (BlockingIOError, InterruptedError):
+            break
+    return frames
+
+
+def open_bridge(interface, tap=False):
+    '''
+        :returns TapBridge if tap else RawBridge for interface
+    '''
+    if tap:
+        return TapBridge(interface)
+    return RawBridge(interface)
@@ -3,14 +3,13 @@
 # certain rights in this software.
 
 from os import sys, path
-from ..peripheral_models.peripheral_server import encode_zmq_msg, decode_zmq_msg
+from ..peripheral_models import codec
 import zmq
 from multiprocessing import Process
 import os
-import socket
 import time
 import binascii
-import scapy.all as scapy
+from .host_bridge import open_bridge
 
 __run_server = True
 __host_socket = None
@@ -29,18 +28,16 @@ def rx_from_emulator(emu_rx_port, interface):
     context = zmq.Context()
     mq_socket = context.socket(zmq.SUB)
     mq_socket.connect("tcp://localhost:%s" % emu_rx_port)
-    mq_socket.setsockopt(zmq.SUBSCRIBE, topic)
+    mq_socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+    connection = codec.Connection()
 
     while (__run_server):
-        msg = mq_socket.recv_string()
         # print "Got from emulator:", msg
-        topic, data = decode_zmq_msg(msg)
+        topic, data = connection.recv(mq_socket)
         frame = data['frame']
         # if len(frame) < 64:
         #    frame = frame +('\x00' * (64-len(frame)))
-        p = scapy.Raw(frame)
-        scapy.sendp(p, iface=interface)
-        # __host_socket.send(frame)
+        __host_socket.send(frame)
         print("Sending Frame (%i) on eth: %s" %
               (len(frame), binascii.hexlify(frame)))
 
@@ -52,34 +49,34 @@ def rx_from_host(emu_tx_port, msg_id):
     context = zmq.Context()
     to_emu_socket = context.socket(zmq.PUB)
     to_emu_socket.bind("tcp://*:%s" % emu_tx_port)
+    connection = codec.Connection(initial=codec.BINARY)
 
     while (__run_server):
-        pass
-        # Listen for frame from host
-        frame = __host_socket.recv(2048)
-        data = {'interface_id': msg_id, 'frame': frame}
-        msg = encode_zmq_msg(topic, data)
-        to_emu_socket.send_string(msg)
-        print("Sent message to emulator ", binascii.hexlify(frame))
+        # Listen for frames from host
+        for frame in __host_socket.recv_batch():
+            data = {'interface_id': msg_id, 'frame': frame}
+            connection.send(to_emu_socket, topic, data)
+            print("Sent message to emulator ", binascii.hexlify(frame))
 
 
-def start(interface, emu_rx_port=5556, emu_tx_port=5555, msg_id=1073905664):
+def start(interface, emu_rx_port=5556, emu_tx_port=5555, msg_id=1073905664,
+          tap=False):
+    '''
+        :param tap: Create a TAP device named interface instead of using
+                    an existing interface
+    '''
     global __run_server
     global __host_socket
-    # Open socket to send raw frames on ethernet adapter
-    os.system('ip link set %s promisc on' % interface)  # Set to permisucous
-    # os.system('ethtool -K %s tx off' % interface)
-
-    ETH_P_ALL = 3
-    __host_socket = socket.socket(
-        socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
-    __host_socket.bind((interface, 0))
+    # Open raw socket (promiscuous) or TAP device to send frames on
+    __host_socket = open_bridge(interface, tap)
 
     print("Starting Servers")
     emu_rx_process = Process(target=rx_from_emulator,
-                             args=(emu_rx_port, interface)).start()
+                             args=(emu_rx_port, interface))
+    emu_rx_process.start()
     emu_tx_process = Process(
-        target=rx_from_host, args=(emu_tx_port, msg_id)).start()
+        target=rx_from_host, args=(emu_tx_port, msg_id))
+    emu_tx_process.start()
     try:
         while (1):
             time.sleep(0.1)
@@ -101,8 +98,11 @@ def main():
                    help='Ethernet Interace to listen to')
     p.add_argument('--id', default=1073905664,
                    help='Ethernet Interace to listen to')
+    p.add_argument('--tap', default=False, action='store_true',
+                   help='Create TAP device named -i instead of using an '
+                        'existing interface')
     args = p.parse_args()
-    start(args.interface, args.rx_port, args.tx_port, args.id)
+    start(args.interface, args.rx_port, args.tx_port, args.id, args.tap)
 
 
 if __name__ == '__main__':
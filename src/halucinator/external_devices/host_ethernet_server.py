@@ -7,7 +7,7 @@ import zmq
 from multiprocessing import Process
 import os
 import time
-from ..peripheral_models.peripheral_server import encode_zmq_msg, decode_zmq_msg
+from ..peripheral_models import codec
 from threading import Thread, Event
 import binascii
 import logging
@@ -16,7 +16,8 @@ log = logging.getLogger(__name__)
 
 class IOServer(Thread):
 
-    def __init__(self, rx_port=5556, tx_port=5555, log_file=None):
+    def __init__(self, rx_port=5556, tx_port=5555, log_file=None,
+                 msg_codec=codec.AUTO):
         Thread.__init__(self)
         self.rx_port = rx_port
         self.tx_port = tx_port
@@ -26,6 +27,7 @@ class IOServer(Thread):
         self.rx_socket.connect("tcp://localhost:%s" % self.rx_port)
         self.tx_socket = self.context.socket(zmq.PUB)
         self.tx_socket.bind("tcp://*:%s" % self.tx_port)
+        self.connection = codec.Connection(msg_codec, initial=codec.BINARY)
         self.handlers = {}
         self.packet_log = None
         if log_file is not None:
@@ -39,9 +41,8 @@ class IOServer(Thread):
 
     def run(self):
         while not self.__stop.is_set():
-            msg = self.rx_socket.recv_string()
-            log.debug("Received: %s" % str(msg))
-            topic, data = decode_zmq_msg(msg)
+            topic, data = self.connection.recv(self.rx_socket)
+            log.debug("Received: %s %s" % (topic, data))
             if self.packet_log:
                 self.packet_log.write("Sent, %i, %s, %s\n" % (
                     time.time(), topic, binascii.hexlify(data['frame'])))
@@ -56,8 +57,7 @@ class IOServer(Thread):
             self.packet_log.close()
 
     def send_msg(self, topic, data):
-        msg = encode_zmq_msg(topic, data)
-        self.tx_socket.send_string(msg)
+        self.connection.send(self.tx_socket, topic, data)
         if self.packet_log:
             # TODO, make logging more generic so will work for non-frames
             if 'frame' in data:
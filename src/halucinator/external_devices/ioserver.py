@@ -7,7 +7,8 @@ import zmq
 from multiprocessing import Process
 import os
 import time
-from ..peripheral_models.peripheral_server import encode_zmq_msg, decode_zmq_msg
+from ..peripheral_models import codec
+from .capture import INBOUND, OUTBOUND
 from threading import Thread, Event
 import binascii
 import logging
@@ -15,8 +16,13 @@ log = logging.getLogger(__name__)
 
 
 class IOServer(Thread):
-
-    def __init__(self, rx_port=5556, tx_port=5555, log_file=None):
+    '''
+        :param log_file: CSV log of frames
+        :param capture:  PcapngWriter to capture frames in, can be shared
+                         by several servers
+    '''
+    def __init__(self, rx_port=5556, tx_port=5555, log_file=None,
+                 msg_codec=codec.AUTO, capture=None):
         Thread.__init__(self)
         self.rx_port = rx_port
         self.tx_port = tx_port
@@ -26,10 +32,12 @@ class IOServer(Thread):
         self.rx_socket.connect("tcp://localhost:%s" % self.rx_port)
         self.tx_socket = self.context.socket(zmq.PUB)
         self.tx_socket.bind("tcp://*:%s" % self.tx_port)
+        self.connection = codec.Connection(msg_codec, initial=codec.BINARY)
 
         self.poller = zmq.Poller()
         self.poller.register(self.rx_socket, zmq.POLLIN)
         self.handlers = {}
+        self.capture = capture
         self.packet_log = None
         if log_file is not None:
             self.packet_log = open(log_file, 'wt')
@@ -45,13 +53,14 @@ class IOServer(Thread):
         while not self.__stop.is_set():
             socks = dict(self.poller.poll(1000))
             if self.rx_socket in socks and socks[self.rx_socket] == zmq.POLLIN:
-                msg = self.rx_socket.recv_string()
-                log.debug("Received: %s" % str(msg))
-                topic, data = decode_zmq_msg(msg)
-                if self.packet_log:
-                    self.packet_log.write("Sent, %i, %s, %s\n" % (
+                topic, data = self.connection.recv(self.rx_socket)
+                log.debug("Received: %s %s" % (topic, data))
+                if self.capture is not None:
+                    self.capture.capture_msg(self.rx_port, topic, data,
+                                             OUTBOUND)
+                if self.packet_log and 'frame' in data:
+                    self.packet_log.write("Received, %i, %s, %s\n" % (
                         time.time(), topic, binascii.hexlify(data['frame'])))
-                    self.packet_log.flush()
                 method = self.handlers[topic]
                 method(self, data)
         log.debug("IO Server Stopped")
@@ -63,15 +72,14 @@ class IOServer(Thread):
             self.packet_log.close()
 
     def send_msg(self, topic, data):
-        msg = encode_zmq_msg(topic, data)
-        self.tx_socket.send_string(msg)
+        self.connection.send(self.tx_socket, topic, data)
+        if self.capture is not None:
+            self.capture.capture_msg(self.rx_port, topic, data, INBOUND)
         if self.packet_log:
             # TODO, make logging more generic so will work for non-frames
             if 'frame' in data:
-
-                self.packet_log.write("Received, %i, %s, %s\n" % (
+                self.packet_log.write("Sent, %i, %s, %s\n" % (
                     time.time(), topic, binascii.hexlify(data['frame'])))
-                self.packet_log.flush()
 
 def main():
     from argparse import ArgumentParser
@@ -80,12 +88,14 @@ def main():
                    help='Port number to receive zmq messages for IO on')
     p.add_argument('-t', '--tx_port', default=5555,
                    help='Port number to send IO messages via zmq')
+    p.add_argument('--codec', default=codec.AUTO, choices=codec.CODECS,
+                   help='Message wire format')
     args = p.parse_args()
 
     import halucinator.hal_log as hal_log
     hal_log.setLogConfig()
     
-    io_server = IOServer(args.rx_port, args.tx_port)
+    io_server = IOServer(args.rx_port, args.tx_port, msg_codec=args.codec)
     io_server.start()
 
     try:
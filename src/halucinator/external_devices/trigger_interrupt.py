@@ -4,7 +4,6 @@
 
 from os import sys, path
 
-from ..peripheral_models.peripheral_server import encode_zmq_msg, decode_zmq_msg
 from .ioserver import IOServer
 import zmq
 import time
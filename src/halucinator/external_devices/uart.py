@@ -4,7 +4,6 @@
 
 
 import zmq
-from ..peripheral_models.peripheral_server import encode_zmq_msg, decode_zmq_msg
 from .ioserver import IOServer
 import logging
 log = logging.getLogger(__name__)
@@ -2,10 +2,8 @@
 # (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S. 
 # Government retains certain rights in this software.
 
-import IPython
 import threading
 import zmq
-from ..peripheral_models.peripheral_server import encode_zmq_msg, decode_zmq_msg
 from .ioserver import IOServer
 import logging
 
@@ -21,6 +19,7 @@ class VN8200XP(Thread):
 
     def write_handler(self, ioserver, msg):
         print((msg,))
+        import IPython
         IPython.embed()
 
     def send_data(self, id, chars):
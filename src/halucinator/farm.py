@@ -0,0 +1,316 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+'''
+    Runs many emulation instances at once.  Each instance gets its own
+    process, name (so output goes to tmp/<farm>_<n>/), and free rx, tx,
+    gdb and qmp ports.  Instances that crash are restarted, optionally an
+    Ethernet or 802.15.4 hub connects all instances.  When the farm stops
+    each instance's stats.yaml is summarized in tmp/<farm>/farm.yaml.
+
+    halucinator-farm -c config.yaml -N 16
+    halucinator-farm -j jobs.yaml --hub ethernet --timeout 600
+
+    jobs.yaml is a list of:
+        - config: [<config files>]   # Required
+          symbols: [<symbol files>]  # Optional
+          elf: <elf file>            # Optional
+          count: <int>               # Optional, instances of this job (1)
+'''
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import yaml
+from . import hal_config
+from . import hal_stats
+import logging
+log = logging.getLogger(__name__)
+
+PORTS_PER_INSTANCE = 4  # rx, tx, gdb, qmp (gdb + 1)
+HUBS = ('ethernet', '802_15_4')
+
+
+def port_free(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(('', port))
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def allocate_ports(count, base_port=10000, max_port=65000):
+    '''
+        Finds count blocks of PORTS_PER_INSTANCE consecutive free ports
+
+        :returns list of (rx_port, tx_port, gdb_port), qmp uses gdb_port + 1
+    '''
+    blocks = []
+    port = base_port
+    while len(blocks) < count:
+        if port + PORTS_PER_INSTANCE > max_port:
+            raise RuntimeError("Not enough free ports for %i instances" % count)
+        if all(port_free(p) for p in range(port, port + PORTS_PER_INSTANCE)):
+            blocks.append((port, port + 1, port + 2))
+        port += PORTS_PER_INSTANCE
+    return blocks
+
+
+def run_instance(job, name, ports, cache_dir):
+    '''
+        Process entry point, runs one emulation with output to
+        tmp/<name>/farm.log
+    '''
+    outdir = os.path.join('tmp', name)
+    os.makedirs(outdir, exist_ok=True)
+    log_fd = os.open(os.path.join(outdir, 'farm.log'),
+                     os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+
+    from . import main as hal_main
+    config = hal_config.load_config(job['config'], job.get('symbols', ()),
+                                    cache_dir)
+    if config is None:
+        log.error("Config invalid")
+        os._exit(2)
+    rx_port, tx_port, gdb_port = ports
+    hal_main.emulate_binary(config, name, rx_port=rx_port, tx_port=tx_port,
+                            gdb_port=gdb_port, elf_file=job.get('elf'))
+
+
+class Instance(object):
+    def __init__(self, job, name, ports):
+        self.job = job
+        self.name = name
+        self.ports = ports
+        self.process = None
+        self.started = None
+        self.restarts = 0
+        self.exit_codes = []
+        self.stopping = False
+        self.done = False
+
+    def start(self, ctx, cache_dir):
+        log.info("Starting %s, ports rx %i, tx %i, gdb %i" %
+                 ((self.name,) + self.ports))
+        self.process = ctx.Process(target=run_instance, name=self.name,
+                                   args=(self.job, self.name, self.ports,
+                                         cache_dir))
+        self.process.start()
+        self.started = time.monotonic()
+
+    def stop(self):
+        '''
+            Sends SIGINT so the instance writes its stats and shuts down
+        '''
+        self.stopping = True
+        if self.process is not None and self.process.is_alive():
+            os.kill(self.process.pid, signal.SIGINT)
+
+    def summary(self):
+        out = {'ports': {'rx': self.ports[0], 'tx': self.ports[1],
+                         'gdb': self.ports[2], 'qmp': self.ports[2] + 1},
+               'config': list(self.job['config']),
+               'restarts': self.restarts, 'exit_codes': self.exit_codes}
+        stats_file = os.path.join('tmp', self.name, 'stats.yaml')
+        if os.path.exists(stats_file):
+            try:
+                stats = hal_stats.load_stats(stats_file)
+            except Exception as e:
+                out['stats_error'] = str(e)
+            else:
+                out['stats_file'] = stats_file
+                for key in ('used_intercepts', 'bypassed_funcs'):
+                    if key in stats:
+                        out[key] = sorted(str(v) for v in stats[key])
+                if 'interrupts' in stats:
+                    out['interrupts'] = {k: v for k, v in
+                                         stats['interrupts'].items()
+                                         if k != 'irqs'}
+        return out
+
+
+class Farm(object):
+    '''
+        :param jobs:         List of job dicts (see module doc)
+        :param name:         Prefix of instance names
+        :param max_parallel: Max instances running at once
+        :param max_restarts: Times a crashed instance is restarted
+        :param timeout:      Seconds each instance runs before being stopped
+        :param hub:          None, 'ethernet', or '802_15_4'
+    '''
+    def __init__(self, jobs, name='farm', max_parallel=None, max_restarts=3,
+                 timeout=None, hub=None, base_port=10000,
+                 cache_dir=hal_config.DEFAULT_CACHE_DIR):
+        self.name = name
+        self.max_restarts = max_restarts
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.ctx = multiprocessing.get_context('spawn')
+        expanded = [job for job in jobs for _ in range(job.get('count', 1))]
+        self.max_parallel = max_parallel or len(expanded)
+        ports = allocate_ports(len(expanded), base_port)
+        self.instances = [Instance(job, "%s_%i" % (name, idx), ports[idx])
+                          for idx, job in enumerate(expanded)]
+        self.hub = None
+        self.servers = []
+        if hub is not None:
+            self._start_hub(hub)
+
+    def _start_hub(self, hub):
+        from .external_devices.async_ioserver import AsyncIOServer
+        if hub == 'ethernet':
+            from .external_devices.ethernet_virt_hub import ViruatalEthHub
+            self.hub = ViruatalEthHub(switch=True)
+        else:
+            from .external_devices.IEEE802_15_4 import IEEE802_15_4
+            self.hub = IEEE802_15_4()
+        for inst in self.instances:
+            rx_port, tx_port, _ = inst.ports
+            # Hub receives on the instance's tx port and sends to its rx port
+            server = AsyncIOServer(tx_port, rx_port)
+            self.hub.add_server(server)
+            server.start()
+            self.servers.append(server)
+
+    def running(self):
+        return [i for i in self.instances
+                if i.process is not None and not i.done]
+
+    def poll(self):
+        '''
+            Reaps exited instances, restarts crashed ones and starts queued
+            ones.  Returns False once every instance is done.
+        '''
+        now = time.monotonic()
+        for inst in self.running():
+            if inst.process.is_alive():
+                if self.timeout is not None and not inst.stopping and \
+                        now - inst.started > self.timeout:
+                    log.info("%s reached timeout" % inst.name)
+                    inst.stop()
+                continue
+            inst.process.join()
+            code = inst.process.exitcode
+            inst.exit_codes.append(code)
+            if inst.stopping or code == 0:
+                inst.done = True
+            elif inst.restarts < self.max_restarts:
+                log.warning("%s exited with %s, restarting" % (inst.name, code))
+                inst.restarts += 1
+                inst.start(self.ctx, self.cache_dir)
+            else:
+                log.error("%s exited with %s, giving up" % (inst.name, code))
+                inst.done = True
+        queued = [i for i in self.instances if i.process is None]
+        for inst in queued[:self.max_parallel - len(self.running())]:
+            inst.start(self.ctx, self.cache_dir)
+        return any(not i.done for i in self.instances)
+
+    def run(self, poll_interval=1.0):
+        try:
+            while self.poll():
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            log.info("Stopping farm")
+        self.stop()
+        return self.write_summary()
+
+    def stop(self, grace=10.0):
+        for inst in self.instances:
+            inst.stop()
+        deadline = time.monotonic() + grace
+        for inst in self.instances:
+            if inst.process is None:
+                continue
+            inst.process.join(max(0, deadline - time.monotonic()))
+            if inst.process.is_alive():
+                log.warning("%s did not stop, terminating" % inst.name)
+                inst.process.terminate()
+                inst.process.join()
+            if not inst.done:
+                inst.exit_codes.append(inst.process.exitcode)
+                inst.done = True
+        for server in self.servers:
+            server.shutdown()
+
+    def write_summary(self):
+        summary = {inst.name: inst.summary() for inst in self.instances}
+        outdir = os.path.join('tmp', self.name)
+        os.makedirs(outdir, exist_ok=True)
+        filename = os.path.join(outdir, 'farm.yaml')
+        with open(filename, 'w') as outfile:
+            yaml.safe_dump(summary, outfile)
+        log.info("Wrote farm summary to %s" % filename)
+        return summary
+
+
+def load_jobs(filename):
+    with open(filename, 'r') as infile:
+        jobs = yaml.safe_load(infile)
+    for job in jobs:
+        if isinstance(job['config'], str):
+            job['config'] = [job['config']]
+    return jobs
+
+
+def main():
+    from argparse import ArgumentParser
+    p = ArgumentParser()
+    p.add_argument('-c', '--config', action='append', default=[],
+                   help='Config file(s) for every instance, see halucinator -c')
+    p.add_argument('-s', '--symbols', action='append', default=[],
+                   help='Symbol file(s) for every instance')
+    p.add_argument('-e', '--elf', default=None,
+                   help='Elf file, required to use recorder')
+    p.add_argument('-N', '--num', default=1, type=int,
+                   help='Number of instances of --config to run')
+    p.add_argument('-j', '--jobs', default=None,
+                   help='YAML list of jobs, used instead of --config')
+    p.add_argument('-n', '--name', default='farm',
+                   help='Prefix for instance names and output directories')
+    p.add_argument('-P', '--max_parallel', default=None, type=int,
+                   help='Max instances running at once (default all)')
+    p.add_argument('--max_restarts', default=3, type=int,
+                   help='Times to restart an instance that crashes')
+    p.add_argument('--timeout', default=None, type=float,
+                   help='Stop each instance after this many seconds')
+    p.add_argument('--hub', default=None, choices=HUBS,
+                   help='Connect all instances with a hub')
+    p.add_argument('--base_port', default=10000, type=int,
+                   help='First port to try allocating')
+    p.add_argument('--no_config_cache', default=False, action='store_true',
+                   help='Always parse and validate configs')
+    args = p.parse_args()
+
+    from . import hal_log
+    hal_log.setLogConfig()
+
+    if args.jobs is not None:
+        jobs = load_jobs(args.jobs)
+    elif args.config:
+        jobs = [{'config': args.config, 'symbols': args.symbols,
+                 'elf': args.elf, 'count': args.num}]
+    else:
+        p.error("--config or --jobs required")
+
+    cache_dir = None if args.no_config_cache else hal_config.DEFAULT_CACHE_DIR
+    farm = Farm(jobs, args.name, args.max_parallel, args.max_restarts,
+                args.timeout, args.hub, args.base_port, cache_dir)
+    summary = farm.run()
+    failed = [name for name, inst in summary.items()
+              if any(code not in (0, None, -signal.SIGINT)
+                     for code in inst['exit_codes'][-1:])]
+    if failed:
+        log.error("Failed instances: %s" % ", ".join(failed))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ import functools
 import struct
 
 from .util.parse_symbol_tables import DWARFReader, sym_format
+from .util.profile_hals import load_memory
 
 
 class lazy_property(object):
@@ -70,10 +71,9 @@ class Recording(object):
             Reads the state from the database and returns as a dict
         '''
         c = self.db.cursor()
-        c.execute('SELECT memory, regs FROM states WHERE id == ?', (row_id,))
-        memory, regs = c.fetchone()
-        memory = pickle.loads(memory)
-        regs = pickle.loads(regs)
+        c.execute('SELECT regs FROM states WHERE id == ?', (row_id,))
+        regs = pickle.loads(c.fetchone()[0])
+        memory = load_memory(self.db, row_id)
         return {'memory': memory, 'regs': regs}
 
     def get_ret_value(self):
@@ -0,0 +1,116 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+'''
+    Clock used by handlers and peripheral models that return or schedule
+    on time (timers, clock_time, frame latency).
+
+    real:    Seconds since start of the host's monotonic clock (default)
+    virtual: Time only moves when advanced, by intercept_step seconds on
+             each intercept, by sleep() (e.g., HAL_Delay returns instantly
+             after advancing the clock) or explicitly with advance().
+             Timers fire synchronously as the clock passes their deadline
+             so runs with the same inputs see the same times.
+
+    Configured with the options clock_mode and clock_intercept_step.
+'''
+import time
+from threading import RLock
+import logging
+log = logging.getLogger(__name__)
+
+REAL = 'real'
+VIRTUAL = 'virtual'
+MODES = (REAL, VIRTUAL)
+
+mode = REAL
+intercept_step = 0.0001  # Seconds the virtual clock advances per intercept
+_start = time.monotonic()
+_virtual_time = 0.0
+_lock = RLock()
+_listeners = []  # Called with the new time when the virtual clock advances
+
+
+def set_mode(new_mode, step=None):
+    '''
+        Selects real or virtual time, the clock restarts at 0
+
+        :param step: Seconds to advance per intercept in virtual mode
+    '''
+    global mode, intercept_step, _start, _virtual_time
+    if new_mode not in MODES:
+        raise ValueError("Unknown clock mode %s, valid %s" % (new_mode, MODES))
+    with _lock:
+        mode = new_mode
+        if step is not None:
+            intercept_step = float(step)
+        _start = time.monotonic()
+        _virtual_time = 0.0
+    log.info("Clock mode: %s" % mode)
+
+
+def reset(seconds=0.0):
+    '''
+        Sets the clock to seconds, used when restoring snapshots.  Listeners
+        are not called.
+    '''
+    global _start, _virtual_time
+    with _lock:
+        _start = time.monotonic() - seconds
+        _virtual_time = seconds
+
+
+def is_virtual():
+    return mode == VIRTUAL
+
+
+def now():
+    '''
+        Returns seconds since the clock started
+    '''
+    if mode == VIRTUAL:
+        return _virtual_time
+    return time.monotonic() - _start
+
+
+def add_listener(callback):
+    '''
+        Registers callback(now) which is called each time the virtual
+        clock advances
+    '''
+    _listeners.append(callback)
+
+
+def advance(seconds):
+    '''
+        Advances the virtual clock, does nothing in real mode
+
+        :returns the current time
+    '''
+    global _virtual_time
+    if mode != VIRTUAL:
+        return now()
+    with _lock:
+        _virtual_time += seconds
+        current = _virtual_time
+        for callback in _listeners:
+            callback(current)
+    return current
+
+
+def on_intercept():
+    '''
+        Called for each intercept, advances virtual time by intercept_step
+    '''
+    if mode == VIRTUAL and intercept_step:
+        advance(intercept_step)
+
+
+def sleep(seconds):
+    '''
+        Sleep requested by the firmware. Virtual mode advances the clock
+        instead of waiting, real mode returns immediately as before.
+    '''
+    if mode == VIRTUAL:
+        advance(seconds)
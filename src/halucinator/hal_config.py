@@ -5,10 +5,21 @@ from . import hal_log as hal_log_conf
 import importlib
 import inspect
 import csv
+import sys
+import pickle
+import hashlib
+from bisect import bisect_right
 
 log = logging.getLogger(__name__)
 hal_log = hal_log_conf.getHalLogger()
 
+# Use libyaml if available, same semantics as FullLoader
+YamlLoader = getattr(yaml, 'CFullLoader', yaml.FullLoader)
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'halucinator', 'configs')
+
 
 class HalMemConfig(object):
     def __init__(self, name, config_filename, base_addr, size, permissions='rwx', file=None, emulate=None):
@@ -66,7 +77,7 @@ class HalInterceptConfig(object):
 
     def __init__(self, config_file, cls, function, addr=None, symbol=None,
                  class_args=None, registration_args=None,
-                 run_once=False, watchpoint=False):
+                 run_once=False, watchpoint=False, inline=False):
         self.config_file = config_file
         self.symbol = symbol
         
@@ -82,6 +93,7 @@ class HalInterceptConfig(object):
             del self.registration_args['self']
         self.run_once = run_once
         self.watchpoint = watchpoint  # Valid 'r', 'w' ,'rw'
+        self.inline = inline
 
 
     def _check_handler_is_valid(self):
@@ -102,14 +114,14 @@ class HalInterceptConfig(object):
             return False
 
         # See if could init class
-        argspec = inspect.getargspec(cls_obj.__init__)
+        argspec = inspect.getfullargspec(cls_obj.__init__)
         if not set(self.class_args).issubset(set(argspec.args)):
             hal_log.error("class_arg are invalid for %s" % self)
             hal_log.error("    Valid options %s" % argspec.args)
             hal_log.error("    Input options %s" % self.class_args)
             valid = False
 
-        argspec = inspect.getargspec(cls_obj.register_handler)
+        argspec = inspect.getfullargspec(cls_obj.register_handler)
         if not set(self.registration_args).issubset(set(argspec.args)):
             hal_log.error("class_arg are invalid for %s" % self)
             hal_log.error("    Valid options %s" % argspec.args)
@@ -124,6 +136,13 @@ class HalInterceptConfig(object):
             hal_log.error('Intercept: Watchpoints must be false, true, r, w, or rw on: %s' % self)
             valid = False
         
+        if self.inline not in (False, True):
+            hal_log.error('Intercept: inline must be true or false on: %s' % self)
+            valid = False
+        elif self.inline and (self.watchpoint or self.run_once):
+            hal_log.error('Intercept: inline can not be used with watchpoint or run_once on: %s' % self)
+            valid = False
+
         valid &= self._check_handler_is_valid()
 
         if self.bp_addr is not None and type(self.bp_addr) != int:
@@ -154,6 +173,53 @@ class HalSymbolConfig(object):
         return "SymConfig(%s){%s, %s(%i),%i}" % \
                 (self.config_file, self.name, hex(self.addr), self.addr, self.size)
 
+class HalSymbolIndex(object):
+    '''
+        Index over a list of HalSymbolConfig, name lookups use a dict and
+        address lookups bisect a list sorted by address.  Where symbols
+        overlap the one earliest in the list wins, same as a linear scan.
+    '''
+    def __init__(self):
+        self.by_name = {}
+        self.by_start = {}  # Start address (thumb bit clear): sym with size
+        self.num_indexed = 0
+        self._sorted = None  # [(addr, list_idx, sym)]
+        self._starts = []
+        self._max_ends = []  # max end of _sorted[0..i]
+
+    def add(self, idx, sym):
+        self.by_name.setdefault(sym.name, sym)
+        if sym.size:
+            self.by_start.setdefault(sym.addr & 0xFFFFFFFE, sym)
+        self.num_indexed = idx + 1
+        self._sorted = None
+
+    def _build_sorted(self, symbols):
+        self._sorted = sorted(((sym.addr, idx, sym)
+                               for idx, sym in enumerate(symbols)),
+                              key=lambda x: (x[0], x[1]))
+        self._starts = [s[0] for s in self._sorted]
+        self._max_ends = []
+        max_end = -1
+        for addr, _, sym in self._sorted:
+            max_end = max(max_end, addr + sym.size)
+            self._max_ends.append(max_end)
+
+    def containing(self, symbols, addr):
+        if self._sorted is None:
+            self._build_sorted(symbols)
+        best = None
+        idx = bisect_right(self._starts, addr) - 1
+        # Walk back only while an earlier symbol could still reach addr
+        while idx >= 0 and self._max_ends[idx] >= addr:
+            sym_addr, order, sym = self._sorted[idx]
+            if addr <= sym_addr + sym.size and \
+               (best is None or order < best[0]):
+                best = (order, sym)
+            idx -= 1
+        return best[1] if best else None
+
+
 class HALMachineConfig:
 
     def __init__(self, config_file=None, arch='cortex-m3', cpu_model='cortex-m3', 
@@ -183,11 +249,12 @@ class HalucinatorConfig(object):
         self.intercepts = []
         self.watchpoints = []
         self.symbols = []
+        self._sym_index = HalSymbolIndex()
         self.callables = []
 
     def add_yaml(self, yaml_filename):
         with open(yaml_filename, 'rb') as infile:
-            part_config = yaml.load(infile, Loader=yaml.FullLoader)
+            part_config = yaml.load(infile, Loader=YamlLoader)
 
             if 'machine' in part_config:
                 self._parse_machine(part_config['machine'], yaml_filename)
@@ -216,7 +283,7 @@ class HalucinatorConfig(object):
                 addr = int(row[1].strip(),0)
                 addr2 = int(row[2].strip(),0)
                 size = addr2 - addr
-                self.symbols.append(HalSymbolConfig(csv_file, row[0].strip(), addr, size))
+                self.add_symbol(HalSymbolConfig(csv_file, row[0].strip(), addr, size))
     
     def _parse_machine(self, machine_dict, filename):
         
@@ -258,7 +325,26 @@ class HalucinatorConfig(object):
     def _parse_symbols(self, sym_dict, yaml_file):
         for addr, sym_name in sym_dict.items():
             sym = HalSymbolConfig(yaml_file, name=sym_name, addr=addr)
-            self.symbols.append(sym)
+            self.add_symbol(sym)
+
+    def add_symbol(self, sym):
+        '''
+            Adds a HalSymbolConfig and updates the symbol index
+        '''
+        self.symbols.append(sym)
+        self._sym_index.add(len(self.symbols) - 1, sym)
+
+    def _symbol_index(self):
+        '''
+            Returns the symbol index, catching up with symbols appended
+            directly to self.symbols
+        '''
+        index = self._sym_index
+        if index.num_indexed > len(self.symbols):
+            index = self._sym_index = HalSymbolIndex()
+        for idx in range(index.num_indexed, len(self.symbols)):
+            index.add(idx, self.symbols[idx])
+        return index
 
     def get_addr_for_symbol(self, sym_name):
         '''
@@ -267,11 +353,8 @@ class HalucinatorConfig(object):
             :param sym_name:  Name of the symbol
             :ret_val None or Address: 
         '''
-
-        for sym in self.symbols:
-            if sym_name == sym.name:
-                return sym.addr
-        return None
+        sym = self._symbol_index().by_name.get(sym_name)
+        return sym.addr if sym is not None else None
 
     def resolve_intercept_bp_addrs(self):
         '''
@@ -293,10 +376,21 @@ class HalucinatorConfig(object):
         '''
             Gets symbol name that contains address
         '''
-        for sym in self.symbols:
-            if addr >= sym.addr and addr <= (sym.addr + sym.size):
-                return sym.name
-        return None
+        sym = self._symbol_index().containing(self.symbols, addr)
+        return sym.name if sym is not None else None
+
+    def get_symbol_size(self, addr):
+        '''
+            Gets size of the symbol starting at addr, None if unknown
+        '''
+        sym = self._symbol_index().by_start.get(addr)
+        return sym.size if sym is not None else None
+
+    def has_inline_intercepts(self):
+        for inter in self.intercepts:
+            if inter.inline and inter.bp_addr is not None:
+                return True
+        return False
 
     def memory_containing(self, addr):
         '''
@@ -351,4 +445,105 @@ class HalucinatorConfig(object):
         for inter in del_inters:
             self.intercepts.remove(inter)
 
-        return valid
\ No newline at end of file
+        return valid
+
+    def handler_files(self):
+        '''
+            Source files defining the intercept handler classes and their
+            base classes (imported by prepare_and_validate).  The class is
+            resolved as it may be re-exported by a package
+            (e.g. halucinator.bp_handlers.ReturnZero)
+        '''
+        files = set()
+        for inter in self.intercepts:
+            module_name, cls_name = inter.cls.rsplit('.', 1)
+            module = sys.modules.get(module_name)
+            cls_obj = getattr(module, cls_name, None)
+            if not inspect.isclass(cls_obj):
+                continue
+            for klass in inspect.getmro(cls_obj):
+                try:
+                    files.add(os.path.abspath(inspect.getfile(klass)))
+                except TypeError:
+                    pass  # Builtin, e.g. object
+        return sorted(files)
+
+
+def _file_sig(filename):
+    stat = os.stat(filename)
+    return (filename, stat.st_mtime_ns, stat.st_size)
+
+
+def _cache_key(config_files, symbol_files):
+    '''
+        Hash of the contents and locations of the input files
+    '''
+    key = hashlib.sha256()
+    key.update(("%i %s" % (CACHE_VERSION, sys.version)).encode('utf-8'))
+    for kind, filenames in (('c', config_files), ('s', symbol_files)):
+        for filename in filenames:
+            key.update(("%s:%s:" % (kind, os.path.abspath(filename))).encode('utf-8'))
+            with open(filename, 'rb') as infile:
+                key.update(hashlib.sha256(infile.read()).digest())
+    return key.hexdigest()
+
+
+def _load_cached(cache_file):
+    try:
+        with open(cache_file, 'rb') as infile:
+            entry = pickle.load(infile)
+        for dep in entry['deps']:
+            if _file_sig(dep[0]) != tuple(dep):
+                log.info("Config cache stale, %s changed" % dep[0])
+                return None
+        return entry['config']
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.warning("Ignoring unreadable config cache %s: %s" % (cache_file, e))
+        return None
+
+
+def load_config(config_files, symbol_files=(), cache_dir=DEFAULT_CACHE_DIR):
+    '''
+        Builds, prepares and validates a HalucinatorConfig from yaml config
+        files and csv symbol files.  Valid configs are cached in cache_dir
+        keyed on the content of the input files, and invalidated when the
+        handler modules or hal_config change.
+
+        :param cache_dir: Cache directory, None disables the cache
+        :returns HalucinatorConfig or None if the config is invalid
+    '''
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, _cache_key(config_files, symbol_files))
+        config = _load_cached(cache_file)
+        if config is not None:
+            log.info("Using cached config %s" % cache_file)
+            return config
+
+    config = HalucinatorConfig()
+    for conf_file in config_files:
+        log.info("Parsing config file: %s" %conf_file)
+        config.add_yaml(conf_file)
+
+    for csv_file in symbol_files:
+        log.info("Parsing csv symbol file: %s" %csv_file)
+        config.add_csv_symbols(csv_file)
+
+    if not config.prepare_and_validate():
+        return None
+
+    if cache_file is not None:
+        deps = [_file_sig(f) for f in
+                [os.path.abspath(__file__)] + config.handler_files()]
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = "%s.%i.tmp" % (cache_file, os.getpid())
+            with open(tmp_file, 'wb') as outfile:
+                pickle.dump({'deps': deps, 'config': config}, outfile,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            log.warning("Could not write config cache: %s" % e)
+    return config
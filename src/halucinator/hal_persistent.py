@@ -0,0 +1,318 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+'''
+    Persistent execution, runs many inputs through one QEMU/GDB session.
+
+    The state the target is in when the runner is created (the entry point
+    or a snapshot loaded with --restore, see hal_snapshot) is kept in
+    memory as the baseline.  Each iteration resets the target to it and
+    delivers the input to a peripheral model, as if it was received from
+    an IO server on topic, then runs until an end address, a crash address
+    or the timeout is reached.  Resetting compares RAM to the baseline and
+    only writes back the pages that differ, then restores the registers,
+    NVIC state and Python state of the handlers and models.
+
+    The compare reads all of the compared RAM over GDB on every reset, so
+    its cost grows with the RAM size.  Limit it with ranges (--reset_range)
+    to the memory the code under test writes (e.g. .data, .bss, heap and
+    stack), memory outside them is not reset.
+
+    hal_persistent serves a pipe (stdin/stdout by default) so a fuzzer can
+    drive it:
+        request:  <u32 length><length bytes of input>, length 0xFFFFFFFF exits
+        response: <u32 status><u32 execution time in us>
+    all little endian, status is one of OK, TIMEOUT, CRASH.  PersistentClient
+    implements the fuzzer side in Python.
+
+    hal_persistent -c cfg.yaml --restore tmp/HALucinator/snapshot.pkl \\
+        --topic Peripheral.UARTPublisher.rx_data --field chars \\
+        --msg "{id: 0x40011000}" --end HAL_UART_Receive_IT
+'''
+import os
+import struct
+import subprocess
+import sys
+import time
+import yaml
+from threading import Event
+from . import hal_snapshot
+from .bp_handlers import intercepts
+from .peripheral_models import peripheral_server
+import logging
+log = logging.getLogger(__name__)
+
+OK = 0
+TIMEOUT = 1
+CRASH = 2
+STATUS_NAMES = {OK: 'ok', TIMEOUT: 'timeout', CRASH: 'crash'}
+
+DEFAULT_CRASH = ('HardFault_Handler', 'MemManage_Handler', 'BusFault_Handler',
+                 'UsageFault_Handler')
+REQUEST = struct.Struct('<I')
+RESPONSE = struct.Struct('<II')
+EXIT_REQUEST = 0xFFFFFFFF
+
+
+class PersistentRunner(object):
+    '''
+        :param qemu:      Target from main.setup_emulation, stopped where
+                          every iteration starts
+        :param config:    HalucinatorConfig
+        :param topic:     Peripheral model rx topic inputs are delivered on
+        :param field:     Message field set to the input
+        :param msg:       Other fields of the message (e.g., {'id': 1})
+        :param end:       Symbols/addresses that end an iteration
+        :param crash:     Symbols/addresses reported as crashes
+        :param timeout:   Max seconds per iteration
+        :param page_size: Bytes of RAM compared and restored together
+        :param ranges:    (addr, size) of the RAM compared and restored,
+                          default all writable memories
+    '''
+    def __init__(self, qemu, config, topic, field, msg=None, end=(),
+                 crash=DEFAULT_CRASH, timeout=1.0, page_size=1024,
+                 ranges=None):
+        self.qemu = qemu
+        self.config = config
+        self.topic = topic
+        self.field = field
+        self.msg = dict(msg) if msg else {}
+        self.timeout = timeout
+        self.page_size = page_size
+        self.iterations = 0
+        self.pages_restored = 0
+        self.counts = {name: 0 for name in STATUS_NAMES.values()}
+        self._dirty = False
+        self._status = None
+        self._done = Event()
+
+        self.baseline = hal_snapshot.capture(qemu, config)
+        self._regions = []  # (base_addr, baseline bytes)
+        unmatched = list(ranges) if ranges is not None else []
+        for mem in hal_snapshot.writable_memories(config):
+            data = b''.join(d for _, d in
+                            hal_snapshot.memory_contents(self.baseline, mem))
+            if ranges is None:
+                self._regions.append((mem.base_addr, data))
+                continue
+            for start, size in list(unmatched):
+                if mem.base_addr <= start and \
+                        start + size <= mem.base_addr + mem.size:
+                    offset = start - mem.base_addr
+                    self._regions.append((start, data[offset:offset + size]))
+                    unmatched.remove((start, size))
+        if unmatched:
+            raise ValueError("Reset ranges not in a writable memory: %s" %
+                             ", ".join("%#x:%#x" % r for r in unmatched))
+
+        for at in end:
+            self._add_stop(at, OK)
+        for at in crash:
+            try:
+                self._add_stop(at, CRASH)
+            except ValueError:
+                log.debug("No crash symbol %s" % at)
+
+    def _add_stop(self, at, status):
+        def hook(target, bp, pc):
+            # Leave the target stopped for reset
+            self._status = status
+            self._done.set()
+            return True
+        addr = hal_snapshot.resolve_addr(self.config, at)
+        intercepts.add_pc_hook(self.qemu, addr, hook)
+        log.info("Iteration %s at %#x" % (STATUS_NAMES[status], addr))
+
+    def _dirty_pages(self):
+        writes = []
+        for base, data in self._regions:
+            for start in range(0, len(data), hal_snapshot.CHUNK_SIZE):
+                size = min(hal_snapshot.CHUNK_SIZE, len(data) - start)
+                current = self.qemu.read_memory_bulk(base + start, size)
+                for off in range(start, start + size, self.page_size):
+                    page = data[off:off + self.page_size]
+                    if current[off - start:off - start + len(page)] != page:
+                        writes.append((base + off, page))
+        return writes
+
+    def reset(self):
+        '''
+            Returns the (stopped) target and models to the baseline
+        '''
+        peripheral_server.hold_interrupts()
+        try:
+            peripheral_server.clear_interrupts()
+            writes = self._dirty_pages()
+            if writes:
+                self.qemu.write_memory_scatter(writes)
+            self.pages_restored += len(writes)
+            hal_snapshot.restore_cpu(self.qemu, self.baseline)
+            hal_snapshot.restore_python(self.baseline)
+        finally:
+            peripheral_server.release_interrupts()
+        self._dirty = False
+
+    def run(self, data):
+        '''
+            Runs one iteration with input data
+
+            :returns OK, TIMEOUT or CRASH
+        '''
+        if self._dirty:
+            self.reset()
+        self._dirty = True
+        self._status = None
+        self._done.clear()
+        msg = dict(self.msg)
+        msg[self.field] = data
+        peripheral_server.dispatch(self.topic, msg)
+        self.qemu.cont()
+        if not self._done.wait(self.timeout):
+            self.qemu.stop()
+        status = self._status if self._status is not None else TIMEOUT
+        self.iterations += 1
+        self.counts[STATUS_NAMES[status]] += 1
+        return status
+
+    def stats(self):
+        out = dict(self.counts)
+        out['iterations'] = self.iterations
+        out['pages_restored'] = self.pages_restored
+        return out
+
+
+def serve(runner, infile, outfile):
+    '''
+        Runs requests from infile until EXIT_REQUEST or end of file
+
+        :param infile:  Binary file to read requests from
+        :param outfile: Binary file to write responses to
+    '''
+    while True:
+        header = infile.read(REQUEST.size)
+        if len(header) < REQUEST.size:
+            return
+        length, = REQUEST.unpack(header)
+        if length == EXIT_REQUEST:
+            return
+        data = infile.read(length)
+        start = time.perf_counter()
+        status = runner.run(data)
+        exec_us = int((time.perf_counter() - start) * 1000000)
+        outfile.write(RESPONSE.pack(status, min(exec_us, 0xFFFFFFFF)))
+        outfile.flush()
+
+
+class PersistentClient(object):
+    '''
+        Fuzzer side of the pipe, starts hal_persistent with args
+
+        Usage:
+            client = PersistentClient(['-c', 'cfg.yaml', ...])
+            status, exec_us = client.run(b'input')
+            client.close()
+    '''
+    def __init__(self, args, executable='hal_persistent'):
+        self.process = subprocess.Popen([executable] + list(args),
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+
+    def run(self, data):
+        self.process.stdin.write(REQUEST.pack(len(data)) + bytes(data))
+        self.process.stdin.flush()
+        response = self.process.stdout.read(RESPONSE.size)
+        if len(response) < RESPONSE.size:
+            raise EOFError("hal_persistent exited")
+        return RESPONSE.unpack(response)
+
+    def close(self):
+        try:
+            self.process.stdin.write(REQUEST.pack(EXIT_REQUEST))
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        return self.process.wait()
+
+
+def main():
+    from argparse import ArgumentParser
+    p = ArgumentParser()
+    p.add_argument('-c', '--config', action='append', required=True,
+                   help='Config file(s), see halucinator -c')
+    p.add_argument('-s', '--symbols', action='append', default=[],
+                   help='CSV file with each row having symbol, first_addr, last_addr')
+    p.add_argument('-n', '--name', default='HALucinator',
+                   help='Name of target for avatar, used for logging')
+    p.add_argument('-p', '--gdb_port', default=1234, type=int,
+                   help="GDB_Port")
+    p.add_argument('-r', '--rx_port', default=5555, type=int,
+                   help='Port number to receive zmq messages for IO on')
+    p.add_argument('-t', '--tx_port', default=5556, type=int,
+                   help='Port number to send IO messages via zmq')
+    p.add_argument('--restore', default=None,
+                   help='Snapshot to start each iteration from')
+    p.add_argument('--topic', required=True,
+                   help='Peripheral model topic inputs are sent on, e.g. '
+                        'Peripheral.UARTPublisher.rx_data')
+    p.add_argument('--field', required=True,
+                   help='Message field the input is put in, e.g. chars')
+    p.add_argument('--msg', default=None,
+                   help='YAML dict of the other message fields')
+    p.add_argument('--end', action='append', default=[],
+                   help='Symbol or address that ends an iteration')
+    p.add_argument('--crash', action='append', default=None,
+                   help='Symbol or address reported as a crash (default '
+                        'the Cortex-M fault handlers)')
+    p.add_argument('--timeout', default=1.0, type=float,
+                   help='Max seconds per iteration')
+    p.add_argument('--page_size', default=1024, type=int,
+                   help='Bytes of RAM compared and restored together')
+    p.add_argument('--reset_range', action='append', default=None,
+                   help='addr:size of RAM compared and restored each '
+                        'iteration (default all writable memories)')
+    p.add_argument('-i', '--input', default=None,
+                   help='Read requests from this file/fifo instead of stdin')
+    p.add_argument('-o', '--output', default=None,
+                   help='Write responses to this file/fifo instead of stdout')
+    p.add_argument('--no_config_cache', default=False, action='store_true',
+                   help='Always parse and validate configs')
+    args = p.parse_args()
+
+    # Responses use stdout, anything else printed goes to stderr
+    if args.output is None:
+        outfile = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    else:
+        outfile = open(args.output, 'wb')
+    infile = sys.stdin.buffer if args.input is None else open(args.input, 'rb')
+
+    from . import main as hal_main
+    from . import hal_config
+    cache_dir = None if args.no_config_cache else hal_config.DEFAULT_CACHE_DIR
+    config = hal_config.load_config(args.config, args.symbols, cache_dir)
+    if config is None:
+        log.error("Config invalid")
+        exit(-1)
+
+    avatar, qemu = hal_main.setup_emulation(
+        config, args.name, rx_port=args.rx_port, tx_port=args.tx_port,
+        gdb_port=args.gdb_port, restore=args.restore)
+    msg = yaml.safe_load(args.msg) if args.msg is not None else None
+    crash = args.crash if args.crash is not None else DEFAULT_CRASH
+    ranges = None
+    if args.reset_range is not None:
+        ranges = [tuple(int(v, 0) for v in r.split(':'))
+                  for r in args.reset_range]
+    runner = PersistentRunner(qemu, config, args.topic, args.field, msg,
+                              args.end, crash, args.timeout, args.page_size,
+                              ranges)
+    try:
+        serve(runner, infile, outfile)
+    finally:
+        log.info("Persistent: %s" % runner.stats())
+        hal_main.shutdown_emulation(avatar)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+'''
+    Per intercept latency profiling.  When enabled intercepts.interceptor
+    records for each intercept:
+        stop:    Time from Avatar dispatching the break point to the handler
+                 being called (includes fetching registers)
+        handler: Wall time of the handler
+        resume:  Time to write back registers and continue the target
+        bytes:   Bytes of memory read/written by the handler
+    into fixed bucket histograms.  Handler classes can additionally be run
+    under cProfile.  Results are written to profile.yaml (and
+    profile_<Class>.prof) on shutdown, use hal_profile_report to print them.
+'''
+import bisect
+import cProfile
+import functools
+import os
+import time
+import yaml
+import logging
+log = logging.getLogger(__name__)
+
+# Upper bounds of the time buckets in microseconds, last bucket is overflow
+TIME_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000,
+                50000, 100000, 250000, 1000000)
+# Upper bounds of the byte buckets
+BYTE_BUCKETS = (0, 4, 16, 64, 256, 1024, 4096, 16384, 65536)
+
+enabled = False
+_profile_classes = set()
+_profilers = {}  # Class name: cProfile.Profile
+_records = {}    # bp: InterceptProfile
+_output_dir = None
+
+
+class Histogram(object):
+    '''
+        Fixed bucket histogram, values greater than the last bound go in an
+        overflow bucket
+    '''
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.num = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.num += 1
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.num if self.num else 0
+
+    def percentile(self, pct):
+        '''
+            Returns the upper bound of the bucket containing the pct
+            percentile, limited to max
+        '''
+        target = self.num * pct / 100.0
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                if idx < len(self.bounds):
+                    return min(self.bounds[idx], self.max)
+                return self.max
+        return 0
+
+    def to_dict(self):
+        return {'bounds': list(self.bounds), 'counts': self.counts,
+                'total': self.total, 'num': self.num, 'max': self.max}
+
+
+class InterceptProfile(object):
+    def __init__(self, name):
+        self.name = name
+        self.stop = Histogram(TIME_BUCKETS)
+        self.handler = Histogram(TIME_BUCKETS)
+        self.resume = Histogram(TIME_BUCKETS)
+        self.bytes = Histogram(BYTE_BUCKETS)
+
+    def to_dict(self):
+        return {'name': self.name,
+                'stop': self.stop.to_dict(),
+                'handler': self.handler.to_dict(),
+                'resume': self.resume.to_dict(),
+                'bytes': self.bytes.to_dict()}
+
+
+class InterceptTimer(object):
+    '''
+        Times one intercept, passed to intercepts._intercept which calls
+        start before the handler, handled after it and resumed after the
+        target is continued
+    '''
+    def __init__(self, stop_time=None):
+        self.stop_time = stop_time if stop_time is not None \
+            else time.perf_counter()
+
+    def start(self, target, bp, cls, method, name):
+        '''
+            :returns callable that runs method like method(cls, target, pc),
+                     under cProfile if cls is profiled
+        '''
+        self.record = get_record(bp, "%s.%s" % (cls.__class__.__name__, name))
+        self.bytes_start = target.bytes_moved
+        profiler = get_profiler(cls)
+        self.handler_start = time.perf_counter()
+        if profiler is not None:
+            return functools.partial(profiler.runcall, method)
+        return method
+
+    def handled(self, target):
+        self.handler_end = time.perf_counter()
+        self.bytes_moved = target.bytes_moved - self.bytes_start
+
+    def resumed(self):
+        resume_end = time.perf_counter()
+        self.record.stop.add(to_us(self.stop_time, self.handler_start))
+        self.record.handler.add(to_us(self.handler_start, self.handler_end))
+        self.record.resume.add(to_us(self.handler_end, resume_end))
+        self.record.bytes.add(self.bytes_moved)
+
+
+def enable(output_dir, profile_classes=()):
+    '''
+        Enables profiling
+
+        :param output_dir: Directory to write results to
+        :param profile_classes: Names of bp_handler classes to run under
+                                cProfile, 'all' profiles every class
+    '''
+    global enabled, _output_dir
+    enabled = True
+    _output_dir = output_dir
+    _profile_classes.update(profile_classes)
+
+
+def mark_stop(avatar, message, *args, **kwargs):
+    '''
+        Synchronous BreakpointHit watchman, records when Avatar dispatched
+        the stop. Must be added before the interceptor watchman.
+    '''
+    message.hal_stop_time = time.perf_counter()
+
+
+def get_record(bp, name):
+    if bp not in _records:
+        _records[bp] = InterceptProfile(name)
+    return _records[bp]
+
+
+def get_profiler(cls):
+    '''
+        Returns cProfile.Profile for the bp_handler class or None if it is
+        not profiled
+    '''
+    name = cls.__class__.__name__
+    if name not in _profile_classes and 'all' not in _profile_classes:
+        return None
+    if name not in _profilers:
+        _profilers[name] = cProfile.Profile()
+    return _profilers[name]
+
+
+def to_us(start, end):
+    return int((end - start) * 1000000)
+
+
+def write_profile():
+    '''
+        Writes histograms to profile.yaml and cProfile stats to
+        profile_<Class>.prof in the output directory
+    '''
+    if not enabled or _output_dir is None:
+        return
+    out = {bp: rec.to_dict() for bp, rec in _records.items()}
+    with open(os.path.join(_output_dir, 'profile.yaml'), 'w') as outfile:
+        yaml.safe_dump(out, outfile)
+    for name, profiler in _profilers.items():
+        profiler.dump_stats(os.path.join(_output_dir, 'profile_%s.prof' % name))
+    log.info("Wrote profile to %s" % _output_dir)
+
+
+SORT_KEYS = ('total', 'handler', 'stop', 'resume', 'bytes', 'count')
+
+
+def _total_us(rec):
+    return rec['stop']['total'] + rec['handler']['total'] + \
+        rec['resume']['total']
+
+
+def report(profile_file, sort='total', limit=None):
+    '''
+        Returns ranked text report from profile.yaml
+    '''
+    with open(profile_file, 'r') as infile:
+        records = yaml.safe_load(infile) or {}
+
+    def sort_key(rec):
+        if sort == 'total':
+            return _total_us(rec)
+        if sort == 'count':
+            return rec['handler']['num']
+        return rec[sort]['total']
+
+    def pcts(hist):
+        h = Histogram(tuple(hist['bounds']))
+        h.counts = hist['counts']
+        h.num = hist['num']
+        h.max = hist['max']
+        return "%8i %8i %8i" % (h.percentile(50), h.percentile(99), h.max)
+
+    ranked = sorted(records.values(), key=sort_key, reverse=True)
+    if limit:
+        ranked = ranked[:limit]
+    all_us = sum(_total_us(r) for r in records.values()) or 1
+    lines = ["%-32s %8s %10s %6s | %-26s | %-26s | %-26s | %10s" % (
+        'Intercept', 'Count', 'Total(ms)', '%', 'Stop p50/p99/max (us)',
+        'Handler p50/p99/max (us)', 'Resume p50/p99/max (us)', 'Bytes')]
+    for rec in ranked:
+        total = _total_us(rec)
+        lines.append("%-32s %8i %10.1f %6.2f | %s | %s | %s | %10i" % (
+            rec['name'][:32], rec['handler']['num'], total / 1000.0,
+            100.0 * total / all_us, pcts(rec['stop']), pcts(rec['handler']),
+            pcts(rec['resume']), rec['bytes']['total']))
+    return "\n".join(lines)
+
+
+def main():
+    from argparse import ArgumentParser
+    p = ArgumentParser()
+    p.add_argument('-p', '--profile', required=True,
+                   help='profile.yaml from halucinator run with --profile')
+    p.add_argument('-s', '--sort', default='total', choices=SORT_KEYS,
+                   help='Rank intercepts by this metric')
+    p.add_argument('-n', '--num', default=None, type=int,
+                   help='Only show top N intercepts')
+    args = p.parse_args()
+    print(report(args.profile, args.sort, args.num))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+'''
+    Post boot snapshots, so runs can skip the firmware's initialization.
+
+    When the address in the option snapshot_at (symbol or address) is hit
+    the registers, writable memories, Cortex-M NVIC/SysTick state and the
+    Python state of the bp_handler instances and peripheral models are
+    saved to snapshot_file (default tmp/<name>/snapshot.pkl).  If
+    snapshot_at is an intercepted function the snapshot is taken before
+    its handler runs, and the handler runs again when restored.
+
+    halucinator --restore <snapshot file> loads it after the targets are
+    initialized and starts from the saved state.
+
+    Python state is saved per object as every attribute that can be
+    pickled (locks, threads, sockets and targets are skipped and keep
+    the values from this run).  Classes can instead define snapshot_state()
+    and restore_state(state) to save their own state.
+'''
+import os
+import pickle
+import signal
+import time
+import zlib
+from . import hal_clock
+from .bp_handlers import intercepts
+from .peripheral_models import peripheral_server
+import logging
+log = logging.getLogger(__name__)
+
+VERSION = 1
+DEFAULT_FILENAME = 'snapshot.pkl'
+CHUNK_SIZE = 0x10000
+
+# Cortex-M System Control Space saved in restore order (SysTick LOAD before
+# CTRL, priorities before enables)
+CORTEX_M_SCS = (('nvic_ipr', 0xE000E400, 240),
+                ('systick_load', 0xE000E014, 4),
+                ('systick_ctrl', 0xE000E010, 4),
+                ('nvic_iser', 0xE000E100, 64))
+VTOR_ADDR = 0xE000ED08
+NVIC_ICER = 0xE000E180  # Writing ones disables interrupts
+NVIC_ICPR = 0xE000E280  # Writing ones clears pending interrupts
+
+
+def resolve_addr(config, at):
+    '''
+        :param at: Symbol name or address (int or string, e.g. '0x8001234'
+                   from the command line)
+        :returns address with the thumb bit cleared
+    '''
+    addr = at
+    if not isinstance(at, int):
+        try:
+            addr = int(at, 0)
+        except ValueError:
+            addr = config.get_addr_for_symbol(at)
+    if addr is None:
+        raise ValueError("Unknown symbol %s" % at)
+    return addr & 0xFFFFFFFE
+
+
+def arm(qemu, config, at, filename, exit_after=False):
+    '''
+        Takes a snapshot the first time at is executed
+
+        :param at:         Symbol name or address
+        :param exit_after: Shutdown (as on Ctrl-C) once saved
+    '''
+    addr = resolve_addr(config, at)
+
+    def on_hit(target, bp, pc):
+        intercepts.remove_pc_hook(addr)
+        save(target, filename, config)
+        if exit_after:
+            os.kill(os.getpid(), signal.SIGINT)
+        return False
+
+    intercepts.add_pc_hook(qemu, addr, on_hit, temporary=True)
+    log.info("Snapshot at %#x will be saved to %s" % (addr, filename))
+
+
+def writable_memories(config):
+    return [m for m in config.memories.values()
+            if 'w' in m.permissions and m.emulate is None]
+
+
+def _read_chunks(qemu, base, size):
+    chunks = []
+    for addr in range(base, base + size, CHUNK_SIZE):
+        data = qemu.read_memory_bulk(addr, min(CHUNK_SIZE, base + size - addr))
+        chunks.append((addr, zlib.compress(data)))
+    return chunks
+
+
+def _picklable(attrs):
+    '''
+        Returns pickled dict of the attributes that can be pickled
+    '''
+    state = {}
+    for key, value in attrs.items():
+        if key.startswith('__') or \
+                isinstance(value, (classmethod, staticmethod, property)) or \
+                callable(value) and not isinstance(value, type):
+            continue
+        try:
+            pickle.dumps(value)
+        except Exception:
+            log.debug("Snapshot skipping %s" % key)
+            continue
+        state[key] = value
+    return pickle.dumps(state)
+
+
+def _save_object(obj, attrs):
+    if hasattr(obj, 'snapshot_state'):
+        return ('custom', pickle.dumps(obj.snapshot_state()))
+    return ('attrs', _picklable(attrs))
+
+
+def _restore_object(obj, saved):
+    kind, data = saved
+    state = pickle.loads(data)
+    if kind == 'custom':
+        obj.restore_state(state)
+    else:
+        for key, value in state.items():
+            setattr(obj, key, value)
+
+
+def _name(cls):
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+def capture(qemu, config):
+    '''
+        :returns snapshot of the (stopped) target and the Python models
+    '''
+    snapshot = {'version': VERSION,
+                'arch': config.machine.arch,
+                'clock': hal_clock.now(),
+                'registers': qemu.read_registers(),
+                'memories': {}, 'scs': {}, 'handlers': {}, 'models': {}}
+    for mem in writable_memories(config):
+        snapshot['memories'][mem.name] = {
+            'base_addr': mem.base_addr, 'size': mem.size,
+            'chunks': _read_chunks(qemu, mem.base_addr, mem.size)}
+
+    if config.machine.arch == 'cortex-m3':
+        try:
+            for name, addr, size in CORTEX_M_SCS:
+                snapshot['scs'][name] = qemu.read_memory_bulk(addr, size)
+            snapshot['vtor'] = qemu.read_memory(VTOR_ADDR, 4)
+        except Exception:
+            log.exception("Failed to save NVIC state")
+            snapshot['scs'] = {}
+
+    for cls, instance in intercepts.initalized_classes.items():
+        snapshot['handlers'][_name(cls)] = _save_object(instance,
+                                                        vars(instance))
+    for name, cls in peripheral_server.get_models().items():
+        snapshot['models'][name] = _save_object(cls, vars(cls))
+    return snapshot
+
+
+def save(qemu, filename, config=None):
+    '''
+        Saves the state of qemu and the Python models to filename
+    '''
+    start = time.time()
+    config = config if config is not None else qemu.avatar.config
+    snapshot = capture(qemu, config)
+    dirname = os.path.dirname(filename)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with open(filename, 'wb') as outfile:
+        pickle.dump(snapshot, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+    log.info("Saved snapshot %s at pc %#x in %.2fs" % (
+        filename, snapshot['registers'].get('pc', 0), time.time() - start))
+
+
+def load(filename):
+    with open(filename, 'rb') as infile:
+        snapshot = pickle.load(infile)
+    if snapshot.get('version') != VERSION:
+        raise ValueError("Unsupported snapshot version %s" %
+                         snapshot.get('version'))
+    return snapshot
+
+
+def restore(qemu, snapshot, config):
+    '''
+        Writes the snapshot to the (initialized, stopped) target and restores
+        the Python state.  Must be called after the peripheral server is
+        started as restored models may trigger interrupts.
+    '''
+    if snapshot['arch'] != config.machine.arch:
+        raise ValueError("Snapshot is for %s, config is %s" %
+                         (snapshot['arch'], config.machine.arch))
+    restore_memories(qemu, snapshot, config)
+    restore_cpu(qemu, snapshot)
+    restore_python(snapshot)
+    log.info("Restored snapshot at pc %#x" %
+             snapshot['registers'].get('pc', 0))
+
+
+def memory_contents(snapshot, mem):
+    '''
+        :returns list of (addr, bytes) chunks saved for memory mem
+    '''
+    saved = snapshot['memories'].get(mem.name)
+    if saved is None or saved['base_addr'] != mem.base_addr or \
+            saved['size'] != mem.size:
+        raise ValueError("Snapshot memory %s does not match config" %
+                         mem.name)
+    return [(addr, zlib.decompress(data)) for addr, data in saved['chunks']]
+
+
+def restore_memories(qemu, snapshot, config):
+    for mem in writable_memories(config):
+        for addr, data in memory_contents(snapshot, mem):
+            # Memories without a file start zeroed
+            if mem.file is None and not any(data):
+                continue
+            qemu.write_memory_bulk(addr, data)
+
+
+def restore_cpu(qemu, snapshot):
+    '''
+        Restores the NVIC/SysTick state and registers, interrupts enabled
+        or pended since the snapshot are cleared as writing ISER can only
+        set enables
+    '''
+    if snapshot['scs']:
+        qemu.set_vector_table_base(snapshot['vtor'])
+        qemu.write_memory_bulk(NVIC_ICER, b'\xff' * 64)
+        qemu.write_memory_bulk(NVIC_ICPR, b'\xff' * 64)
+        for name, addr, size in CORTEX_M_SCS:
+            qemu.write_memory_bulk(addr, snapshot['scs'][name])
+    qemu.write_registers(snapshot['registers'])
+
+
+def restore_python(snapshot):
+    '''
+        Restores the clock, bp_handler instances and peripheral models
+    '''
+    hal_clock.reset(snapshot['clock'])
+    for cls, instance in intercepts.initalized_classes.items():
+        saved = snapshot['handlers'].get(_name(cls))
+        if saved is not None:
+            _restore_object(instance, saved)
+    for name, cls in peripheral_server.get_models().items():
+        saved = snapshot['models'].get(name)
+        if saved is not None:
+            _restore_object(cls, saved)
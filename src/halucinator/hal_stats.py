@@ -1,11 +1,35 @@
-# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS). 
-# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains 
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
 # certain rights in this software.
 
+'''
+    Statistics collected during emulation.  Stats are kept in memory and
+    written to the stats file by a background thread at most every
+    flush_interval seconds (and on shutdown).  Sets that grow large (e.g.,
+    MMIO_addr_pc) can be made append only, new values are then appended to
+    a separate file instead of rewriting them in the stats file.  Use
+    load_stats to read a stats file including its append only sets.
+'''
 import yaml
+import os
+import copy
+import time
+from threading import Thread, Event, RLock
+import logging
+log = logging.getLogger(__name__)
 
 stats = {}
 _stats_file = None
+_lazy_updates = []
+_lazy_updated = 0.0  # time.monotonic() of last refresh_lazy_updates
+
+_lock = RLock()
+_dirty = Event()
+_stop = Event()
+_flusher = None
+flush_interval = 1.0  # Seconds, 0 writes on every update
+
+_append_only = {}  # set_key: values not yet appended to file
 
 
 def set_filename(filename):
@@ -13,14 +37,179 @@ def set_filename(filename):
     _stats_file = filename
 
 
+def set_flush_interval(interval):
+    '''
+        Sets max time (seconds) between writes of the stats file, 0 writes
+        synchronously on every update
+    '''
+    global flush_interval
+    flush_interval = interval
+
+
+def set_append_only(set_key):
+    '''
+        Makes stats[set_key] append only, new values are appended to
+        <stats file dir>/<set_key>.txt
+    '''
+    with _lock:
+        _append_only[set_key] = list(stats.get(set_key, ()))
+        if _stats_file is not None:
+            open(_append_filename(set_key), 'w').close()
+
+
+def _append_filename(set_key):
+    return os.path.join(os.path.dirname(_stats_file), set_key + '.txt')
+
+
+def add_lazy_update(funct):
+    '''
+        Registers a function that is called to refresh values in stats
+        (e.g., counters kept in emulated memory) before they are written
+    '''
+    _lazy_updates.append(funct)
+
+
+def refresh_lazy_updates():
+    '''
+        Runs the lazy updates if flush_interval has passed since they last
+        ran and schedules a write.  Lazy updates may read the target, call
+        only while it is stopped (e.g., from a break point handler).
+    '''
+    global _lazy_updated
+    if not _lazy_updates or _stats_file is None:
+        return
+    now = time.monotonic()
+    if now - _lazy_updated < flush_interval:
+        return
+    _lazy_updated = now
+    for update in _lazy_updates:
+        update()
+    mark_dirty()
+
+
+def snapshot():
+    '''
+        Returns a copy of stats that is safe to use while emulation continues
+    '''
+    with _lock:
+        return copy.deepcopy(stats)
+
+
+def _write():
+    with _lock:
+        _dirty.clear()
+        out_stats = {}
+        for key, value in stats.items():
+            if key in _append_only:
+                out_stats[key + '_file'] = os.path.basename(
+                    _append_filename(key))
+            else:
+                out_stats[key] = copy.copy(value)
+        pending = [(k, v) for k, v in _append_only.items() if v]
+        for key in _append_only:
+            _append_only[key] = []
+
+    for key, values in pending:
+        with open(_append_filename(key), 'a') as outfile:
+            for value in values:
+                if isinstance(value, tuple):
+                    value = ",".join(str(v) for v in value)
+                outfile.write("%s\n" % value)
+
+    tmp_file = _stats_file + '.tmp'
+    with open(tmp_file, 'w') as outfile:
+        yaml.safe_dump(out_stats, outfile)
+    os.replace(tmp_file, _stats_file)
+
+
+def write_stats():
+    '''
+        Writes the stats dictionary to the stats file now, including values
+        from lazy updates
+    '''
+    if _stats_file is None:
+        return
+    for update in _lazy_updates:
+        update()
+    _write()
+
+
+def _run_flusher():
+    while not _stop.is_set():
+        _dirty.wait()
+        if _stop.wait(flush_interval):
+            break
+        try:
+            _write()
+        except Exception:
+            log.exception("Writing stats failed")
+
+
+def mark_dirty():
+    '''
+        Schedules a write of the stats file
+    '''
+    global _flusher
+    if _stats_file is None:
+        return
+    if flush_interval <= 0:
+        _write()
+        return
+    _dirty.set()
+    if _flusher is None:
+        _flusher = Thread(target=_run_flusher, name='hal_stats', daemon=True)
+        _flusher.start()
+
+
+def increment(key, field='count'):
+    '''
+        Increments stats[key][field]
+    '''
+    with _lock:
+        stats[key][field] += 1
+    mark_dirty()
+
+
 def write_on_update(set_key, value):
     '''
-        Writes the stats information when if value is added to the set in 
+        Writes the stats information when if value is added to the set in
         the stats dictionary
     '''
-    global stats
-    if value not in stats[set_key]:
+    with _lock:
+        if value in stats[set_key]:
+            return
         stats[set_key].add(value)
         stats[set_key+'_length'] = len(stats[set_key])
-        with open(_stats_file, 'w') as outfile:
-            yaml.safe_dump(stats, outfile)
+        if set_key in _append_only:
+            _append_only[set_key].append(value)
+    mark_dirty()
+
+
+def shutdown():
+    '''
+        Stops the background writer and writes the final stats
+    '''
+    global _flusher
+    _stop.set()
+    _dirty.set()
+    if _flusher is not None:
+        _flusher.join()
+        _flusher = None
+    write_stats()
+
+
+def load_stats(filename):
+    '''
+        Reads a stats file, sets stored in append only files are read back
+        into the returned dictionary
+    '''
+    with open(filename, 'r') as infile:
+        loaded = yaml.safe_load(infile)
+    base_dir = os.path.dirname(filename)
+    for key in [k for k in loaded
+                if isinstance(k, str) and k.endswith('_file')]:
+        set_key = key[:-len('_file')]
+        with open(os.path.join(base_dir, loaded[key]), 'r') as infile:
+            loaded[set_key] = set(line.rstrip('\n') for line in infile)
+        del loaded[key]
+    return loaded
@@ -9,7 +9,6 @@ from avatar2.peripherals.avatar_peripheral import AvatarPeripheral
 import logging
 import os
 from .peripheral_models import generic as peripheral_emulators
-from IPython import embed
 #import gdbgui.backend as gdbgui
 import time
 import sys
@@ -17,10 +16,14 @@ import sys
 from .util import hexyaml
 #from . import bp_handlers
 from .bp_handlers import intercepts as intercepts
+from .bp_handlers.inline import InlinePatcher
 from .peripheral_models import peripheral_server as periph_server
-from .util.profile_hals import State_Recorder
+from .peripheral_models import frame_queue
 from .util import cortex_m_helpers as CM_helpers
 from . import hal_stats
+from . import hal_profile
+from . import hal_clock
+from . import hal_snapshot
 from . import hal_log, hal_config
 import signal
 log = logging.getLogger(__name__)
@@ -30,6 +33,7 @@ hal_log.setLogConfig()
 
 PATCH_MEMORY_SIZE = 4096
 INTERCEPT_RETURN_INSTR_ADDR = 0x20000000 - PATCH_MEMORY_SIZE
+INLINE_STUB_OFFSET = 0x100  # Start of inline intercept stubs in patch memory
 ARCH_LUT={'cortex-m3': ARM_CORTEX_M3, 'arm': ARM}
 QEMU_ARCH_LUT={'cortex-m3': ARMv7mQemuTarget, 'arm': ARMQemuTarget}
 
@@ -90,6 +94,10 @@ def write_patch_memory(qemu):
         qemu.regs.pc = callee
     qemu.call_ret_0 = call_ret_0
 
+    qemu.inline_patcher = InlinePatcher(
+        qemu, INTERCEPT_RETURN_INSTR_ADDR + INLINE_STUB_OFFSET,
+        PATCH_MEMORY_SIZE - INLINE_STUB_OFFSET)
+
 
 def find_qemu():
     '''
@@ -188,8 +196,17 @@ def setup_memory(avatar, memory, record_memories=None):
             record_memories.append((memory.base_addr, memory.size))
 
 
-def emulate_binary(config, target_name=None, log_basic_blocks=None,
-                   rx_port=5555, tx_port=5556, gdb_port=1234, elf_file=None, db_name=None):
+def setup_emulation(config, target_name=None, log_basic_blocks=None,
+                    rx_port=5555, tx_port=5556, gdb_port=1234, elf_file=None,
+                    db_name=None, profile=False, profile_handlers=(),
+                    restore=None):
+    '''
+        Creates and initializes the target, registers the intercepts and
+        starts the peripheral server.  The target is left stopped.
+
+        :param restore: Snapshot file (see hal_snapshot) to start from
+        :returns (avatar, qemu)
+    '''
 
     # Bug in QEMU about init stack pointer/entry point this works around
     if config.machine.arch == 'cortex-m3':
@@ -213,9 +230,18 @@ def emulate_binary(config, target_name=None, log_basic_blocks=None,
     for memory in config.memories.values():
         setup_memory(avatar, memory, record_memories)
 
+    # Inline intercepts are stubs in patch memory, only supported on thumb
+    use_patch_memory = config.has_inline_intercepts()
+    if use_patch_memory and config.machine.arch != 'cortex-m3':
+        log.warning("Inline intercepts only supported on cortex-m3")
+        use_patch_memory = False
+    if use_patch_memory:
+        add_patch_memory(avatar, qemu)
+
     # Add recorder to avatar
     # Used for debugging peripherals
     if elf_file is not None:
+        from .util.profile_hals import State_Recorder
         if db_name is None:
             db_name = ".".join((os.path.splitext(elf_file)[
                                0], str(target_name), "sqlite"))
@@ -237,6 +263,10 @@ def emulate_binary(config, target_name=None, log_basic_blocks=None,
                                         forwarded=True, forwarded_to=bp_cls)
                 added_classes.append(bp_cls)
    # Setup Intecepts
+    if profile:
+        hal_profile.enable(avatar.output_directory, profile_handlers)
+        avatar.watchmen.add_watchman('BreakpointHit', 'before',
+                                     hal_profile.mark_stop)
     avatar.watchmen.add_watchman('BreakpointHit', 'before',
                                  intercepts.interceptor, is_async=True)
     # Avatar may not support WatchPoints
@@ -251,9 +281,20 @@ def emulate_binary(config, target_name=None, log_basic_blocks=None,
 
     qemu.gdb_port = gdb_port
     avatar.config = config
+    hal_stats.set_flush_interval(
+        config.options.get('stats_flush_interval', hal_stats.flush_interval))
+    for set_key in config.options.get('stats_append_only', ['MMIO_addr_pc']):
+        hal_stats.set_append_only(set_key)
+    hal_clock.set_mode(config.options.get('clock_mode', hal_clock.REAL),
+                       config.options.get('clock_intercept_step'))
+    frame_queue.set_defaults(config.options.get('frame_queue_size'),
+                             config.options.get('frame_queue_policy'))
     log.info("Initializing Avatar Targets")
     avatar.init_targets()
 
+    if use_patch_memory:
+        write_patch_memory(qemu)
+
     for intercept in config.intercepts:
         if intercept.bp_addr is not None:
             log.info("Registering Intercept: %s" % intercept)
@@ -265,18 +306,52 @@ def emulate_binary(config, target_name=None, log_basic_blocks=None,
         qemu.regs.cpsr |= 0x20  # Make sure the thumb bit is set
         qemu.regs.sp = config.machine.init_sp  # Set SP as Qemu doesn't init correctly
         qemu.set_vector_table_base(config.machine.vector_base)
-    
+
+    snapshot = None
+    if restore is not None:
+        log.info("Loading snapshot %s" % restore)
+        snapshot = hal_snapshot.load(restore)
+    elif config.options.get('snapshot_at') is not None:
+        hal_snapshot.arm(qemu, config, config.options['snapshot_at'],
+                         config.options.get('snapshot_file', os.path.join(
+                             avatar.output_directory,
+                             hal_snapshot.DEFAULT_FILENAME)),
+                         config.options.get('snapshot_exit', False))
 
     # Emulate the Binary
-    periph_server.start(rx_port, tx_port, qemu)
+    periph_server.start(rx_port, tx_port, qemu,
+                        config.options.get('peripheral_codec', 'auto'),
+                        config.options.get('max_pending_irqs', 256))
+    if snapshot is not None:
+        hal_snapshot.restore(qemu, snapshot, config)
+    return avatar, qemu
+
+
+def shutdown_emulation(avatar):
+    '''
+        Stops the target, writes stats/profiles and stops the servers
+    '''
+    avatar.stop()
+    hal_stats.shutdown()
+    hal_profile.write_profile()
+    if avatar.recorder is not None:
+        avatar.recorder.close()
+    avatar.shutdown()
+    periph_server.stop()
+
+
+def emulate_binary(config, target_name=None, log_basic_blocks=None,
+                   rx_port=5555, tx_port=5556, gdb_port=1234, elf_file=None, db_name=None,
+                   profile=False, profile_handlers=(), restore=None):
+    avatar, qemu = setup_emulation(config, target_name, log_basic_blocks,
+                                   rx_port, tx_port, gdb_port, elf_file,
+                                   db_name, profile, profile_handlers, restore)
     # import os; os.system('stty sane') # Make so display works
     # import IPython; IPython.embed()
 
     def signal_handler(signal, frame):
         print('You pressed Ctrl+C!')
-        avatar.stop()
-        avatar.shutdown()
-        periph_server.stop()
+        shutdown_emulation(avatar)
         sys.exit(0)
     signal.signal(signal.SIGINT, signal_handler)
     log.info("Letting QEMU Run")
@@ -292,6 +367,10 @@ def emulate_binary(config, target_name=None, log_basic_blocks=None,
         # import IPython; IPython.embed()
         periph_server.stop()
         avatar.stop()
+        hal_stats.shutdown()
+        hal_profile.write_profile()
+        if avatar.recorder is not None:
+            avatar.recorder.close()
         avatar.shutdown()
         quit(-1)
 
@@ -318,26 +397,34 @@ def main():
                    help="GDB_Port")
     p.add_argument('-e', '--elf', default=None,
                    help='Elf file, required to use recorder')
+    p.add_argument('--profile', default=False, action='store_true',
+                   help='Record per intercept latency histograms to profile.yaml')
+    p.add_argument('--profile_handlers', action='append', default=[],
+                   help='bp_handler class name to run under cProfile (implies '
+                        '--profile), "all" profiles every class')
+
+    p.add_argument('--restore', default=None,
+                   help='Start from a snapshot saved with the snapshot_at option')
+    p.add_argument('--config_cache', default=hal_config.DEFAULT_CACHE_DIR,
+                   help='Directory to cache validated configs in')
+    p.add_argument('--no_config_cache', default=False, action='store_true',
+                   help='Always parse and validate configs')
 
     args = p.parse_args()
 
     # Build configuration
-    config = hal_config.HalucinatorConfig()
-    for conf_file in args.config:
-        log.info("Parsing config file: %s" %conf_file)
-        config.add_yaml(conf_file)
-
-    for csv_file in args.symbols:
-        log.info("Parsing csv symbol file: %s" %csv_file)
-        config.add_csv_symbols(csv_file)
-
-    if not config.prepare_and_validate():
+    cache_dir = None if args.no_config_cache else args.config_cache
+    config = hal_config.load_config(args.config, args.symbols, cache_dir)
+    if config is None:
         log.error("Config invalid")
         exit(-1)
 
     emulate_binary(config, args.name, args.log_blocks,
                    args.rx_port, args.tx_port,
-                   elf_file=args.elf, gdb_port=args.gdb_port)
+                   elf_file=args.elf, gdb_port=args.gdb_port,
+                   profile=args.profile or bool(args.profile_handlers),
+                   profile_handlers=args.profile_handlers,
+                   restore=args.restore)
 
 
 if __name__ == '__main__':
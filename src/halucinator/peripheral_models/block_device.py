@@ -0,0 +1,281 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+import mmap
+import os
+import struct
+from threading import Thread, Event, RLock
+import logging
+log = logging.getLogger(__name__)
+
+GROW_SIZE = 1024 * 1024  # Image grows in multiples of this, file is sparse
+
+OVERLAY_MAGIC = b'HALCOW01'
+OVERLAY_HEADER = struct.Struct('<8sI4x')  # magic, block size
+OVERLAY_RECORD = struct.Struct('<Q')      # block number, followed by block
+
+
+class MmapBlockDevice(object):
+    '''
+        Block device backed by a memory mapped sparse image file.  Multi
+        block reads return a memoryview into the map (no copy), blocks never
+        written read as zeros.  Dirty data is flushed to the file by a
+        background thread every flush_interval seconds and on close.
+    '''
+    def __init__(self, filename, block_size=0x200, flush_interval=1.0):
+        self.filename = filename
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self._lock = RLock()
+        self._retired = []  # Maps replaced while memoryviews were exported
+        self._dirty = Event()
+        self._closed = Event()
+
+        mode = 'r+b' if os.path.exists(filename) else 'w+b'
+        self._file = open(filename, mode)
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._map = None
+        if self.size:
+            self._map = mmap.mmap(self._file.fileno(), self.size)
+        self._flusher = Thread(target=self._flush_loop, daemon=True,
+                               name="BlockDevice %s" % filename)
+        self._flusher.start()
+
+    def _grow(self, size):
+        '''
+            Extends the image to at least size bytes and remaps it
+        '''
+        size = ((size + GROW_SIZE - 1) // GROW_SIZE) * GROW_SIZE
+        log.debug("Growing %s to %#x" % (self.filename, size))
+        if self._map is not None:
+            self._map.flush()
+            try:
+                self._map.close()
+            except BufferError:
+                # Memoryviews from read_blocks still reference it
+                self._retired.append(self._map)
+        self._file.truncate(size)
+        self.size = size
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    def read_blocks(self, block_num, count=1):
+        '''
+            Reads count blocks starting at block_num
+
+            :returns memoryview (bytes if the read extends past the image)
+        '''
+        start = block_num * self.block_size
+        end = start + count * self.block_size
+        with self._lock:
+            if end <= self.size:
+                return memoryview(self._map)[start:end]
+            data = self._map[start:self.size] if start < self.size else b''
+        return data + bytes(end - start - len(data))
+
+    def write_blocks(self, block_num, data):
+        '''
+            Writes data (multiple of block_size) starting at block_num
+        '''
+        start = block_num * self.block_size
+        end = start + len(data)
+        with self._lock:
+            if end > self.size:
+                self._grow(end)
+            self._map[start:end] = data
+        self._dirty.set()
+        return True
+
+    def flush(self):
+        with self._lock:
+            self._dirty.clear()
+            if self._map is not None:
+                self._map.flush()
+
+    def _flush_loop(self):
+        while not self._closed.is_set():
+            self._dirty.wait()
+            if self._closed.wait(self.flush_interval):
+                break
+            self.flush()
+
+    def close(self):
+        self._closed.set()
+        self._dirty.set()
+        self._flusher.join()
+        self.flush()
+        with self._lock:
+            for old_map in self._retired + [self._map]:
+                if old_map is not None:
+                    try:
+                        old_map.close()
+                    except BufferError:
+                        pass
+            self._file.close()
+
+
+class OverlayBlockDevice(object):
+    '''
+        Copy-on-write block device.  Reads come from a shared read only
+        base image unless the block has been written, writes go to a per
+        instance overlay file.  The overlay file is a header followed by
+        records of (block number, block data), a written block is updated
+        in place.  Use merge to apply the overlay to the base image or
+        discard to drop it.
+    '''
+    def __init__(self, base_filename, overlay_filename, block_size=0x200,
+                 flush_interval=1.0):
+        self.base_filename = base_filename
+        self.filename = overlay_filename
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self._lock = RLock()
+        self._dirty = Event()
+        self._closed = Event()
+        self.blocks = {}  # block number: offset of data in overlay file
+
+        with open(base_filename, 'rb') as base:
+            self.base_size = os.fstat(base.fileno()).st_size
+            self._base = None
+            if self.base_size:
+                # Read only shared map, all instances share the page cache
+                self._base = mmap.mmap(base.fileno(), self.base_size,
+                                       access=mmap.ACCESS_READ)
+
+        self._fd = os.open(overlay_filename, os.O_RDWR | os.O_CREAT, 0o644)
+        self._load_index()
+        self._flusher = Thread(target=self._flush_loop, daemon=True,
+                               name="Overlay %s" % overlay_filename)
+        self._flusher.start()
+
+    def _load_index(self):
+        size = os.fstat(self._fd).st_size
+        if size == 0:
+            os.pwrite(self._fd, OVERLAY_HEADER.pack(OVERLAY_MAGIC,
+                                                    self.block_size), 0)
+            self._end = OVERLAY_HEADER.size
+            return
+        magic, block_size = OVERLAY_HEADER.unpack(
+            os.pread(self._fd, OVERLAY_HEADER.size, 0))
+        if magic != OVERLAY_MAGIC:
+            raise ValueError("%s is not an overlay file" % self.filename)
+        if block_size != self.block_size:
+            log.warning("Overlay %s uses block size %i" % (self.filename,
+                                                           block_size))
+            self.block_size = block_size
+        record_size = OVERLAY_RECORD.size + block_size
+        offset = OVERLAY_HEADER.size
+        while offset + record_size <= size:
+            block_num, = OVERLAY_RECORD.unpack(
+                os.pread(self._fd, OVERLAY_RECORD.size, offset))
+            self.blocks[block_num] = offset + OVERLAY_RECORD.size
+            offset += record_size
+        self._end = offset
+
+    def _base_slice(self, start, end):
+        if end <= self.base_size:
+            return memoryview(self._base)[start:end]
+        data = self._base[start:self.base_size] if start < self.base_size else b''
+        return data + bytes(end - start - len(data))
+
+    def read_blocks(self, block_num, count=1):
+        '''
+            Reads count blocks starting at block_num
+
+            :returns memoryview of the base image if no block is in the
+                     overlay, else bytes
+        '''
+        bs = self.block_size
+        with self._lock:
+            written = [b for b in range(block_num, block_num + count)
+                       if b in self.blocks]
+            if not written:
+                return self._base_slice(block_num * bs, (block_num + count) * bs)
+            data = bytearray(self._base_slice(block_num * bs,
+                                              (block_num + count) * bs))
+            for block in written:
+                offset = (block - block_num) * bs
+                data[offset:offset + bs] = os.pread(self._fd, bs,
+                                                    self.blocks[block])
+        return bytes(data)
+
+    def write_blocks(self, block_num, data):
+        '''
+            Writes data (multiple of block_size) starting at block_num to
+            the overlay
+        '''
+        bs = self.block_size
+        data = memoryview(data)
+        with self._lock:
+            for idx in range(len(data) // bs):
+                block = block_num + idx
+                chunk = data[idx * bs:(idx + 1) * bs]
+                if block in self.blocks:
+                    os.pwrite(self._fd, chunk, self.blocks[block])
+                else:
+                    os.pwrite(self._fd, OVERLAY_RECORD.pack(block) + chunk,
+                              self._end)
+                    self.blocks[block] = self._end + OVERLAY_RECORD.size
+                    self._end += OVERLAY_RECORD.size + bs
+        self._dirty.set()
+        return True
+
+    def flush(self):
+        with self._lock:
+            self._dirty.clear()
+            os.fsync(self._fd)
+
+    def _flush_loop(self):
+        while not self._closed.is_set():
+            self._dirty.wait()
+            if self._closed.wait(self.flush_interval):
+                break
+            self.flush()
+
+    def merge(self):
+        '''
+            Writes the overlay blocks into the base image and empties the
+            overlay.  No other instance may be using the base image.
+        '''
+        with self._lock, open(self.base_filename, 'r+b') as base:
+            for block, offset in sorted(self.blocks.items()):
+                base.seek(block * self.block_size)
+                base.write(os.pread(self._fd, self.block_size, offset))
+            base.flush()
+            os.fsync(base.fileno())
+        log.info("Merged %i blocks into %s" % (len(self.blocks),
+                                               self.base_filename))
+        self.discard()
+
+    def discard(self):
+        '''
+            Drops all blocks written to the overlay
+        '''
+        with self._lock:
+            os.ftruncate(self._fd, 0)
+            self.blocks = {}
+            self._load_index()
+            if self._base is not None:
+                try:
+                    self._base.close()
+                except BufferError:
+                    pass  # Memoryviews still exported, left for gc
+            with open(self.base_filename, 'rb') as base:
+                self.base_size = os.fstat(base.fileno()).st_size
+                self._base = None
+                if self.base_size:
+                    self._base = mmap.mmap(base.fileno(), self.base_size,
+                                           access=mmap.ACCESS_READ)
+
+    def close(self):
+        self._closed.set()
+        self._dirty.set()
+        self._flusher.join()
+        self.flush()
+        with self._lock:
+            if self._base is not None:
+                try:
+                    self._base.close()
+                except BufferError:
+                    pass
+            os.close(self._fd)
@@ -0,0 +1,151 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+'''
+    Wire formats for messages between the peripheral server and IO servers.
+
+    yaml:   Single frame "topic yaml_encoded_msg", the original format
+    binary: Multipart message
+                frame 0:  topic
+                frame 1:  header, HEADER (magic, version, number of payloads)
+                          followed by json of the msg without payloads
+                frame 2+: raw payloads, the bytes values of msg
+            Bytes values (e.g., ethernet frames) are sent without encoding.
+            Messages json can't represent exactly (non str keys, tuples,
+            sets) are sent as yaml.
+
+    Received messages are decoded based on their format so both formats can
+    be received on any socket.  Sockets using the 'auto' codec send with the
+    format last received on that connection.  Until something is received
+    the peripheral server sends yaml, so peers that only speak yaml (even
+    ones that only subscribe) keep working, while the IO servers in
+    external_devices start with binary so the peripheral server switches to
+    it once they send.
+'''
+import json
+import struct
+import yaml
+import zmq
+import logging
+log = logging.getLogger(__name__)
+
+MAGIC = 0xA7
+VERSION = 1
+HEADER = struct.Struct('<BBH')  # magic, version, number of payload frames
+
+YAML = 'yaml'
+BINARY = 'binary'
+AUTO = 'auto'
+CODECS = (YAML, BINARY, AUTO)
+
+
+def encode_yaml(topic, msg):
+    return [("%s %s" % (topic, yaml.safe_dump(msg))).encode('utf-8')]
+
+
+def decode_yaml(frame):
+    topic, encoded_msg = bytes(frame).decode('utf-8').split(' ', 1)
+    return topic, yaml.safe_load(encoded_msg)
+
+
+def _json_exact(value):
+    '''
+        True if json round trips value unchanged (it turns tuples into lists
+        and int keys into strings)
+    '''
+    if isinstance(value, dict):
+        return all(isinstance(k, str) and _json_exact(v)
+                   for k, v in value.items())
+    if isinstance(value, list):
+        return all(_json_exact(v) for v in value)
+    return value is None or isinstance(value, (str, int, float))
+
+
+def encode_binary(topic, msg):
+    '''
+        Returns list of frames, falls back to yaml if msg can't be
+        represented exactly (e.g., nested bytes, int keys, tuples)
+    '''
+    if not isinstance(msg, dict) or \
+            not all(isinstance(key, str) for key in msg):
+        return encode_yaml(topic, msg)
+    fields = {}
+    payloads = []
+    payload_keys = []
+    for key, value in msg.items():
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            payload_keys.append(key)
+            payloads.append(value)
+        elif _json_exact(value):
+            fields[key] = value
+        else:
+            return encode_yaml(topic, msg)
+    meta = json.dumps([fields, payload_keys],
+                      separators=(',', ':')).encode('utf-8')
+    header = HEADER.pack(MAGIC, VERSION, len(payloads)) + meta
+    return [topic.encode('utf-8'), header] + payloads
+
+
+def decode_binary(frames):
+    magic, version, num_payloads = HEADER.unpack_from(frames[1])
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Unsupported message version %i" % version)
+    fields, payload_keys = json.loads(bytes(frames[1][HEADER.size:]))
+    for key, payload in zip(payload_keys, frames[2:2 + num_payloads]):
+        fields[key] = bytes(payload)
+    return frames[0].decode('utf-8'), fields
+
+
+def encode(topic, msg, codec=BINARY):
+    if codec == YAML:
+        return encode_yaml(topic, msg)
+    return encode_binary(topic, msg)
+
+
+def decode(frames):
+    '''
+        Decodes a multipart message received from zmq
+
+        :returns (topic, msg, codec used by sender)
+    '''
+    if len(frames) == 1:
+        topic, msg = decode_yaml(frames[0])
+        return topic, msg, YAML
+    topic, msg = decode_binary(frames)
+    return topic, msg, BINARY
+
+
+class Connection(object):
+    '''
+        Tracks the codec to use when sending on a connection
+
+        :param codec: yaml, binary, or auto
+        :param initial: Codec auto sends with until the peer is heard
+    '''
+    def __init__(self, codec=AUTO, initial=YAML):
+        if codec not in CODECS:
+            raise ValueError("Unknown codec %s, valid %s" % (codec, CODECS))
+        self.codec = codec
+        self.tx_codec = initial if codec == AUTO else codec
+
+    def send(self, socket, topic, msg):
+        socket.send_multipart(encode(topic, msg, self.tx_codec), copy=False)
+
+    def recv(self, socket):
+        '''
+            Receives and decodes a message, in auto mode the sender's codec
+            is used for subsequent sends
+        '''
+        return self.decode(socket.recv_multipart())
+
+    def decode(self, frames):
+        '''
+            Decodes frames received on this connection (e.g., from an
+            asyncio socket), see recv
+        '''
+        topic, msg, codec = decode(frames)
+        if self.codec == AUTO and codec != self.tx_codec:
+            log.info("Peer uses %s codec, switching" % codec)
+            self.tx_codec = codec
+        return topic, msg
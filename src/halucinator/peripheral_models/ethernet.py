@@ -5,12 +5,11 @@
 
 from . import peripheral_server
 # from peripheral_server import PeripheralServer, peripheral_model
-from collections import deque, defaultdict
 from .interrupts import Interrupts
+from .frame_queue import FrameQueue
 import binascii
-import struct
+from functools import partial
 import logging
-import time
 log = logging.getLogger(__name__)
 # log.setLevel(logging.DEBUG)
 
@@ -19,16 +18,23 @@ log = logging.getLogger(__name__)
 @peripheral_server.peripheral_model
 class EthernetModel(object):
 
-    frame_queues = defaultdict(deque)
+    frame_queues = {}  # interface_id: FrameQueue
     calc_crc = True
     rx_frame_isr = None
     rx_isr_enabled = False
-    frame_times = defaultdict(deque)  # Used to record reception time
+
+    @classmethod
+    def get_queue(cls, interface_id):
+        if interface_id not in cls.frame_queues:
+            cls.frame_queues[interface_id] = FrameQueue(
+                "EthernetModel.%s" % interface_id,
+                on_credit=partial(cls.rx_credit, interface_id))
+        return cls.frame_queues[interface_id]
 
     @classmethod
     def enable_rx_isr(cls, interface_id):
         cls.rx_isr_enabled = True
-        if cls.frame_queues[interface_id] and cls.rx_frame_isr is not None:
+        if cls.get_queue(interface_id) and cls.rx_frame_isr is not None:
             Interrupts.trigger_interrupt(cls.rx_frame_isr, 'Ethernet_RX_Frame')
 
     @classmethod
@@ -47,6 +53,14 @@ class EthernetModel(object):
         msg = {'interface_id': interface_id, 'frame': frame}
         return msg
 
+    @classmethod
+    @peripheral_server.tx_msg
+    def rx_credit(cls, interface_id, credits):
+        '''
+            Tells the sender how many frames it may send, 0 pauses it
+        '''
+        return {'interface_id': interface_id, 'credits': credits}
+
     @classmethod
     @peripheral_server.reg_rx_handler
     def rx_frame(cls, msg):
@@ -57,21 +71,15 @@ class EthernetModel(object):
         interface_id = msg['interface_id']
         log.info("Adding Frame to: %s" % interface_id)
         frame = msg['frame']
-        cls.frame_queues[interface_id].append(frame)
-        cls.frame_times[interface_id].append(time.time())
-        log.info("Adding Frame to: %s" % interface_id)
+        if not cls.get_queue(interface_id).put(frame):
+            log.info("Queue full, dropped frame for: %s" % interface_id)
         if cls.rx_frame_isr is not None and cls.rx_isr_enabled:
             Interrupts.trigger_interrupt(cls.rx_frame_isr, 'Ethernet_RX_Frame')
 
     @classmethod
     def get_rx_frame(cls, interface_id, get_time=False):
-        frame = None
-        rx_time = None
         log.info("Checking for: %s" % str(interface_id))
-        if cls.frame_queues[interface_id]:
-            log.info("Returning frame")
-            frame = cls.frame_queues[interface_id].popleft()
-            rx_time = cls.frame_times[interface_id].popleft()
+        rx_time, frame = cls.get_queue(interface_id).get()
 
         if get_time:
             return frame, rx_time
@@ -83,7 +91,8 @@ class EthernetModel(object):
         '''
             return number of frames and length of first frame
         '''
-        queue = cls.frame_queues[interface_id]
-        if queue:
-            return len(queue), len(queue[0])
+        queue = cls.get_queue(interface_id)
+        frame = queue.peek()
+        if frame is not None:
+            return len(queue), len(frame)
         return 0, 0
@@ -0,0 +1,161 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+'''
+    Bounded receive queues for frame based peripheral models.  When a
+    queue is full the policy decides what happens to a new frame:
+
+    tail-drop:  The new frame is dropped
+    head-drop:  The oldest queued frame is dropped
+    pause:      The new frame is dropped and the sender is told to stop,
+                by calling on_credit(0).  Once drained to half full
+                on_credit(free slots) tells it to resume.
+
+    Depth and drop counters are written to stats.yaml under frame_queues.
+'''
+from collections import deque
+from threading import Lock
+from .. import hal_clock
+from .. import hal_stats
+import logging
+log = logging.getLogger(__name__)
+
+TAIL_DROP = 'tail-drop'
+HEAD_DROP = 'head-drop'
+PAUSE = 'pause'
+POLICIES = (TAIL_DROP, HEAD_DROP, PAUSE)
+
+default_max_frames = 1024
+default_policy = TAIL_DROP
+_queues = {}  # name: FrameQueue
+
+
+def set_defaults(max_frames=None, policy=None):
+    '''
+        Sets the size and policy of queues created after this call
+    '''
+    global default_max_frames, default_policy
+    if max_frames is not None:
+        default_max_frames = int(max_frames)
+    if policy is not None:
+        if policy not in POLICIES:
+            raise ValueError("Unknown frame queue policy %s, valid %s" %
+                             (policy, POLICIES))
+        default_policy = policy
+
+
+class FrameQueue(object):
+    '''
+        FIFO of (rx_time, frame) records
+
+        :param name:      Name used in stats
+        :param on_credit: Called with the number of frames the sender may
+                          send, only used by the pause policy
+    '''
+    def __init__(self, name, max_frames=None, policy=None, on_credit=None):
+        self.name = name
+        self.max_frames = default_max_frames if max_frames is None \
+            else max_frames
+        self.policy = default_policy if policy is None else policy
+        if self.policy not in POLICIES:
+            raise ValueError("Unknown frame queue policy %s, valid %s" %
+                             (self.policy, POLICIES))
+        self.on_credit = on_credit
+        self.paused = False
+        self._frames = deque()
+        self._lock = Lock()
+        self.enqueued = 0
+        self.dequeued = 0
+        self.dropped = 0
+        self.max_depth = 0
+        _queues[name] = self
+
+    def __getstate__(self):
+        # Lock can't be pickled (hal_snapshot), a new one is made
+        with self._lock:
+            state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+        _queues[self.name] = self
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, frame):
+        '''
+            Adds frame, stamped with the current hal_clock time
+
+            :returns False if frame was dropped
+        '''
+        credit = None
+        with self._lock:
+            if len(self._frames) >= self.max_frames:
+                self.dropped += 1
+                if self.policy == HEAD_DROP:
+                    self._frames.popleft()
+                else:
+                    if self.policy == PAUSE and not self.paused:
+                        self.paused = True
+                        credit = 0
+                    frame = None
+            if frame is not None:
+                self._frames.append((hal_clock.now(), frame))
+                self.enqueued += 1
+                self.max_depth = max(self.max_depth, len(self._frames))
+        if credit is not None:
+            self._send_credit(credit)
+        return frame is not None
+
+    def get(self):
+        '''
+            Removes the oldest frame
+
+            :returns (rx_time, frame) or (None, None) if empty
+        '''
+        credit = None
+        with self._lock:
+            if not self._frames:
+                return None, None
+            record = self._frames.popleft()
+            self.dequeued += 1
+            if self.paused and len(self._frames) <= self.max_frames // 2:
+                self.paused = False
+                credit = self.max_frames - len(self._frames)
+        if credit is not None:
+            self._send_credit(credit)
+        return record
+
+    def peek(self):
+        '''
+            :returns first frame without removing it, None if empty
+        '''
+        with self._lock:
+            return self._frames[0][1] if self._frames else None
+
+    def _send_credit(self, credits):
+        log.info("%s: sending %i credits" % (self.name, credits))
+        if self.on_credit is not None:
+            try:
+                self.on_credit(credits)
+            except Exception:
+                log.exception("Failed to send credits for %s" % self.name)
+
+    def stats(self):
+        return {'depth': len(self._frames), 'max_depth': self.max_depth,
+                'enqueued': self.enqueued, 'dequeued': self.dequeued,
+                'dropped': self.dropped, 'max_frames': self.max_frames,
+                'policy': self.policy}
+
+
+def update_stats():
+    if _queues:
+        hal_stats.stats['frame_queues'] = {name: q.stats()
+                                           for name, q in _queues.items()}
+
+
+hal_stats.add_lazy_update(update_stats)
@@ -59,7 +59,8 @@ class HaltPeripheral(AvatarPeripheral):
                  (self.name, addr, size, hex(pc)))
         hal_stats.write_on_update('MMIO_read_addresses', hex(addr))
         hal_stats.write_on_update('MMIO_addresses', hex(addr))
-        hal_stats.write_on_update('MMIO_addr_pc', (hex(addr), hex(pc), 'r'))
+        hal_stats.write_on_update(
+            'MMIO_addr_pc', "0x%08x,0x%08x,%s" % (addr, pc, 'r'))
         print("HALTING on MMIO READ")
         while 1:
             pass
@@ -70,7 +71,8 @@ class HaltPeripheral(AvatarPeripheral):
             self.name, addr, size, value, hex(pc)))
         hal_stats.write_on_update('MMIO_write_addresses', hex(addr))
         hal_stats.write_on_update('MMIO_addresses', hex(addr))
-        hal_stats.write_on_update('MMIO_addr_pc', (hex(addr), hex(pc), 'w'))
+        hal_stats.write_on_update(
+            'MMIO_addr_pc', "0x%08x,0x%08x,%s" % (addr, pc, 'w'))
         print("HALTING on MMIO Write")
         while 1:
             pass
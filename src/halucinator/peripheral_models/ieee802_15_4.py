@@ -5,12 +5,10 @@
 
 from . import peripheral_server
 # from peripheral_server import PeripheralServer, peripheral_model
-from collections import deque, defaultdict
 from .interrupts import Interrupts
+from .frame_queue import FrameQueue
 import binascii
-import struct
 import logging
-import time
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
@@ -20,16 +18,22 @@ log.setLevel(logging.DEBUG)
 class IEEE802_15_4(object):
 
     IRQ_NAME = '802_15_4_RX_Frame'
-    frame_queue = deque()
+    frame_queue = None  # FrameQueue, created by get_queue
     calc_crc = True
     rx_frame_isr = None
     rx_isr_enabled = False
-    frame_time = deque()  # Used to record reception time
+
+    @classmethod
+    def get_queue(cls):
+        if cls.frame_queue is None:
+            cls.frame_queue = FrameQueue("IEEE802_15_4",
+                                         on_credit=cls.rx_credit)
+        return cls.frame_queue
 
     @classmethod
     def enable_rx_isr(cls, interface_id):
         cls.rx_isr_enabled = True
-        if cls.frame_queue and cls.rx_frame_isr is not None:
+        if cls.get_queue() and cls.rx_frame_isr is not None:
             Interrupts.trigger_interrupt(cls.rx_frame_isr, cls.IRQ_NAME)
 
     @classmethod
@@ -47,6 +51,14 @@ class IEEE802_15_4(object):
         msg = {'frame': frame}
         return msg
 
+    @classmethod
+    @peripheral_server.tx_msg
+    def rx_credit(cls, credits):
+        '''
+            Tells the sender how many frames it may send, 0 pauses it
+        '''
+        return {'credits': credits}
+
     @classmethod
     @peripheral_server.reg_rx_handler
     def rx_frame(cls, msg):
@@ -57,20 +69,15 @@ class IEEE802_15_4(object):
         frame = msg['frame']
         log.info("Received Frame: %s" % binascii.hexlify(frame))
 
-        cls.frame_queue.append(frame)
-        cls.frame_time.append(time.time())
+        if not cls.get_queue().put(frame):
+            log.info("Queue full, dropped frame")
         if cls.rx_frame_isr is not None and cls.rx_isr_enabled:
             Interrupts.trigger_interrupt(cls.rx_frame_isr,  cls.IRQ_NAME)
 
     @classmethod
     def get_first_frame(cls, get_time=False):
-        frame = None
-        rx_time = None
         log.info("Checking for frame")
-        if cls.frame_queue > 0:
-            log.info("Returning frame")
-            frame = cls.frame_queue.popleft()
-            rx_time = cls.frame_time.popleft()
+        rx_time, frame = cls.get_queue().get()
 
         if get_time:
             return frame, rx_time
@@ -79,14 +86,15 @@ class IEEE802_15_4(object):
 
     @classmethod
     def has_frame(cls):
-        return len(cls.frame_queue) > 0
+        return len(cls.get_queue()) > 0
 
     @classmethod
     def get_frame_info(cls):
         '''
             return number of frames and length of first frame
         '''
-        queue = cls.frame_queue
-        if queue:
-            return len(queue), len(queue[0])
+        queue = cls.get_queue()
+        frame = queue.peek()
+        if frame is not None:
+            return len(queue), len(frame)
         return 0, 0
@@ -0,0 +1,122 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+from collections import OrderedDict, defaultdict
+from threading import Thread, Condition
+import logging
+log = logging.getLogger(__name__)
+
+
+class IrqDispatcher(object):
+    '''
+        Queues interrupt requests and injects them from a single thread.
+        A request for an IRQ that is still pending (requested but not yet
+        injected) is coalesced into it.  While held (e.g., the target is
+        stopped in an intercept) requests accumulate and are injected
+        together when released.
+
+        :param inject:      Function called with the IRQ number to inject it
+        :param max_pending: Max distinct IRQs pending, further requests are
+                            dropped
+    '''
+    def __init__(self, inject, max_pending=256):
+        self.inject = inject
+        self.max_pending = max_pending
+        self._pending = OrderedDict()  # irq: None, in request order
+        self._holds = 0
+        self._running = True
+        self._cond = Condition()
+        self.counts = defaultdict(int)  # requested, injected, coalesced, ...
+        self.irq_counts = defaultdict(lambda: defaultdict(int))
+        self._thread = Thread(target=self._run, daemon=True,
+                              name="IrqDispatcher")
+        self._thread.start()
+
+    def _count(self, irq_num, key):
+        self.counts[key] += 1
+        self.irq_counts[irq_num][key] += 1
+
+    def request(self, irq_num):
+        '''
+            Queues irq_num for injection
+
+            :returns False if the request was dropped
+        '''
+        with self._cond:
+            self._count(irq_num, 'requested')
+            if irq_num in self._pending:
+                self._count(irq_num, 'coalesced')
+                return True
+            if len(self._pending) >= self.max_pending:
+                self._count(irq_num, 'dropped')
+                log.debug("IRQ queue full, dropping %s" % irq_num)
+                return False
+            self._pending[irq_num] = None
+            if not self._holds:
+                self._cond.notify()
+            return True
+
+    def hold(self):
+        '''
+            Defers injection until a matching release
+        '''
+        with self._cond:
+            self._holds += 1
+
+    def release(self):
+        with self._cond:
+            self._holds = max(0, self._holds - 1)
+            if not self._holds and self._pending:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: not self._running or
+                                    (self._pending and not self._holds))
+                if not self._running:
+                    return
+                batch = list(self._pending)
+                self._pending.clear()
+            # Requests arriving while injecting queue for the next batch
+            for irq_num in batch:
+                log.debug("Injecting IRQ %s" % irq_num)
+                try:
+                    self.inject(irq_num)
+                    result = 'injected'
+                except Exception:
+                    result = 'dropped'
+                    log.exception("Failed to inject IRQ %s" % irq_num)
+                with self._cond:
+                    self._count(irq_num, result)
+            with self._cond:
+                self.counts['batches'] += 1
+
+    def clear(self):
+        '''
+            Drops the pending requests
+        '''
+        with self._cond:
+            for irq_num in self._pending:
+                self._count(irq_num, 'dropped')
+            self._pending.clear()
+
+    def stats(self):
+        '''
+            Returns the counts as plain dicts
+        '''
+        with self._cond:
+            out = dict(self.counts)
+            out['irqs'] = {irq: dict(c) for irq, c in self.irq_counts.items()}
+        return out
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+        with self._cond:
+            for irq_num in self._pending:
+                self._count(irq_num, 'dropped')
+            self._pending.clear()
@@ -5,20 +5,28 @@
 import zmq
 import yaml
 from functools import wraps
+from . import codec
+from .irq_dispatcher import IrqDispatcher
+from .. import hal_stats
 from multiprocessing import Process
+from threading import Lock
 import logging
 log = logging.getLogger(__name__)
 
 
 __rx_handlers__ = {}
+__models__ = {}  # module.class name: peripheral model class
 __rx_context__ = zmq.Context()
 __tx_context__ = zmq.Context()
 __stop_server = False
 __rx_socket__ = None
 __tx_socket__ = None
+__tx_lock = Lock()  # zmq sockets aren't thread safe, models send from any thread
 
 __process = None
 __qemu = None
+__connection = codec.Connection()
+__irq_dispatcher = None
 
 output_directory = None
 
@@ -27,6 +35,7 @@ def peripheral_model(cls):
     '''
         Decorator which registers classes as peripheral models 
     '''
+    __models__['%s.%s' % (cls.__module__, cls.__name__)] = cls
     methods = [getattr(cls, x) for x in dir(
         cls) if hasattr(getattr(cls, x), 'is_rx_handler')]
     for m in methods:
@@ -40,6 +49,13 @@ def peripheral_model(cls):
     return cls
 
 
+def get_models():
+    '''
+        Returns dict of {module.class name: class} of registered models
+    '''
+    return dict(__models__)
+
+
 def tx_msg(funct):
     '''
         This is a decorator that sends output of the wrapped function as 
@@ -54,9 +70,9 @@ def tx_msg(funct):
         global __tx_socket__
         data = funct(model_cls, *args)
         topic = "Peripheral.%s.%s" % (model_cls.__name__, funct.__name__)
-        msg = encode_zmq_msg(topic, data)
-        log.info("Sending: %s" % msg)
-        __tx_socket__.send_string(msg)
+        log.info("Sending: %s %s" % (topic, data))
+        with __tx_lock:
+            __connection.send(__tx_socket__, topic, data)
     return tx_msg_decorator
 
 
@@ -70,6 +86,10 @@ def reg_rx_handler(funct):
 
 
 def encode_zmq_msg(topic, msg):
+    '''
+        YAML encoding, kept for compatibility see codec.py for the wire
+        formats used by the server
+    '''
     data_yaml = yaml.safe_dump(msg)
     return "%s %s" % (topic, data_yaml)
 
@@ -80,7 +100,14 @@ def decode_zmq_msg(msg):
     return (topic, decoded_msg)
 
 
-def start(rx_port=5555, tx_port=5556, qemu=None):
+def start(rx_port=5555, tx_port=5556, qemu=None, msg_codec=codec.AUTO,
+          max_pending_irqs=256):
+    '''
+        :param msg_codec: Wire format to send with (yaml, binary, or auto),
+                          see codec.py
+        :param max_pending_irqs: Distinct IRQs that can be queued for
+                                 injection before requests are dropped
+    '''
     # TODO Change from localhost if needed
     global __rx_socket__
     global __tx_socket__
@@ -90,9 +117,14 @@ def start(rx_port=5555, tx_port=5556, qemu=None):
     global __process
     global __qemu
     global output_directory
+    global __connection
+    global __irq_dispatcher
 
     output_directory = qemu.avatar.output_directory
     __qemu = qemu
+    __connection = codec.Connection(msg_codec)
+    __irq_dispatcher = IrqDispatcher(qemu.trigger_interrupt, max_pending_irqs)
+    hal_stats.add_lazy_update(update_irq_stats)
     log.info('Starting Peripheral Server, In port %i, outport %i' %
              (rx_port, tx_port))
     # Setup subscriber
@@ -112,9 +144,42 @@ def start(rx_port=5555, tx_port=5556, qemu=None):
 
 
 def trigger_interrupt(num):
+    '''
+        Queues interrupt num, duplicates of a pending interrupt are coalesced
+    '''
     global __qemu
     log.info("Sending Interrupt: %s" % num)
-    __qemu.trigger_interrupt(num)
+    if __irq_dispatcher is None:
+        __qemu.trigger_interrupt(num)
+    else:
+        __irq_dispatcher.request(num)
+
+
+def hold_interrupts():
+    '''
+        Defers injecting interrupts until release_interrupts, used while
+        the target is stopped in an intercept
+    '''
+    if __irq_dispatcher is not None:
+        __irq_dispatcher.hold()
+
+
+def release_interrupts():
+    if __irq_dispatcher is not None:
+        __irq_dispatcher.release()
+
+
+def clear_interrupts():
+    '''
+        Drops interrupts queued for injection
+    '''
+    if __irq_dispatcher is not None:
+        __irq_dispatcher.clear()
+
+
+def update_irq_stats():
+    if __irq_dispatcher is not None:
+        hal_stats.stats['interrupts'] = __irq_dispatcher.stats()
 
 
 def irq_set(irq_num=1, cpu=0):
@@ -144,31 +209,42 @@ def run_server():
     while(not __stop_server):
         socks = dict(poller.poll(500))
         if __rx_socket__ in socks and socks[__rx_socket__] == zmq.POLLIN:
-            string = __rx_socket__.recv_string()
-            topic, msg = decode_zmq_msg(string)
+            topic, msg = __connection.recv(__rx_socket__)
             log.info("Got message: Topic %s  Msg: %s" % (str(topic), str(msg)))
-
-            if topic.startswith("Peripheral"):
-                if topic in __rx_handlers__:
-                    method_cls, method = __rx_handlers__[topic]
-                    method(msg)
-                else:
-                    log.error(
-                        "Unhandled peripheral message type received: %s" % topic)
-
-            elif topic.startswith("Interrupt.Trigger"):
-                log.info("Triggering Interrupt %s" % msg['num'])
-                trigger_interrupt(msg['num'])
-            elif topic.startswith("Interrupt.Base"):
-                log.info("Setting Vector Base Addr %s" % msg['num'])
-                __qemu.set_vector_table_base(msg['base'])
-            else:
-                log.error("Unhandled topic received: %s" % topic)
+            dispatch(topic, msg)
     log.info("Peripheral Server Shutdown Normally")
 
 
+def dispatch(topic, msg):
+    '''
+        Handles msg as if received on topic, used by run_server and to
+        deliver input without an IO server (see hal_persistent)
+    '''
+    if topic.startswith("Peripheral"):
+        if topic in __rx_handlers__:
+            method_cls, method = __rx_handlers__[topic]
+            method(msg)
+        else:
+            log.error(
+                "Unhandled peripheral message type received: %s" % topic)
+
+    elif topic.startswith("Interrupt.Trigger"):
+        log.info("Triggering Interrupt %s" % msg['num'])
+        trigger_interrupt(msg['num'])
+    elif topic.startswith("Interrupt.Base"):
+        log.info("Setting Vector Base Addr %s" % msg['num'])
+        __qemu.set_vector_table_base(msg['base'])
+    else:
+        log.error("Unhandled topic received: %s" % topic)
+
+
 def stop():
     global __process
     global __stop_server
     __stop_server = True
+    if __irq_dispatcher is not None:
+        __irq_dispatcher.stop()
+        log.info("Interrupts: %s" % {k: v for k, v in
+                                     __irq_dispatcher.stats().items()
+                                     if k != 'irqs'})
     # __process.join()
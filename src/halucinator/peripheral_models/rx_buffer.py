@@ -0,0 +1,85 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+from threading import Condition, Lock
+
+
+class RxBuffer(object):
+    '''
+        Byte FIFO filled by the peripheral server thread and read by
+        bp_handlers.  Blocking reads wait on a condition variable until
+        enough data arrives (or timeout) instead of spinning.
+    '''
+    def __init__(self):
+        self._data = bytearray()
+        self._start = 0  # Index of first unread byte in _data
+        self._cond = Condition()
+
+    def __getstate__(self):
+        # Condition can't be pickled (hal_snapshot), a new one is made
+        with self._cond:
+            return {'_data': bytes(self._data[self._start:])}
+
+    def __setstate__(self, state):
+        self._data = bytearray(state['_data'])
+        self._start = 0
+        self._cond = Condition()
+
+    def __len__(self):
+        return len(self._data) - self._start
+
+    def extend(self, data):
+        '''
+            Adds data (bytes, or str which is utf-8 encoded) and wakes
+            blocked readers
+        '''
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self._cond:
+            self._data += data
+            self._cond.notify_all()
+
+    def read(self, count, block=False, timeout=None, until=None):
+        '''
+            Removes and returns up to count bytes
+
+            :param block:   Wait for count bytes (or until) to be available
+            :param timeout: Max seconds to block, None waits forever
+            :param until:   Byte string, if present read stops after it
+            :returns bytes, may be shorter than count if not blocking or timed out
+        '''
+        with self._cond:
+            if block:
+                self._cond.wait_for(
+                    lambda: len(self) >= count or self._find(until, count) >= 0,
+                    timeout)
+            num = min(count, len(self))
+            idx = self._find(until, num)
+            if idx >= 0:
+                num = idx + len(until) - self._start
+            end = self._start + num
+            chars = bytes(self._data[self._start:end])
+            self._start = end
+            # Compact once the consumed prefix dominates the buffer
+            if self._start > 4096 and self._start * 2 > len(self._data):
+                del self._data[:self._start]
+                self._start = 0
+            return chars
+
+    def _find(self, until, count):
+        if until is None:
+            return -1
+        return self._data.find(until, self._start, self._start + count)
+
+
+class RxBuffers(dict):
+    '''
+        Dict of id: RxBuffer, a missing buffer is created under a lock so
+        the handler and peripheral server threads get the same one
+    '''
+    _lock = Lock()
+
+    def __missing__(self, key):
+        with self._lock:
+            return self.setdefault(key, RxBuffer())
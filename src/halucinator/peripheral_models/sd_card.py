@@ -4,8 +4,10 @@
 
 from .peripheral import requires_tx_map, requires_rx_map, requires_interrupt_map
 from . import peripheral_server
+from .block_device import MmapBlockDevice, OverlayBlockDevice
 from collections import defaultdict
 import os
+import atexit
 import logging
 log = logging.getLogger(__name__)
 
@@ -16,17 +18,30 @@ log = logging.getLogger(__name__)
 @peripheral_server.peripheral_model
 class SDCardModel(object):
     STATES = {'READY': 1}
+    DEFAULT_BLOCK_SIZE = 0x200
     BLOCK_SIZE = {}
     filename = {}
+    devices = {}
+    base_images = {}  # sd_id: shared base image, used copy-on-write
+    default_base_image = None
 
     @classmethod
-    def set_config(cls, sd_id, filename, block_size):
-        cls.BLOCK_SIZE[sd_id] = 0x200
+    def set_config(cls, sd_id, filename, block_size, base_image=None):
+        '''
+            :param base_image: If set the card reads from this image and
+                writes go to a per instance overlay (filename + '.cow'),
+                the base image is never modified
+        '''
+        cls.BLOCK_SIZE[sd_id] = block_size if block_size else cls.DEFAULT_BLOCK_SIZE
+        if base_image is not None:
+            cls.base_images[sd_id] = base_image
+        if sd_id in cls.devices:
+            cls.devices[sd_id].block_size = cls.BLOCK_SIZE[sd_id]
         if filename is not None:
-            if peripheral_server.base_dir is not None:
+            if peripheral_server.output_directory is not None:
                 log.info("Setting File name using output dir")
                 cls.filename[sd_id] = os.path.join(
-                    peripheral_server.base_dir, filename)
+                    peripheral_server.output_directory, filename)
             else:
                 log.info("No output found dir")
                 cls.filename[sd_id] = filename
@@ -34,27 +49,50 @@ class SDCardModel(object):
     @classmethod
     def get_filename(cls, sd_id):
         if sd_id not in cls.filename:
-            if peripheral_server.base_dir is not None:
+            if peripheral_server.output_directory is not None:
                 cls.filename[sd_id] = os.path.join(
-                    peripheral_server.base_dir, "sd_card_%s.bin" % str(sd_id))
+                    peripheral_server.output_directory, "sd_card_%s.bin" % str(sd_id))
             else:
                 cls.filename[sd_id] = "sd_card_%s.bin" % str(sd_id)
 
         return cls.filename[sd_id]
 
+    @classmethod
+    def get_device(cls, sd_id):
+        '''
+            Returns the MmapBlockDevice for sd_id, opening it on first use
+        '''
+        if sd_id not in cls.devices:
+            if not cls.devices:
+                atexit.register(cls.close)
+            base_image = cls.base_images.get(sd_id, cls.default_base_image)
+            if base_image is not None:
+                log.info("SD %s: %s copy-on-write" % (sd_id, base_image))
+                cls.devices[sd_id] = OverlayBlockDevice(
+                    base_image, cls.get_filename(sd_id) + '.cow',
+                    cls.get_block_size(sd_id))
+            else:
+                cls.devices[sd_id] = MmapBlockDevice(cls.get_filename(sd_id),
+                                                     cls.get_block_size(sd_id))
+        return cls.devices[sd_id]
+
     @classmethod
     def read_block(cls, sd_id, block_num):
         '''
             Reads data from the file, and returns the data if possible 
             return None
         '''
-        data = None
-        with open(cls.get_filename(sd_id), 'rb') as f:
-            addr = block_num * SDCardModel.BLOCK_SIZE[sd_id]
-            log.info("SDCardModle Reading: %s" % hex(addr))
-            f.seek(addr)
-            data = f.read(SDCardModel.BLOCK_SIZE[sd_id])
-        return data
+        return bytes(cls.read_blocks(sd_id, block_num, 1))
+
+    @classmethod
+    def read_blocks(cls, sd_id, block_num, count):
+        '''
+            Reads count contiguous blocks as a single slice
+
+            :returns memoryview (or bytes) of count * block size bytes
+        '''
+        log.info("SDCardModel Reading: block %i, count %i" % (block_num, count))
+        return cls.get_device(sd_id).read_blocks(block_num, count)
 
     @classmethod
     @requires_tx_map
@@ -63,21 +101,30 @@ class SDCardModel(object):
             Writes the data to a file, and returns True if no errors else 
             return False
         '''
-        filename = cls.get_filename(sd_id)
-        if not os.path.exists(filename):
-            with open(filename, 'wb') as f:
-                pass  # Create the file
-        with open(filename, 'rb+') as f:
-            addr = block_num * SDCardModel.BLOCK_SIZE[sd_id]
-            log.info("SDCardModle Writeing: %s" % hex(addr))
-            f.seek(addr)
-            f.write(data)
-            return True
-        return False
+        return cls.write_blocks(sd_id, block_num, data)
+
+    @classmethod
+    @requires_tx_map
+    def write_blocks(cls, sd_id, block_num, data):
+        '''
+            Writes data, one or more contiguous blocks, starting at block_num
+        '''
+        log.info("SDCardModel Writing: block %i, len %i" % (block_num, len(data)))
+        return cls.get_device(sd_id).write_blocks(block_num, data)
+
+    @classmethod
+    def close(cls):
+        '''
+            Flushes and closes all the SD card images
+        '''
+        for device in cls.devices.values():
+            device.close()
+        cls.devices.clear()
 
     @classmethod
     def get_block_size(cls, sd_id):
-        return SDCardModel.BLOCK_SIZE[sd_id]
+        # Default used if set_config not called (e.g., init intercepts inlined)
+        return SDCardModel.BLOCK_SIZE.get(sd_id, SDCardModel.DEFAULT_BLOCK_SIZE)
 
     @classmethod
     @requires_rx_map
@@ -4,6 +4,7 @@
 
 
 from . import peripheral_server
+from .rx_buffer import RxBuffers
 # from queue import Queue
 from threading import Event, Thread
 from collections import deque, defaultdict
@@ -49,7 +50,7 @@ class UARTModel(object):
 # Register the pub/sub calls and methods that need mapped
 @peripheral_server.peripheral_model
 class SPIPublisher(object):
-    rx_buffers = defaultdict(deque)
+    rx_buffers = RxBuffers()
 
     @classmethod
     @peripheral_server.tx_msg
@@ -58,32 +59,23 @@ class SPIPublisher(object):
            Publishes the data to sub/pub server
         '''
         log.debug("In: SPIPublisher.write")
-        msg = {'id': uart_id, 'chars': chars}
+        msg = {'id': spi_id, 'chars': chars}
         return msg
 
     @classmethod
-    def read(cls, spi_id, count=1, block=False):
+    def read(cls, spi_id, count=1, block=False, timeout=None):
         '''
             Gets data previously received from the sub/pub server
             Args:
                 spi_id:   A unique id for the spi
                 count:  Max number of chars to read
                 block(bool): Block if data is not available
+                timeout: Max seconds to block, None blocks until available
         '''
         log.debug("In: SPIPublisher.read id:%s count:%i, block:%s" %
                   (hex(spi_id), count, str(block)))
-        while block and (len(cls.rx_buffers[spi_id]) < count):
-            pass
+        chars = cls.rx_buffers[spi_id].read(count, block, timeout)
         log.debug("Done Blocking: SPIPublisher.read")
-        buffer = cls.rx_buffers[spi_id]
-        chars_available = len(buffer)
-        if chars_available >= count:
-            chars = list(map(apply, repeat(buffer.popleft, count)))
-            chars = ''.join(chars)
-        else:
-            chars = list(map(apply, repeat(buffer.popleft, chars_available)))
-            chars = ''.join(chars)
-
         return chars
 
     @classmethod
@@ -1,36 +1,99 @@
-# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS). 
-# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains 
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
 # certain rights in this software.
 
 from . import peripheral_server
-from collections import deque, defaultdict
 from .interrupts import Interrupts
-from threading import Thread, Event
+from .. import hal_clock
+from threading import Thread, Condition
+import heapq
+import itertools
 import logging
-import time
 log = logging.getLogger(__name__)
 
 
+class Timer(object):
+    '''
+        State of one timer, scheduled by TimerModel
+    '''
+    def __init__(self, name, irq_num, rate, periodic=True):
+        self.name = name
+        self.irq_num = irq_num
+        self.rate = rate
+        self.periodic = periodic
+        self.deadline = None
+        self.fired = 0
+        self.missed = 0  # Periods skipped because the scheduler fell behind
+
 
 # Register the pub/sub calls and methods that need mapped
 @peripheral_server.peripheral_model
 class TimerModel(object):
+    '''
+        Fires interrupts for all timers from a single scheduler thread.
+        Deadlines are kept in a min heap, timers due within the same tick
+        are fired together and an irq shared by several of them is only
+        triggered once.  With a virtual hal_clock there is no thread,
+        timers fire when the clock is advanced past their deadline.
+    '''
+    active_timers = {}  # name: Timer
+    tick = 0.001        # Timers due within this many seconds fire together
+    _heap = []          # (deadline, seq, Timer)
+    _seq = itertools.count()
+    _cond = Condition()
+    _thread = None
+    _running = False
 
-    active_timers = {}
     @classmethod
-    def start_timer(cls, name, isr_num, rate):
+    def start_timer(cls, name, isr_num, rate, periodic=True):
+        '''
+            Starts timer name which triggers isr_num every rate seconds
+            (once after rate seconds if not periodic).  Does nothing if
+            the timer is already running, use set_rate to change it.
+        '''
+        cls._check_rate(rate)
         log.info("Starting timer: %s" % name)
-        if name not in cls.active_timers:
-            stop_event = Event()
-            t = TimerIRQ(stop_event, name, isr_num, rate)
-            cls.active_timers[name] = (stop_event, t)
-            t.start()
+        with cls._cond:
+            if name in cls.active_timers:
+                return
+            timer = Timer(name, isr_num, rate, periodic)
+            cls.active_timers[name] = timer
+            cls._schedule(timer, hal_clock.now() + rate)
+            cls._start_scheduler()
 
     @classmethod
     def stop_timer(cls, name):
-        if name in cls.active_timers:
-            (stop_event, t) = cls.active_timers[name]
-            stop_event.set()
+        with cls._cond:
+            # Heap entries for removed timers are dropped when popped
+            timer = cls.active_timers.pop(name, None)
+            if timer is not None:
+                timer.deadline = None
+                cls._cond.notify()
+
+    @classmethod
+    def set_rate(cls, name, rate):
+        '''
+            Changes the period of a running timer, the next fire is rate
+            seconds after the previous one (or now if that has passed)
+        '''
+        cls._check_rate(rate)
+        with cls._cond:
+            timer = cls.active_timers.get(name)
+            if timer is None:
+                return False
+            last = timer.deadline - timer.rate
+            timer.rate = rate
+            cls._schedule(timer, max(last + rate, hal_clock.now()))
+            return True
+
+    @staticmethod
+    def _check_rate(rate):
+        if not rate > 0:
+            raise ValueError("Timer rate must be > 0, got %s" % rate)
+
+    @classmethod
+    def is_running(cls, name):
+        return name in cls.active_timers
 
     @classmethod
     def clear_timer(cls, irq_name):
@@ -39,21 +102,136 @@ class TimerModel(object):
 
     @classmethod
     def shutdown(cls):
-        for key, (stop_event, t) in list(cls.active_timers.items()):
-            stop_event.set()
+        with cls._cond:
+            cls._running = False
+            cls.active_timers.clear()
+            cls._heap[:] = []
+            cls._cond.notify()
+            thread = cls._thread
+            cls._thread = None
+        if thread is not None:
+            thread.join()
 
+    @classmethod
+    def snapshot_state(cls):
+        '''
+            Running timers and the time until they next fire, for hal_snapshot
+        '''
+        now = hal_clock.now()
+        with cls._cond:
+            return {name: (t.irq_num, t.rate, t.periodic,
+                           max(t.deadline - now, 0))
+                    for name, t in cls.active_timers.items()}
+
+    @classmethod
+    def restore_state(cls, state):
+        '''
+            Replaces the running timers with those from snapshot_state
+        '''
+        with cls._cond:
+            for timer in cls.active_timers.values():
+                timer.deadline = None
+            cls.active_timers.clear()
+            cls._heap[:] = []
+            for name, (irq_num, rate, periodic, remaining) in state.items():
+                timer = Timer(name, irq_num, rate, periodic)
+                cls.active_timers[name] = timer
+                cls._schedule(timer, hal_clock.now() + remaining)
+            if state:
+                cls._start_scheduler()
+
+    @classmethod
+    def _schedule(cls, timer, deadline):
+        timer.deadline = deadline
+        heapq.heappush(cls._heap, (deadline, next(cls._seq), timer))
+        cls._cond.notify()
+
+    @classmethod
+    def _start_scheduler(cls):
+        if cls._thread is None and not hal_clock.is_virtual():
+            cls._running = True
+            cls._thread = Thread(target=cls._run, daemon=True,
+                                 name="TimerModel")
+            cls._thread.start()
+
+    @classmethod
+    def _wait_due(cls):
+        '''
+            Waits for the next deadline, then returns the due timers.
+            Called with _cond held.
+        '''
+        while cls._running:
+            # Drop entries for stopped or rescheduled timers
+            while cls._heap and cls._heap[0][2].deadline != cls._heap[0][0]:
+                heapq.heappop(cls._heap)
+            if not cls._heap:
+                cls._cond.wait()
+                continue
+            now = hal_clock.now()
+            if cls._heap[0][0] > now:
+                cls._cond.wait(cls._heap[0][0] - now)
+                continue
+            return cls._pop_due(now)
+        return []
+
+    @classmethod
+    def _pop_due(cls, now):
+        '''
+            Removes and returns every timer due within a tick of now and
+            reschedules the periodic ones.  Called with _cond held.
+        '''
+        due = []
+        while cls._heap and cls._heap[0][0] <= now + cls.tick:
+            deadline, _, timer = heapq.heappop(cls._heap)
+            if timer.deadline == deadline:
+                due.append(timer)
+        for timer in due:
+            timer.fired += 1
+            if timer.periodic:
+                next_time = timer.deadline + timer.rate
+                if next_time <= now:
+                    # Behind, skip the missed periods instead of bursting
+                    missed = int((now - timer.deadline) / timer.rate)
+                    timer.missed += missed
+                    next_time += missed * timer.rate
+                cls._schedule(timer, next_time)
+            else:
+                del cls.active_timers[timer.name]
+                timer.deadline = None
+        return due
+
+    @classmethod
+    def _fire(cls, due):
+        irqs = []
+        for timer in due:
+            Interrupts.set_active(timer.name)
+            if timer.irq_num not in irqs:
+                irqs.append(timer.irq_num)
+        for irq_num in irqs:
+            log.info("Sending IRQ: %s" % irq_num)
+            try:
+                Interrupts.trigger_interrupt(irq_num)
+            except Exception:
+                log.exception("Failed to trigger IRQ %s" % irq_num)
+
+    @classmethod
+    def clock_advanced(cls, now):
+        '''
+            hal_clock listener, fires timers due at virtual time now
+        '''
+        with cls._cond:
+            due = cls._pop_due(now)
+        if due:
+            cls._fire(due)
+
+    @classmethod
+    def _run(cls):
+        while True:
+            with cls._cond:
+                due = cls._wait_due()
+                if not cls._running:
+                    return
+            cls._fire(due)
 
-class TimerIRQ(Thread):
-    def __init__(self, event, irq_name, irq_num, rate):
-        Thread.__init__(self)
-        self.stopped = event
-        self.name = irq_name
-        self.irq_num = irq_num
-        self.rate = rate
 
-    def run(self):
-        while not self.stopped.wait(self.rate):
-            log.info("Sending IRQ: %s" % self.irq_num)
-            Interrupts.set_active(self.name)
-            Interrupts.trigger_interrupt(self.irq_num)
-            # call a function
+hal_clock.add_listener(TimerModel.clock_advanced)
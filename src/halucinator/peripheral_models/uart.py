@@ -3,6 +3,7 @@
 # certain rights in this software.
 
 from . import peripheral_server
+from .rx_buffer import RxBuffers
 #from queue import Queue
 from threading import Event, Thread
 from collections import deque, defaultdict
@@ -17,7 +18,7 @@ log = logging.getLogger(__name__)
 # Register the pub/sub calls and methods that need mapped
 @peripheral_server.peripheral_model
 class UARTPublisher(object):
-    rx_buffers = defaultdict(deque)
+    rx_buffers = RxBuffers()
 
     @classmethod
     @peripheral_server.tx_msg
@@ -30,63 +31,40 @@ class UARTPublisher(object):
         return msg
 
     @classmethod
-    def read(cls, uart_id, count=1, block=False):
+    def read(cls, uart_id, count=1, block=False, timeout=None):
         '''
             Gets data previously received from the sub/pub server
             Args:
                 uart_id:   A unique id for the uart
                 count:  Max number of chars to read
                 block(bool): Block if data is not available
+                timeout: Max seconds to block, None blocks until available
         '''
         log.debug("In: UARTPublisher.read id:%s count:%i, block:%s" %
                   (hex(uart_id), count, str(block)))
-        while block and (len(cls.rx_buffers[uart_id]) < count):
-            pass
+        chars = cls.rx_buffers[uart_id].read(count, block, timeout)
         log.debug("Done Blocking: UARTPublisher.read")
-        buffer = cls.rx_buffers[uart_id]
-        chars_available = len(buffer)
-        if chars_available >= count:
-            chars = [buffer.popleft() for _ in range(count)]
-            chars = ''.join(chars).encode('utf-8')
-        else:
-            chars = [buffer.popleft() for _ in range(chars_available)]
-            chars = ''.join(chars).encode('utf-8')
-
         log.info("Reading %s"% chars)
         return chars
 
     @classmethod
-    def read_line(cls, uart_id, count=1, block=False):
+    def read_line(cls, uart_id, count=1, block=False, timeout=None):
         '''
-            Gets data previously received from the sub/pub server
+            Gets data previously received from the sub/pub server, stops
+            after a newline
             Args:
                 uart_id:   A unique id for the uart
                 count:  Max number of chars to read
                 block(bool): Block if data is not available
+                timeout: Max seconds to block, None blocks until available
         '''
         log.debug("In: UARTPublisher.read id:%s count:%i, block:%s" %
                   (hex(uart_id), count, str(block)))
-        while block and (len(cls.rx_buffers[uart_id]) < count) :
-            if len(cls.rx_buffers[uart_id]) > 0:
-                if cls.rx_buffers[uart_id][-1] == '\n':
-                    break
-
+        chars = cls.rx_buffers[uart_id].read(count, block, timeout, until=b'\n')
         log.debug("Done Blocking: UARTPublisher.read")
-        log.debug("rx_buffers %s" % cls.rx_buffers[uart_id])
-        buffer = cls.rx_buffers[uart_id]
-        chars_available = len(buffer)
-        if chars_available >= count:
-            #chars = list(map(apply, repeat(buffer.popleft, count)))
-            chars = [buffer.popleft() for _ in range(count)]
-            chars = ''.join(chars).encode('utf-8')
-        else:
-            chars = [buffer.popleft() for _ in range(chars_available)]
-            chars = ''.join(chars).encode('utf-8')
-
         log.info("Reading %s"% chars)
         return chars
 
-
     @classmethod
     @peripheral_server.reg_rx_handler
     def rx_data(cls, msg):
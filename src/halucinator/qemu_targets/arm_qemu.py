@@ -4,6 +4,46 @@
 
 
 from avatar2 import Avatar, QemuTarget
+from avatar2.protocols.gdb import GDB_PROT_DONE
+from binascii import hexlify
+import struct
+import logging
+log = logging.getLogger(__name__)
+
+
+class MemoryTransaction(object):
+    '''
+        Collects writes to the target and issues them as a single scatter
+        write when flushed (or the with block exits).
+
+        Usage:
+            with qemu.memory_transaction() as txn:
+                txn.write(addr, data)
+                txn.write_struct(addr2, '<II', a, b)
+    '''
+    def __init__(self, target):
+        self.target = target
+        self.writes = []
+
+    def write(self, address, data):
+        self.writes.append((address, bytes(data)))
+
+    def write_struct(self, address, fmt, *values):
+        self.writes.append((address, struct.pack(fmt, *values)))
+
+    def flush(self):
+        writes = self.writes
+        self.writes = []
+        self.target.write_memory_scatter(writes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        return False
+
 
 class ARMQemuTarget(QemuTarget):
     '''
@@ -13,6 +53,115 @@ class ARMQemuTarget(QemuTarget):
     '''
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._reg_snapshot = None
+        self._dirty_regs = {}
+        self.bytes_moved = 0  # Memory read/written, used by hal_profile
+
+    def _register_numbers(self):
+        '''
+            Returns dict of {register_name: gdb register number} for all
+            registers that can be read using -data-list-register-values
+        '''
+        special = getattr(self.avatar.arch, 'special_registers', {})
+        return {name: nr for name, nr in self.regs.__dict__.items()
+                if name != '_target' and name not in special}
+
+    def snapshot_registers(self):
+        '''
+            Reads the whole register file in a single GDB request. Until the
+            target is resumed all register reads are served from the snapshot
+            and writes are buffered, then written back by flush_registers.
+
+            :returns True if snapshot was taken
+        '''
+        self._reg_snapshot = None
+        self._dirty_regs = {}
+        nr2name = {nr: name for name, nr in self._register_numbers().items()}
+        request = ["-data-list-register-values", "x"] + \
+                  ["%d" % nr for nr in sorted(nr2name)]
+        ret, resp = self.protocols.registers._sync_request(request,
+                                                           GDB_PROT_DONE)
+        if not ret:
+            log.warning("Register snapshot failed, response: %s" % resp)
+            return False
+
+        snapshot = {}
+        for entry in resp['payload']['register-values']:
+            name = nr2name.get(int(entry['number']))
+            try:
+                if name is not None:
+                    snapshot[name] = int(entry['value'], 16)
+            except ValueError:
+                # e.g. <unavailable>, will be read individually if used
+                pass
+        self._reg_snapshot = snapshot
+        return True
+
+    def flush_registers(self):
+        '''
+            Writes registers modified since snapshot_registers back to the
+            target and discards the snapshot.  Several registers are
+            written in a single GDB request as one comma expression
+            ($r0=..,$pc=..), evaluated left to right in write order.
+        '''
+        dirty = self._dirty_regs
+        self._reg_snapshot = None
+        self._dirty_regs = {}
+        if len(dirty) > 1:
+            expr = ",".join("$%s=%#x" % (reg, value)
+                            for reg, value in dirty.items())
+            ret, resp = self.protocols.registers._sync_request(
+                ["-data-evaluate-expression", expr], GDB_PROT_DONE)
+            if ret:
+                return
+            log.debug("Batched register write failed, response: %s" % resp)
+        for reg, value in dirty.items():
+            super().write_register(reg, value)
+
+    def read_registers(self):
+        '''
+            :returns dict of {register_name: value} for the whole register
+                     file, read in a single GDB request if not snapshotted
+        '''
+        if self._reg_snapshot is None and not self.snapshot_registers():
+            return {name: super(ARMQemuTarget, self).read_register(name)
+                    for name in self._register_numbers()}
+        return dict(self._reg_snapshot)
+
+    def write_registers(self, registers, last=('sp', 'pc')):
+        '''
+            Writes dict of {register_name: value}, the registers in last are
+            written after all others in the given order
+        '''
+        for name, value in registers.items():
+            if name not in last:
+                self.write_register(name, value)
+        for name in last:
+            if name in registers:
+                self.write_register(name, registers[name])
+
+    def read_register(self, register):
+        if self._reg_snapshot is not None and register in self._reg_snapshot:
+            return self._reg_snapshot[register]
+        return super().read_register(register)
+
+    def write_register(self, register, value):
+        if self._reg_snapshot is not None and register in self._reg_snapshot:
+            if self._reg_snapshot[register] == value and \
+                    register not in self._dirty_regs:
+                return True  # Unchanged, nothing to write back
+            self._reg_snapshot[register] = value
+            self._dirty_regs[register] = value
+            return True
+        return super().write_register(register, value)
+
+    def cont(self, blocking=True):
+        self.flush_registers()
+        return super().cont(blocking=blocking)
+
+    def step(self, blocking=True):
+        self.flush_registers()
+        return super().step(blocking=blocking)
 
     def get_arg(self, idx):
         '''
@@ -47,6 +196,134 @@ class ARMQemuTarget(QemuTarget):
         else:
             raise ValueError(idx)
 
+    def read_memory(self, address, size, num_words=1, raw=False):
+        self.bytes_moved += size * num_words
+        return super().read_memory(address, size, num_words, raw)
+
+    def write_memory(self, address, size, value, num_words=1, raw=False):
+        self.bytes_moved += size * num_words
+        return super().write_memory(address, size, value, num_words, raw)
+
+    def _is_forwarded(self, address):
+        '''
+            True if address is in a memory range forwarded to python
+            (these can't be accessed directly through gdb)
+        '''
+        try:
+            mem_range = self.avatar.get_memory_range(address)
+        except Exception:
+            return False
+        return mem_range is not None and mem_range.forwarded is True and \
+            mem_range.forwarded_to != self
+
+    def read_memory_bulk(self, address, size):
+        '''
+            Reads size bytes in a single request, unlike read_memory which
+            splits reads into 256 byte requests
+
+            :returns bytes
+        '''
+        if size == 0:
+            return b''
+        if self._is_forwarded(address):
+            return self.read_memory(address, 1, size, raw=True)
+        ret, resp = self.protocols.memory._sync_request(
+            ["-data-read-memory-bytes", str(address), str(size)],
+            GDB_PROT_DONE)
+        if not ret:
+            raise Exception("Failed to read memory! %#x, %i" % (address, size))
+        self.bytes_moved += size
+        return b''.join(bytes.fromhex(m['contents'])
+                        for m in resp['payload']['memory'])
+
+    def write_memory_bulk(self, address, data):
+        '''
+            Writes data (bytes) in a single request
+        '''
+        if not data:
+            return True
+        if self._is_forwarded(address):
+            return self.write_memory(address, 1, data, len(data), raw=True)
+        self.bytes_moved += len(data)
+        ret, resp = self.protocols.memory._sync_request(
+            ["-data-write-memory-bytes", str(address),
+             hexlify(data).decode('ascii')], GDB_PROT_DONE)
+        return ret
+
+    def read_memory_gather(self, regions, max_gap=64):
+        '''
+            Reads multiple regions, regions that are adjacent or within
+            max_gap bytes of each other are combined into a single request
+
+            :param regions: list of (address, size)
+            :returns list of bytes, in order of regions
+        '''
+        order = sorted(range(len(regions)), key=lambda i: regions[i][0])
+        spans = []  # [start, end, [region indexes]]
+        for idx in order:
+            addr, size = regions[idx]
+            if spans and addr <= spans[-1][1] + max_gap and \
+               not self._is_forwarded(addr):
+                spans[-1][1] = max(spans[-1][1], addr + size)
+                spans[-1][2].append(idx)
+            else:
+                spans.append([addr, addr + size, [idx]])
+
+        results = [None] * len(regions)
+        for start, end, idxs in spans:
+            data = self.read_memory_bulk(start, end - start)
+            for idx in idxs:
+                addr, size = regions[idx]
+                results[idx] = data[addr - start: addr - start + size]
+        return results
+
+    def write_memory_scatter(self, writes):
+        '''
+            Writes multiple regions, contiguous or overlapping writes are
+            combined into a single request. Later writes take precedence.
+
+            :param writes: list of (address, bytes)
+        '''
+        spans = []  # (start, bytearray), kept disjoint
+        for addr, data in writes:
+            start, end = addr, addr + len(data)
+            overlapping = [s for s in spans
+                           if s[0] <= end and start <= s[0] + len(s[1])]
+            for s_start, s_buf in overlapping:
+                start = min(start, s_start)
+                end = max(end, s_start + len(s_buf))
+            merged = bytearray(end - start)
+            for s_start, s_buf in overlapping:
+                merged[s_start - start:s_start - start + len(s_buf)] = s_buf
+            merged[addr - start:addr - start + len(data)] = data
+            spans = [s for s in spans
+                     if not any(s is o for o in overlapping)]
+            spans.append((start, merged))
+        ret = True
+        for start, buf in spans:
+            ret &= bool(self.write_memory_bulk(start, bytes(buf)))
+        return ret
+
+    def read_struct(self, address, fmt):
+        '''
+            Reads and unpacks a structure in a single request
+
+            :param fmt: struct module format string e.g. '<IIHH'
+            :returns tuple of values
+        '''
+        return struct.unpack(fmt, self.read_memory_bulk(address,
+                                                        struct.calcsize(fmt)))
+
+    def write_struct(self, address, fmt, *values):
+        return self.write_memory_bulk(address, struct.pack(fmt, *values))
+
+    def memory_transaction(self):
+        '''
+            Returns a MemoryTransaction, writes are deferred until it is
+            flushed
+        '''
+        return MemoryTransaction(self)
+
     def get_ret_addr(self):
         '''
             Gets the return address for the function call
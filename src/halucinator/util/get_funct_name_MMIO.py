@@ -3,15 +3,15 @@
 # certain rights in this software.
 
 import os
-import yaml
 from collections import defaultdict
 from elf_sym_hal_getter import build_addr_to_sym_lookup
+from halucinator.hal_stats import load_stats
 
 
 def get_names_for_addrs(stats_file, binary):
 
-    with open(stats_file, 'rb') as infile:
-        stats = yaml.safe_load(infile)
+    # MMIO_addr_pc may be in a separate append only file
+    stats = load_stats(stats_file)
 
     sym_lut = build_addr_to_sym_lookup(binary)
 
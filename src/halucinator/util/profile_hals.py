@@ -3,18 +3,58 @@
 # certain rights in this software.
 
 import yaml
-from avatar2 import Avatar, GDBTarget, ARM_CORTEX_M3, TargetStates
 import logging
 import os
-from IPython import embed
 import sqlite3
 import hashlib
 import pickle
+import zlib
+from queue import Queue
+from threading import Thread
 from collections import deque, defaultdict
 
 
+PAGE_SIZE = 4096
+BATCH_SIZE = 256
+RUN_ID_SHIFT = 32  # State ids are run_id << RUN_ID_SHIFT | sequence
+
+
+def load_memory(db, state_id):
+    '''
+        Rebuilds the memory saved with a state, from the pages saved by the
+        states of the same run up to it.  States written before states had
+        a run_id keep their pickled memory.
+
+        :param db: sqlite3 connection to a State_Recorder database
+        :returns dict of {addr: bytes}
+    '''
+    run_id, memory = db.execute("SELECT run_id, memory FROM states WHERE id == ?",
+                                (state_id,)).fetchone()
+    if memory is not None:
+        return pickle.loads(memory)
+    pages = {}
+    for addr, data in db.execute('''SELECT sp.addr, p.data FROM state_pages sp
+                                      JOIN states s ON s.id = sp.state_id
+                                      JOIN pages p ON p.hash = sp.hash
+                                      WHERE s.run_id == ? AND sp.state_id <= ?
+                                      ORDER BY sp.state_id''', (run_id, state_id)):
+        pages[addr] = zlib.decompress(data)
+    return pages
+
+
 class State_Recorder(object):
+    '''
+        Records processor state on entry/exit of functions to sqlite.
 
+        Memory is stored as page level deltas: each state references only
+        the pages that changed since the previous state (state_pages), page
+        contents are stored once, zlib compressed and keyed by their sha1
+        (pages).  Use load_memory to rebuild the memory of a state.  Each
+        recorder is a run, its states have the run_id and their ids start
+        at run_id << RUN_ID_SHIFT so several recorders can share a
+        database.  Writes are done in batches by a background thread using
+        one WAL mode connection; call close to flush them.
+    '''
     def __init__(self, db_name, gdb, memories, elf_file):
 
         self.db_name = db_name
@@ -24,12 +64,23 @@ class State_Recorder(object):
         self.break_points = {}
         self.call_stack = deque()
         self.ret_addrs = defaultdict(deque)
+        self._page_hashes = {}  # addr: sha1 of page in last saved state
 
-        db = sqlite3.connect(self.db_name)
-        db.text_factory = bytes
-        self.create_sql_tables(db)
-        self.get_app_id(elf_file, db)
-        db.close()
+        self.db = sqlite3.connect(self.db_name, check_same_thread=False)
+        self.db.text_factory = bytes
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.create_sql_tables(self.db)
+        self.get_app_id(elf_file, self.db)
+        cursor = self.db.execute("INSERT INTO runs (app_id) VALUES (?)",
+                                 (self.app_id,))
+        self.db.commit()
+        self.run_id = cursor.lastrowid
+        self._next_id = (self.run_id << RUN_ID_SHIFT) + 1
+        self._queue = Queue()
+        self._writer = Thread(target=self._write_loop, name='State_Recorder',
+                              daemon=True)
+        self._writer.start()
 
     def add_function(self, function):
         # * on break point sets on first instruction, not first line of code from source
@@ -62,9 +113,27 @@ class State_Recorder(object):
         cursor.execute('''CREATE TABLE IF NOT EXISTS states (id INTEGER PRIMARY KEY,
                             app_id INTEGER, 
                             function_name TEXT,
-                            entry_id INTEGER,  memory BLOB, regs BLOB)''')
+                            entry_id INTEGER,  memory BLOB, regs BLOB,
+                            run_id INTEGER)''')
         # NOTE: Entry state records will have NULL entry_id's, Exits will reference
-        # the id of the entry state record
+        # the id of the entry state record. memory is NULL, see state_pages
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(states)")]
+        if b'run_id' not in columns and 'run_id' not in columns:
+            cursor.execute("ALTER TABLE states ADD COLUMN run_id INTEGER")
+        cursor.execute('''CREATE TABLE IF NOT EXISTS pages (hash TEXT PRIMARY KEY,
+                            data BLOB)''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS state_pages (
+                            state_id INTEGER, addr INTEGER, hash TEXT)''')
+        # One per recorder, the first state of a run has all pages, later
+        # states have only changed pages
+        cursor.execute('''CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY,
+                            app_id INTEGER)''')
+        cursor.execute('''CREATE INDEX IF NOT EXISTS state_pages_state
+                            ON state_pages (state_id)''')
+        cursor.execute('''CREATE INDEX IF NOT EXISTS states_function_name
+                            ON states (function_name)''')
+        cursor.execute('''CREATE INDEX IF NOT EXISTS states_entry_id
+                            ON states (entry_id)''')
         db.commit()
 
     def get_app_id(self, elf_file, db):
@@ -93,39 +162,94 @@ class State_Recorder(object):
             args:
                 bp_id(int): Break point id to look up entry_id, function
         '''
-        db = sqlite3.connect(self.db_name)
         memories, regs = self.get_state()
-        mem = pickle.dumps(memories)
         regs = pickle.dumps(regs)
-        c = db.cursor()
-        if is_entry:
-            c.execute('''INSERT INTO states (app_id, function_name, 
-                         memory, regs) VALUES(?,?,?,?)''', (self.app_id,
-                                                            function, mem, regs))
-        else:
+        entry_id = None
+        if not is_entry:
             func, entry_id = self.call_stack.pop()
             if func != function:
                 # TODO   Handle Tail calls
                 error_str = "Call stack is off: %s != %s" % (func, function)
                 raise ValueError(error_str)
 
-            c.execute('''INSERT INTO states (app_id, function_name, 
-                         memory, regs, entry_id) VALUES (?,?,?,?,?)''', (self.app_id,
-                                                                         function, mem, regs, entry_id))
-        db.commit()
-        record_id = c.lastrowid
-        db.close()
+        record_id = self._next_id
+        self._next_id += 1
+        changed = []
+        for start, data in memories.items():
+            for offset in range(0, len(data), PAGE_SIZE):
+                page = data[offset:offset + PAGE_SIZE]
+                digest = hashlib.sha1(page).hexdigest()
+                if self._page_hashes.get(start + offset) != digest:
+                    self._page_hashes[start + offset] = digest
+                    changed.append((start + offset, digest, page))
+        self._queue.put((record_id, function, entry_id, regs, changed))
         if is_entry:
             self.call_stack.append((function, record_id))
         return record_id
 
+    def _write_loop(self):
+        '''
+            Writes queued states, committing once per batch
+        '''
+        written = set()  # Page hashes known to be in the db
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get())
+            done = batch[-1] is None
+            cursor = self.db.cursor()
+            for item in batch:
+                if item is None:
+                    continue
+                record_id, function, entry_id, regs, changed = item
+                cursor.execute('''INSERT INTO states (id, app_id, function_name,
+                                  entry_id, regs, run_id) VALUES (?,?,?,?,?,?)''',
+                               (record_id, self.app_id, function, entry_id, regs,
+                                self.run_id))
+                for addr, digest, page in changed:
+                    if digest not in written:
+                        cursor.execute("INSERT OR IGNORE INTO pages (hash, data) VALUES (?,?)",
+                                       (digest, zlib.compress(page, 1)))
+                        written.add(digest)
+                cursor.executemany("INSERT INTO state_pages (state_id, addr, hash) VALUES (?,?,?)",
+                                   [(record_id, addr, digest)
+                                    for addr, digest, _ in changed])
+            self.db.commit()
+            if done:
+                break
+
+    def close(self):
+        '''
+            Writes all queued states and closes the database
+        '''
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        self.db.close()
+
+    def load_memory(self, state_id):
+        '''
+            Rebuilds the memory saved with a state, see load_memory
+
+            :returns dict of {page_addr: bytes}
+        '''
+        db = sqlite3.connect(self.db_name)
+        try:
+            return load_memory(db, state_id)
+        finally:
+            db.close()
+
     def get_state(self):
         '''
             Gets the processor state
         '''
         mems = {}
+        read_bulk = getattr(self.gdb, 'read_memory_bulk', None)
         for (start, size) in self.memories:
-            mems[start] = self.gdb.read_memory(start, 1, size, raw=True)
+            if read_bulk is not None:
+                mems[start] = read_bulk(start, size)
+            else:
+                mems[start] = self.gdb.read_memory(start, 1, size, raw=True)
 
         registers = {}
         for reg in self.gdb.avatar.arch.registers:
@@ -160,6 +284,7 @@ def handle_bp(avatar, message):
 
 if __name__ == '__main__':
     from argparse import ArgumentParser
+    from avatar2 import Avatar, GDBTarget, ARM_CORTEX_M3
     p = ArgumentParser()
     p.add_argument("-e", '--elf', required=True,
                    help='Elf file to profile')
@@ -194,6 +319,7 @@ if __name__ == '__main__':
     gdb.protocols.execution.console_command('load')
     gdb.protocols.execution.console_command('monitor reset')
     gdb.cont()
+    from IPython import embed
     embed()
     gdb.stop()
     avatar.shutdown()
@@ -0,0 +1,49 @@
+# Copyright 2019 National Technology & Engineering Solutions of Sandia, LLC (NTESS).
+# Under the terms of Contract DE-NA0003525 with NTESS, the U.S. Government retains
+# certain rights in this software.
+
+'''
+    Manages copy-on-write SD card overlays (<sd image>.cow files) created
+    when SDCardModel is given a base_image.
+
+    hal_sd_overlay info -b base.img -o tmp/run1/sd_card_0.bin.cow
+    hal_sd_overlay merge -b base.img -o tmp/run1/sd_card_0.bin.cow
+    hal_sd_overlay discard -b base.img -o tmp/run1/sd_card_0.bin.cow
+'''
+from ..peripheral_models.block_device import OverlayBlockDevice
+
+
+def main():
+    from argparse import ArgumentParser
+    p = ArgumentParser()
+    p.add_argument('command', choices=['info', 'merge', 'discard'],
+                   help='info: list blocks in overlay, merge: write overlay '
+                        'into base image and empty it, discard: empty overlay')
+    p.add_argument('-b', '--base', required=True,
+                   help='Base SD card image')
+    p.add_argument('-o', '--overlay', required=True,
+                   help='Overlay file')
+    p.add_argument('--block_size', default=0x200, type=int,
+                   help='Block size used if overlay is new')
+    args = p.parse_args()
+
+    overlay = OverlayBlockDevice(args.base, args.overlay, args.block_size)
+    try:
+        if args.command == 'info':
+            print("Block size: %i, Blocks in overlay: %i" %
+                  (overlay.block_size, len(overlay.blocks)))
+            print(" ".join(str(b) for b in sorted(overlay.blocks)))
+        elif args.command == 'merge':
+            num = len(overlay.blocks)
+            overlay.merge()
+            print("Merged %i blocks into %s" % (num, args.base))
+        elif args.command == 'discard':
+            num = len(overlay.blocks)
+            overlay.discard()
+            print("Discarded %i blocks" % num)
+    finally:
+        overlay.close()
+
+
+if __name__ == '__main__':
+    main()
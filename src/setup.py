@@ -32,13 +32,18 @@ setup(name='halucinator',
             'halucinator = halucinator.main:main',
             'qemulog2trace = tools.qemu_to_trace:main',
             'hal_make_addr= halucinator.util.elf_sym_hal_getter:main',
+            'hal_profile_report=halucinator.hal_profile:main',
+            'hal_sd_overlay=halucinator.util.sd_overlay:main',
             'hal_dev_uart=halucinator.external_devices.uart:main',
             'hal_dev_virt_hub=halucinator.external_devices.ethernet_virt_hub:main',
             'hal_dev_eth_wireless=halucinator.external_devices.ethernet_wireless:main',
             'hal_dev_host_eth=halucinator.external_devices.host_ethernet:main',
             'hal_dev_host_eth_server=halucinator.external_devices.host_ethernet_server:main',
             'hal_dev_802_15_4=halucinator.external_devices.IEEE802_15_4:main',
-            'hal_dev_irq_trigger=halucinator.external_devices.trigger_interrupt:main'
+            'hal_dev_irq_trigger=halucinator.external_devices.trigger_interrupt:main',
+            'halucinator-farm=halucinator.farm:main',
+            'hal_persistent=halucinator.hal_persistent:main',
+            'hal_import_time=tools.import_time:main'
         ]},
       requires=['avatar2',    
                 'zeromq',
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+'''
+    Startup import benchmark, guards against heavy dependencies creeping
+    back into halucinator's import path.
+
+    Runs python -X importtime -c "import <module>" several times and reports
+    the median total import time and the slowest modules.  Exits with 1 if
+    the median exceeds --max_ms or any --forbid module (by default the
+    optional IPython, scapy, angr and elftools) was imported.
+
+    hal_import_time -m halucinator.main --max_ms 800
+'''
+import argparse
+import statistics
+import subprocess
+import sys
+
+DEFAULT_FORBID = ('IPython', 'scapy', 'angr', 'elftools')
+
+
+def parse_importtime(stderr):
+    '''
+        :returns list of (module, self_us, cumulative_us), in import order.
+                 module is indented by two spaces per nesting level
+    '''
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # Header
+        records.append((fields[2][1:].rstrip(), int(fields[0]),
+                        int(fields[1])))
+    return records
+
+
+def _importtime(code, python):
+    proc = subprocess.run([python, '-X', 'importtime', '-c', code],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError("Running %s failed:\n%s" % (code, proc.stderr))
+    return parse_importtime(proc.stderr)
+
+
+def measure(module, python=sys.executable):
+    '''
+        Imports module in a fresh interpreter, modules imported by the
+        interpreter's startup are excluded
+
+        :returns (total_us, records)
+    '''
+    startup = set(name.strip() for name, _, _ in _importtime('pass', python))
+    records = [r for r in _importtime('import %s' % module, python)
+               if r[0].strip() not in startup]
+    # Top level imports are not indented, their cumulative times sum to total
+    total = sum(cum for name, _, cum in records if not name.startswith(' '))
+    return total, records
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('-m', '--module', default='halucinator.main',
+                   help='Module to import')
+    p.add_argument('-n', '--runs', default=5, type=int,
+                   help='Times to import, the median is reported')
+    p.add_argument('--top', default=15, type=int,
+                   help='Number of slowest modules to list')
+    p.add_argument('--max_ms', default=None, type=float,
+                   help='Fail if the median import time exceeds this')
+    p.add_argument('--forbid', action='append', default=None,
+                   help='Fail if this module is imported (default %s)' %
+                        ", ".join(DEFAULT_FORBID))
+    args = p.parse_args()
+
+    totals = []
+    records = []
+    for _ in range(args.runs):
+        total, records = measure(args.module)
+        totals.append(total)
+    median_ms = statistics.median(totals) / 1000.0
+
+    print("Import %s: median %.1f ms (min %.1f, max %.1f, %i runs)" % (
+        args.module, median_ms, min(totals) / 1000.0, max(totals) / 1000.0,
+        args.runs))
+    print("%10s %10s  %s" % ("self ms", "cum ms", "module"))
+    for name, self_us, cum_us in sorted(records, key=lambda r: -r[1])[:args.top]:
+        print("%10.1f %10.1f  %s" % (self_us / 1000.0, cum_us / 1000.0,
+                                     name.strip()))
+
+    failed = False
+    imported = set(name.strip() for name, _, _ in records)
+    forbid = args.forbid if args.forbid is not None else DEFAULT_FORBID
+    for module in forbid:
+        found = sorted(m for m in imported
+                       if m == module or m.startswith(module + '.'))
+        if found:
+            print("FAIL: %s imported (%s)" % (module, ", ".join(found[:3])))
+            failed = True
+    if args.max_ms is not None and median_ms > args.max_ms:
+        print("FAIL: %.1f ms exceeds %.1f ms" % (median_ms, args.max_ms))
+        failed = True
+    if failed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()